@@ -1,13 +1,17 @@
+import asyncio
 import json
 import logging
 import os
+import time
+import typing as t
 
 import boto3
+import httpx
 from s3fs.core import S3FileSystem
 from telethon.sessions import StringSession
 from telethon.sync import TelegramClient
 
-from openai import OpenAI
+from openai import AsyncOpenAI, AuthenticationError, DefaultAsyncHttpxClient
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
@@ -15,6 +19,18 @@ logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 client = boto3.client("secretsmanager")
 fs = S3FileSystem()
 
+OPENAI_SECRET_TTL = 15 * 60  # Seconds before the OpenAI key is read again to pick up a rotation
+OPENAI_MAX_CONNECTIONS = 20  # Connections in the pool of the shared OpenAI client
+OPENAI_KEEPALIVE_SECONDS = 300  # Idle connections survive this long between warm invocations
+
+# Shared by warm invocations of the same container
+_openai_client: t.Optional[AsyncOpenAI] = None
+_openai_key: t.Optional[str] = None
+_openai_loop: t.Optional[asyncio.AbstractEventLoop] = None
+_openai_checked_at = 0.0
+
+T = t.TypeVar("T")
+
 
 def get_telegram_client(user_id: int):
     """Authenticate with Telegram API and return client"""
@@ -50,13 +66,72 @@ def get_telegram_client(user_id: int):
     return tel_client, api_id, api_hash, bot_token
 
 
-def get_openai_client():
-    """Authenticate with OpenAI API and return client"""
-
+def _read_openai_key() -> str:
     secret_name = os.environ["OPENAI_SECRET"]
     response = client.get_secret_value(SecretId=secret_name)
     secret_value = json.loads(response.get("SecretString"))
-    logger.info("Authenticating with OpenAI API")
-
-    openai_client = OpenAI(api_key=secret_value.get("openai_api_key"))
-    return openai_client
+    return secret_value.get("openai_api_key")
+
+
+async def get_openai_client(refresh: bool = False) -> AsyncOpenAI:
+    """Return the container's OpenAI client, creating it on first use
+
+    The client and its keep-alive connection pool are reused by warm
+    invocations, so connection and TLS setup happen once per container. The
+    API key is read from Secrets Manager again every OPENAI_SECRET_TTL
+    seconds, or right away with `refresh`, and the client is rebuilt when the
+    key has rotated. Connections belong to the event loop they were opened
+    on, so a client is also rebuilt for a new loop.
+
+    Args:
+        refresh: Read the secret now, e.g. after an authentication error
+
+    Returns:
+        AsyncOpenAI: Shared client
+    """
+    global _openai_client, _openai_key, _openai_loop, _openai_checked_at
+
+    loop = asyncio.get_running_loop()
+    rotated = False
+    if refresh or _openai_key is None or time.monotonic() - _openai_checked_at > OPENAI_SECRET_TTL:
+        key = await asyncio.to_thread(_read_openai_key)
+        _openai_checked_at = time.monotonic()
+        rotated = key != _openai_key
+        _openai_key = key
+
+    if _openai_client is None or rotated or _openai_loop is not loop:
+        if _openai_client is not None and _openai_loop is loop:
+            await _openai_client.close()
+        logger.info("Authenticating with OpenAI API")
+        _openai_client = AsyncOpenAI(
+            api_key=_openai_key,
+            max_retries=0,  # Retried by llm_retry within the invocation's deadline
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_SECONDS,
+                )
+            ),
+        )
+        _openai_loop = loop
+    return _openai_client
+
+
+async def with_openai_client(call: t.Callable[[AsyncOpenAI], t.Awaitable[T]]) -> T:
+    """Run call with the shared OpenAI client, again with a fresh key if it is rejected
+
+    A key rotated since it was last read fails with an AuthenticationError;
+    the secret is read again and the call retried once with the new client.
+
+    Args:
+        call: Function making the requests, e.g. lambda c: get_freifahren_risk_assessment(client=c, ...)
+
+    Returns:
+        Result of call
+    """
+    try:
+        return await call(await get_openai_client())
+    except AuthenticationError:
+        logger.warning("OpenAI rejected the API key, reading it again")
+        return await call(await get_openai_client(refresh=True))
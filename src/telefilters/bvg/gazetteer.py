@@ -0,0 +1,289 @@
+import json
+import re
+from collections import deque
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+NETWORK_PATH = Path(__file__).with_name("network.json")
+
+# Words after which a station names the direction of travel rather than the sighting
+DIRECTION_WORDS = ("richtung", "ri", "towards", "toward", "direction", "dir", "nach")
+DIRECTION_WINDOW = 3  # Words between a direction word and its station
+
+# Words that make a message about transit, giving weak matches their context
+CONTEXT_WORDS = DIRECTION_WORDS + (
+    "bahnhof", "station", "gleis", "bahnsteig", "ubahn", "sbahn", "kontrolle", "kontrolleure", "kontis", "bvg"
+)
+CONTEXT_WINDOW = 2  # Words between a spaced line name like "u 8" and its station or context word
+SHORT_ALIAS_LENGTH = 4  # Aliases up to this length, e.g. Alex or Zoo, are also everyday words
+
+_FOLD = str.maketrans({"ä": "a", "ö": "o", "ü": "u", "ß": "ss"})
+_DIGRAPHS = re.compile(r"(?<=[a-z])(ae|oe|ue)")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_STRASSE = re.compile(r"(?<=[a-z])(strasse|str)\b")
+_DOUBLED = re.compile(r"([a-z])\1+")
+
+
+def fold(text: str) -> str:
+    """
+    Normalizes text for matching: lowercase, umlauts and their ae/oe/ue
+    spellings folded to the plain vowel, "straße"/"strasse"/"str." to "str",
+    doubled letters to one ("Hermanstr" matches "Hermannstraße") and
+    punctuation to single spaces, padded with a space on both sides.
+    """
+    text = _DIGRAPHS.sub(lambda m: m.group(0)[0], text.lower().translate(_FOLD))
+    text = _DOUBLED.sub(r"\1", _STRASSE.sub("str", _NON_WORD.sub(" ", text)))
+    return f" {text.strip()} "
+
+
+def _variants(name: str) -> List[str]:
+    """Folded spellings of a station name, including "Voltastr" written as "Volta Str" """
+    folded = fold(name).strip()
+    variants = {folded}
+    if folded.endswith("str") and " " not in folded:
+        variants.add(f"{folded[:-3]} str")
+    return sorted(variants)
+
+
+class AhoCorasick:
+    """
+    Multi-pattern matcher over folded text.
+
+    All patterns are found in one pass over the text, in time linear in the
+    length of the text plus the number of matches.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, str]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[int, str]]] = [[]]
+        for pattern, value in patterns:
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].append((len(pattern), value))
+
+        # Failure links in breadth-first order, children of the root fall back to it
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                if node:
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """All matches in text as (start, end, value)"""
+        matches = []
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, value in self.output[node]:
+                matches.append((index + 1 - length, index + 1, value))
+        return matches
+
+
+class Sighting(NamedTuple):
+    """A ticket inspector sighting extracted from a message"""
+    time: str
+    station: str
+    line: Optional[str]
+    direction: Optional[str]
+
+
+def _line_names(network: dict) -> List[str]:
+    names = set(network["lines"]) | set(network.get("reverse", {}))
+    names.update(f"U{number}" for number in range(1, 10))
+    names.update(f"S{number}" for number in (1, 2, 25, 26, 3, 41, 42, 45, 46, 47, 5, 7, 75, 8, 85, 9))
+    names.update(f"{prefix}{number}" for prefix in "MX" for number in range(1, 100))
+    return sorted(names)
+
+
+class Gazetteer:
+    """
+    Stations and lines of the BVG network, compiled into one matcher.
+
+    Lines are matched as written ("U8", "u 8", "S41", "M10") and, for buses
+    and trams, after the words bus or tram ("Bus 100", "Tram 12").
+
+    Some matches are weak because they also occur in ordinary prose ("it's
+    1 pm", "Alex told me"). Spaced line names only count next to a station
+    or a transit word, and short aliases only in a message that also names
+    a line, another station or a transit word.
+    """
+
+    def __init__(self, network: dict):
+        self.stations = sorted({station for line in network["lines"].values() for station in line["stations"]})
+        self.lines = _line_names(network)
+        self.serving: Dict[str, List[str]] = {}
+        for line, data in network["lines"].items():
+            for station in data["stations"]:
+                self.serving.setdefault(station, []).append(line)
+
+        patterns = []
+        names = {station: station for station in self.stations}
+        aliases = network.get("aliases", {})
+        names.update(aliases)
+        for name, station in names.items():
+            weak = name in aliases and len(name) <= SHORT_ALIAS_LENGTH
+            patterns.extend((f" {variant} ", ("station", station, weak)) for variant in _variants(name))
+        for line in self.lines:
+            prefix, number = line[0].lower(), line[1:]
+            patterns.append((f" {prefix}{number} ", ("line", line, False)))
+            patterns.append((f" {prefix} {number} ", ("line", line, True)))
+        for number in range(1, 400):
+            patterns.append((f" bus {number} ", ("line", f"Bus {number}", False)))
+        for number in range(1, 100):
+            patterns.append((f" tram {number} ", ("line", f"Tram {number}", False)))
+        patterns.extend((f" {word} ", ("direction", word, False)) for word in DIRECTION_WORDS)
+        self.matcher = AhoCorasick(patterns)
+        self._context = re.compile(
+            "(?<= )(" + "|".join(sorted({fold(word).strip() for word in CONTEXT_WORDS})) + ")(?= )"
+        )
+
+    def matches(self, text: str) -> List[Tuple[int, int, str, str]]:
+        """
+        Leftmost-longest, non-overlapping matches in text.
+
+        Returns:
+            (start, end, kind, value) in folded text, kind being station, line or direction
+        """
+        folded = fold(text)
+        found = sorted(self.matcher.find(folded), key=lambda match: (match[0], -match[1]))
+        selected = []
+        end = 0
+        for start, stop, value in found:
+            # Patterns include the spaces around them, neighbouring matches share one
+            if start + 1 >= end:
+                selected.append((start, stop, value))
+                end = stop
+
+        def near(start: int, stop: int, spans: List[Tuple[int, int]]) -> bool:
+            return any(
+                len(folded[stop:other_start].split() if other_start >= stop else folded[other_stop:start].split())
+                <= CONTEXT_WINDOW
+                for other_start, other_stop in spans
+            )
+
+        context = [match.span() for match in self._context.finditer(folded)]
+        stations = [(start, stop) for start, stop, (kind, _, weak) in selected if kind == "station" and not weak]
+        lines = [
+            (start, stop) for start, stop, (kind, _, weak) in selected
+            if kind == "line" and (not weak or near(start, stop, stations + context))
+        ]
+        result = []
+        for start, stop, (kind, value, weak) in selected:
+            if weak and kind == "line" and (start, stop) not in lines:
+                continue
+            if weak and kind == "station" and not (lines or stations or context):
+                continue
+            result.append((start, stop, kind, value))
+        return result
+
+    def sightings(self, time: str, text: str) -> List[Sighting]:
+        """
+        Extracts the sightings reported in a message.
+
+        Every station that does not follow a direction word is a sighting. It
+        gets the closest line mentioned in the message, or the only line that
+        serves it, and the station named after the next direction word.
+
+        Args:
+            time: Time of the message, e.g. "14:27"
+            text: Message text
+
+        Returns:
+            One sighting per reported station, in the order of the text
+        """
+        matches = self.matches(text)
+        folded = fold(text)
+        lines = [(start, value) for start, _, kind, value in matches if kind == "line"]
+
+        stations = []
+        directions = []
+        direction_at = None
+        for start, stop, kind, value in matches:
+            if kind == "direction":
+                direction_at = stop
+            elif kind == "station":
+                words_between = len(folded[direction_at:start].split()) if direction_at is not None else None
+                if words_between is not None and words_between <= DIRECTION_WINDOW:
+                    directions.append((start, value))
+                else:
+                    stations.append((start, value))
+                direction_at = None
+
+        sightings = []
+        for start, station in stations:
+            serving = self.serving.get(station, [])
+            line = None
+            if lines:
+                candidates = [entry for entry in lines if not serving or entry[1] in serving] or lines
+                line = min(candidates, key=lambda entry: abs(entry[0] - start))[1]
+            elif len(serving) == 1:
+                line = serving[0]
+            direction = next((value for position, value in directions if position > start), None)
+            if direction is None and len(stations) == 1 and directions:
+                direction = directions[0][1]
+            sightings.append(Sighting(time, station, line, direction))
+        return sightings
+
+
+@lru_cache(maxsize=1)
+def load_gazetteer(path: Path = NETWORK_PATH) -> Gazetteer:
+    """Gazetteer of the shipped network, built once per container"""
+    with open(path, encoding="utf-8") as f:
+        return Gazetteer(json.load(f))
+
+
+def split_sightings(messages: List[Tuple[str, str]]) -> Tuple[List[Sighting], List[Tuple[str, str]]]:
+    """
+    Sightings of (time, text) messages, e.g. the recent Freifahren messages.
+
+    Returns:
+        The sightings, and the messages with text in which none was recognized
+    """
+    gazetteer = load_gazetteer()
+    sightings: List[Sighting] = []
+    unmatched = []
+    for time, text in messages:
+        found = gazetteer.sightings(time, text or "")
+        sightings.extend(found)
+        if not found and text:
+            unmatched.append((time, text))
+    return sightings, unmatched
+
+
+def extract_sightings(messages: List[Tuple[str, str]]) -> List[Sighting]:
+    """Sightings of (time, text) messages, e.g. the recent Freifahren messages"""
+    return split_sightings(messages)[0]
+
+
+def format_sightings(sightings: List[Sighting], unmatched: Iterable[Tuple[str, str]] = ()) -> str:
+    """
+    One compact line per sighting for the LLM prompt, followed by the
+    unmatched (time, text) messages as written, e.g. stations missing from
+    the network or lines without stations.
+    """
+    lines = []
+    for sighting in sightings:
+        line = f"{sighting.time}: {sighting.station}"
+        if sighting.line:
+            line += f" ({sighting.line})"
+        if sighting.direction:
+            line += f" towards {sighting.direction}"
+        lines.append(line)
+    lines.extend(f"{time}: {text}" for time, text in unmatched)
+    return "\n".join(lines)
@@ -0,0 +1,294 @@
+import heapq
+import json
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from telefilters.bvg.gazetteer import NETWORK_PATH, Sighting, load_gazetteer
+
+HOP_MINUTES = 2.0  # Between neighbouring stations of a line
+TRANSFER_MINUTES = 5.0  # Changing lines, keeps routes from switching lines for no gain
+
+RECENT_MINUTES = 30  # Sightings younger than this make a route risky
+STALE_MINUTES = 90  # Sightings older than this are ignored
+MAX_REASONS = 4
+
+
+class Leg(NamedTuple):
+    """Part of a route on one line, stations in travel order"""
+    line: str
+    stations: List[str]
+
+
+class Route(NamedTuple):
+    legs: List[Leg]
+    minutes: float
+
+    @property
+    def stations(self) -> List[str]:
+        """Stations of the route in travel order, transfer stations once"""
+        stations: List[str] = []
+        for leg in self.legs:
+            stations.extend(station for station in leg.stations if not stations or station != stations[-1])
+        return stations
+
+    @property
+    def transfers(self) -> List[str]:
+        return [leg.stations[-1] for leg in self.legs[:-1]]
+
+    @property
+    def lines(self) -> List[str]:
+        return [leg.line for leg in self.legs]
+
+
+class TransitGraph:
+    """
+    The network as a graph of (station, line) nodes in compressed sparse rows.
+
+    Riding to the neighbouring station costs HOP_MINUTES and changing lines at
+    a station, or between the stations listed as transfers, TRANSFER_MINUTES.
+    Edges are kept in flat arrays: the edges of node n are targets and
+    weights[offsets[n]:offsets[n + 1]].
+    """
+
+    def __init__(self, network: dict):
+        self.lines = sorted(network["lines"])
+        self.stations = sorted({station for line in network["lines"].values() for station in line["stations"]})
+        self.reverse: Dict[str, str] = network.get("reverse", {})
+        station_index = {station: index for index, station in enumerate(self.stations)}
+        line_index = {line: index for index, line in enumerate(self.lines)}
+
+        self.node_station = array("i")
+        self.node_line = array("i")
+        self._nodes: Dict[Tuple[int, int], int] = {}
+        self.nodes_at: Dict[int, List[int]] = {}
+        edges: List[List[Tuple[int, float]]] = []
+
+        def node(station: str, line: str) -> int:
+            key = (station_index[station], line_index[line])
+            if key not in self._nodes:
+                self._nodes[key] = len(edges)
+                self.node_station.append(key[0])
+                self.node_line.append(key[1])
+                self.nodes_at.setdefault(key[0], []).append(len(edges))
+                edges.append([])
+            return self._nodes[key]
+
+        for line, data in network["lines"].items():
+            nodes = [node(station, line) for station in data["stations"]]
+            pairs = list(zip(nodes, nodes[1:]))
+            if data.get("circular"):
+                pairs.append((nodes[-1], nodes[0]))
+            for first, second in pairs:
+                edges[first].append((second, HOP_MINUTES))
+                edges[second].append((first, HOP_MINUTES))
+
+        transfers = [(station, station) for station in self.stations]
+        transfers.extend(tuple(pair) for pair in network.get("transfers", []))
+        for first, second in transfers:
+            for a in self.nodes_at[station_index[first]]:
+                for b in self.nodes_at[station_index[second]]:
+                    if a != b and self.node_line[a] != self.node_line[b]:
+                        edges[a].append((b, TRANSFER_MINUTES))
+                        if first != second:
+                            edges[b].append((a, TRANSFER_MINUTES))
+
+        self.offsets = array("i", [0])
+        self.targets = array("i")
+        self.weights = array("f")
+        for node_edges in edges:
+            for target, weight in node_edges:
+                self.targets.append(target)
+                self.weights.append(weight)
+            self.offsets.append(len(self.targets))
+        self._station_index = station_index
+        self._line_index = line_index
+
+    def _endpoints(self, station: str, line: Optional[str]) -> List[int]:
+        """Nodes of a station, only the one of line when a line is given, none if it does not serve the station"""
+        nodes = self.nodes_at.get(self._station_index.get(station, -1), [])
+        if line is None:
+            return nodes
+        line = self.reverse.get(line, line)
+        return [node for node in nodes if self.lines[self.node_line[node]] == line]
+
+    def knows_line(self, line: str) -> bool:
+        """Whether line, or the line it is the reverse direction of, is part of the graph"""
+        return self.reverse.get(line, line) in self._line_index
+
+    def shortest_route(
+        self,
+        origin: str,
+        destination: str,
+        origin_line: Optional[str] = None,
+        destination_line: Optional[str] = None,
+    ) -> Optional[Route]:
+        """
+        Fastest route between two stations with Dijkstra's algorithm.
+
+        Args:
+            origin: Station the journey starts at
+            destination: Station the journey ends at
+            origin_line: Line to board at the origin, any line when None
+            destination_line: Line to arrive on, likewise
+
+        Returns:
+            The route, None when a station is unknown or unreachable, or a
+            given line does not serve its station
+        """
+        sources = self._endpoints(origin, origin_line)
+        targets = set(self._endpoints(destination, destination_line))
+        if not sources or not targets:
+            return None
+
+        distance = array("f", [float("inf")]) * len(self.node_line)
+        previous = array("i", [-1]) * len(self.node_line)
+        queue = []
+        for source in sources:
+            distance[source] = 0.0
+            queue.append((0.0, source))
+        heapq.heapify(queue)
+        while queue:
+            minutes, current = heapq.heappop(queue)
+            if minutes > distance[current]:
+                continue
+            if current in targets:
+                return self._route(current, previous, minutes)
+            for edge in range(self.offsets[current], self.offsets[current + 1]):
+                target, cost = self.targets[edge], minutes + self.weights[edge]
+                if cost < distance[target]:
+                    distance[target] = cost
+                    previous[target] = current
+                    heapq.heappush(queue, (cost, target))
+        return None
+
+    def _route(self, end: int, previous: array, minutes: float) -> Route:
+        path = [end]
+        while previous[path[-1]] != -1:
+            path.append(previous[path[-1]])
+        legs: List[Leg] = []
+        for node in reversed(path):
+            line, station = self.lines[self.node_line[node]], self.stations[self.node_station[node]]
+            if legs and legs[-1].line == line:
+                legs[-1].stations.append(station)
+            else:
+                legs.append(Leg(line, [station]))
+        # A walk to a transfer station at the origin leaves a leg without a ride
+        while len(legs) > 1 and len(legs[0].stations) == 1:
+            legs.pop(0)
+        return Route(legs, minutes)
+
+    def resolve(self, text: str) -> Optional[Route]:
+        """
+        Route of a journey written as text, e.g. "U5 samariterstr to U8 voltastr".
+
+        The first station mentioned is the origin and the last one the
+        destination, each taken on the line mentioned right before it.
+
+        Returns:
+            The route, None when the text does not name two known stations or
+            names a line the graph does not have, e.g. a tram or bus, or one
+            that does not serve its station
+        """
+        stations: List[Tuple[str, Optional[str]]] = []
+        line = None
+        for _, _, kind, value in load_gazetteer().matches(text):
+            if kind == "line":
+                if not self.knows_line(value):
+                    return None
+                line = value
+            elif kind == "station":
+                stations.append((value, line))
+                line = None
+        if len(stations) < 2 or stations[0][0] == stations[-1][0]:
+            return None
+        (origin, origin_line), (destination, destination_line) = stations[0], stations[-1]
+        return self.shortest_route(origin, destination, origin_line, destination_line)
+
+
+@lru_cache(maxsize=1)
+def load_graph(path: Path = NETWORK_PATH) -> TransitGraph:
+    """Graph of the shipped network, built once per container"""
+    with open(path, encoding="utf-8") as f:
+        return TransitGraph(json.load(f))
+
+
+def _age(time: str, current_time: str) -> int:
+    """Minutes since a message or sighting, both times as HH:MM of the same day or the day before"""
+    hours, minutes = map(int, time.split(":"))
+    now_hours, now_minutes = map(int, current_time.split(":"))
+    return (now_hours * 60 + now_minutes - hours * 60 - minutes) % (24 * 60)
+
+
+def unplaced_reports(route: Route, messages: List[Tuple[str, str]], current_time: str) -> List[Tuple[str, str]]:
+    """
+    Recent reports on a line of the route that name no station the gazetteer knows.
+
+    assess_route cannot weigh these, e.g. "2 Kontrolleure in der U8 Richtung
+    Wittenau", so a route with any of them is left to the LLM.
+
+    Args:
+        route: Resolved journey
+        messages: (time, text) messages without a sighting, e.g. from gazetteer.split_sightings
+        current_time: Current time as HH:MM, in the time zone of the messages
+
+    Returns:
+        The messages of the last RECENT_MINUTES that name a line of the route
+    """
+    graph = load_graph()
+    gazetteer = load_gazetteer()
+    lines = set(route.lines)
+    reports = []
+    for time, text in messages:
+        if _age(time, current_time) > RECENT_MINUTES:
+            continue
+        if any(
+            kind == "line" and graph.reverse.get(value, value) in lines
+            for _, _, kind, value in gazetteer.matches(text)
+        ):
+            reports.append((time, text))
+    return reports
+
+
+def assess_route(route: Route, sightings: List[Sighting], current_time: str) -> str:
+    """
+    Risk of a route from the sightings on it, without asking a model.
+
+    High when inspectors were seen at a station of the route in the last
+    RECENT_MINUTES, Medium when they were seen there earlier or recently
+    elsewhere on a line of the route, Low otherwise.
+
+    Args:
+        route: Resolved journey
+        sightings: Recent sightings, e.g. from gazetteer.extract_sightings
+        current_time: Current time as HH:MM, in the time zone of the sightings
+
+    Returns:
+        str: "Risk: level" followed by one line per reason, most recent sighting first
+    """
+    graph = load_graph()
+    stations = set(route.stations)
+    lines = set(route.lines)
+    level = "Low"
+    reasons = []
+    for sighting in sorted(sightings, key=lambda s: _age(s.time, current_time)):
+        age = _age(sighting.time, current_time)
+        if age > STALE_MINUTES:
+            break
+        where = sighting.station + (f" ({sighting.line})" if sighting.line else "")
+        if sighting.station in stations:
+            if age <= RECENT_MINUTES:
+                level = "High"
+            elif level == "Low":
+                level = "Medium"
+            reasons.append(f"{sighting.time} inspectors at {where}, on your route")
+        elif graph.reverse.get(sighting.line, sighting.line) in lines and age <= RECENT_MINUTES:
+            level = "High" if level == "High" else "Medium"
+            reasons.append(f"{sighting.time} inspectors at {where}, on a line you take")
+
+    if not reasons:
+        reasons.append(f"No sightings on your route in the last {STALE_MINUTES} minutes")
+    route_line = " → ".join(f"{leg.line} {leg.stations[0]}" for leg in route.legs) + f" → {route.stations[-1]}"
+    lines_out = "\n".join(f"- {reason}" for reason in reasons[:MAX_REASONS])
+    return f"Risk: {level}\n{lines_out}\n- Route: {route_line}"
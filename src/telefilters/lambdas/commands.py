@@ -1,11 +1,15 @@
 import json
 import logging
 import os
+import time
 import typing as t
+from datetime import datetime, timezone
 
-from telefilters import auth
+from telefilters import auth, llm_metrics
+from telefilters.bvg.gazetteer import format_sightings, split_sightings
+from telefilters.bvg.graph import assess_route, load_graph, unplaced_reports
 from telefilters.prompts import get_freifahren_risk_assessment
-from telefilters.telegram.messaging import sendReply
+from telefilters.telegram.messaging import StreamingReply, editMessageText, sendReply
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
@@ -16,7 +20,7 @@ async def summarize(body: str, user_id: int, chat_id: int) -> t.Dict:
     client, api_id, api_hash, bot_token = auth.get_telegram_client(user_id)
 
     try:
-        openai_client = auth.get_openai_client()
+        openai_client = await auth.get_openai_client()
         logger.info("Authorization successful")
 
         # Send authentication success message to user
@@ -48,8 +52,8 @@ async def get_bvg_risk(body: str, user_id: int, chat_id: int) -> t.Dict:
     try:
         client, api_id, api_hash, bot_token = auth.get_telegram_client(user_id)
 
-        # Send thinking message
-        await sendReply(bot_token, chat_id, "Thanks for the request, thinking...")
+        # Send thinking message, the answer is streamed into it
+        message_id = await sendReply(bot_token, chat_id, "Thanks for the request, thinking...")
 
         try:
             await client.connect()
@@ -71,19 +75,56 @@ async def get_bvg_risk(body: str, user_id: int, chat_id: int) -> t.Dict:
             messages = [(msg.date.strftime("%H:%M"), msg.text) for msg in messages]
             logger.info(f"Freifahren messages: {messages}")
 
-            prompt_freifahren = "\n".join(
-                [f"{time}: {text}" for time, text in messages]
-            )
-            openai_client = auth.get_openai_client()
+            # Compact sightings first, then the raw texts of messages without a recognized station
+            sightings, unmatched = split_sightings(messages)
+            logger.info(f"Sightings: {sightings}")
+            prompt_freifahren = format_sightings(sightings, unmatched)
+
+            # Journeys between two known stations are answered from the network graph, without a model,
+            # unless a recent report on one of its lines could not be placed at a station
+            start = time.monotonic()
+            route = load_graph().resolve(body)
+            current_time = datetime.now(timezone.utc).strftime("%H:%M")
+            if route is not None and unplaced_reports(route, unmatched, current_time):
+                logger.info("Reports on the route without a station, asking the model")
+                route = None
+            if route is not None:
+                message_out = assess_route(route, sightings, current_time)
+                if message_id is None:
+                    await sendReply(bot_token, chat_id, message_out)
+                else:
+                    await editMessageText(bot_token, chat_id, message_id, message_out)
+                with llm_metrics.tags(command="/get_bvg_risk", mode="route"):
+                    llm_metrics.record_duration("AssessmentLatency", time.monotonic() - start)
+                logger.info(f"Route assessment:\n{message_out}")
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps({"message": "Request processed successfully"}),
+                }
 
-            message_out = await get_freifahren_risk_assessment(
-                client=openai_client,
-                user_prompt=body,
-                freifahren_prompt=prompt_freifahren,
-            )
+            with llm_metrics.tags(command="/get_bvg_risk"):
+                if message_id is None:
+                    message_out = await auth.with_openai_client(
+                        lambda openai_client: get_freifahren_risk_assessment(
+                            client=openai_client,
+                            user_prompt=body,
+                            freifahren_prompt=prompt_freifahren,
+                        )
+                    )
+                    await sendReply(bot_token, chat_id, message_out)
+                else:
+                    async with StreamingReply(bot_token, chat_id, message_id) as reply:
+                        message_out = await auth.with_openai_client(
+                            lambda openai_client: get_freifahren_risk_assessment(
+                                client=openai_client,
+                                user_prompt=body,
+                                freifahren_prompt=prompt_freifahren,
+                                on_text=reply.update,
+                            )
+                        )
+                        await reply.finish(message_out)
 
             logger.info(f"Assistant's response:\n{message_out}")
-            await sendReply(bot_token, chat_id, message_out)
 
             return {
                 "statusCode": 200,
@@ -4,11 +4,34 @@ import logging
 import os
 import typing as t
 
+from telefilters import llm_retry
 from telefilters.lambdas.commands import get_bvg_risk
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
+DEADLINE_MARGIN = 3.0  # Seconds kept free before the Lambda timeout to send the reply
+
+# Kept open between warm invocations, so clients pooled on it stay usable
+_loop: t.Optional[asyncio.AbstractEventLoop] = None
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """Return the container's event loop, creating it on first use"""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def _llm_time_budget(context: t.Any) -> t.Optional[float]:
+    """Seconds LLM calls may take, from the remaining time of the invocation"""
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining is None:
+        return None
+    return get_remaining() / 1000 - DEADLINE_MARGIN
+
 
 def lambda_handler(event: t.Dict, context: t.Dict) -> t.Dict:
     try:
@@ -23,15 +46,11 @@ def lambda_handler(event: t.Dict, context: t.Dict) -> t.Dict:
         # if message_text.startswith("/summarize"):
         #     return summarize(message_text, user_id, chat_id)
         if message_text.startswith("/get_bvg_risk"):
-            # Create new event loop for async operation
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                return loop.run_until_complete(
+            # Reuse the event loop of previous invocations for async operation
+            with llm_retry.deadline(_llm_time_budget(context)):
+                return _event_loop().run_until_complete(
                     get_bvg_risk(message_text, user_id, chat_id)
                 )
-            finally:
-                loop.close()
         else:
             return {
                 "statusCode": 200,
@@ -0,0 +1,136 @@
+import asyncio
+import dataclasses
+import time
+import typing as t
+
+from openai import AsyncOpenAI
+
+from telefilters import llm_cache, llm_metrics, llm_retry
+
+
+async def complete(
+    client: AsyncOpenAI,
+    messages: t.List[t.Dict[str, str]],
+    policy: llm_retry.RetryPolicy = llm_retry.DEFAULT_POLICY,
+    cacheable: t.Optional[t.Callable[[str], bool]] = None,
+    **params: t.Any,
+) -> str:
+    """Make a chat completion through the response cache, with retries and metrics.
+
+    Args:
+        client: AsyncOpenAI client
+        messages: Chat messages, including the system prompt
+        policy: Retry and hedging policy
+        cacheable: Check a response must pass to be cached, e.g. that it parses
+        **params: Model and generation parameters such as max_tokens
+
+    Returns:
+        str: Content of the assistant's message
+    """
+    model = params["model"]
+    start = time.monotonic()
+    called = False
+
+    async def create() -> str:
+        nonlocal called
+        called = True
+        attempts = 0
+
+        def attempt():
+            nonlocal attempts
+            attempts += 1
+            return client.chat.completions.create(messages=messages, **params)
+
+        completion = await llm_retry.call_with_retries(attempt, policy)
+        llm_metrics.record_call(
+            getattr(completion, "model", None) or model, completion.usage, time.monotonic() - start, attempts - 1
+        )
+        return completion.choices[0].message.content
+
+    key = llm_cache.cache_key(messages=messages, **params)
+    response = await llm_cache.get_cache().cached(key, create, cacheable)
+    if not called:
+        llm_metrics.record_cache_hit(model, time.monotonic() - start)
+    return response
+
+
+async def stream(
+    client: AsyncOpenAI,
+    messages: t.List[t.Dict[str, str]],
+    policy: llm_retry.RetryPolicy = llm_retry.DEFAULT_POLICY,
+    **params: t.Any,
+) -> t.AsyncIterator[str]:
+    """Stream a chat completion, yielding the text received so far after every chunk.
+
+    Shares the response cache with complete: a cached response is yielded at
+    once, a streamed one is cached when it is complete. Retries only cover
+    opening the stream and streams are never hedged. Reading the stream is
+    bounded by the current llm_retry deadline as well. The time to the first
+    token is recorded in llm_metrics as TimeToFirstToken.
+
+    Args:
+        client: AsyncOpenAI client
+        messages: Chat messages, including the system prompt
+        policy: Retry policy
+        **params: Model and generation parameters such as max_tokens
+
+    Yields:
+        str: Content of the assistant's message so far
+
+    Raises:
+        llm_retry.DeadlineExceeded: The stream did not finish before the deadline
+    """
+    model = params["model"]
+    start = time.monotonic()
+    cache = llm_cache.get_cache()
+    key = llm_cache.cache_key(messages=messages, **params)
+    cached = await cache.get(key)
+    if cached is not None:
+        llm_metrics.record_cache_hit(model, time.monotonic() - start)
+        yield cached
+        return
+
+    attempts = 0
+
+    def attempt():
+        nonlocal attempts
+        attempts += 1
+        return client.chat.completions.create(
+            messages=messages, stream=True, stream_options={"include_usage": True}, **params
+        )
+
+    response = await llm_retry.call_with_retries(attempt, dataclasses.replace(policy, hedge=False))
+    text = ""
+    usage = None
+    async for chunk in _until_deadline(response):
+        usage = getattr(chunk, "usage", None) or usage
+        model = getattr(chunk, "model", None) or model
+        for choice in chunk.choices:
+            if choice.delta.content:
+                if not text:
+                    llm_metrics.record_duration("TimeToFirstToken", time.monotonic() - start)
+                text += choice.delta.content
+                yield text
+
+    llm_metrics.record_call(model, usage, time.monotonic() - start, attempts - 1)
+    await cache.put(key, text)
+
+
+async def _until_deadline(chunks: t.AsyncIterable[t.Any]) -> t.AsyncIterator[t.Any]:
+    """Iterate a stream, raising DeadlineExceeded when the current deadline passes before it ends"""
+    iterator = chunks.__aiter__()
+    while True:
+        left = llm_retry.remaining()
+        try:
+            if left is None:
+                chunk = await iterator.__anext__()
+            elif left <= 0:
+                raise asyncio.TimeoutError
+            else:
+                chunk = await asyncio.wait_for(iterator.__anext__(), left)
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            llm_retry.stats.deadline_exceeded += 1
+            raise llm_retry.DeadlineExceeded("The stream did not finish before the deadline") from None
+        yield chunk
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import typing as t
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fsspec import AbstractFileSystem
+from fsspec.core import url_to_fs
+
+from telefilters.storage import read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+MEMORY_CACHE_SIZE = 512  # Responses kept in the in-memory tier
+CACHE_TTL = 3 * 24 * 60 * 60  # Seconds a cached response stays valid
+CACHE_PATH_ENV = "LLM_CACHE_PATH"  # s3:// or local directory of the persistent tier
+
+
+def cache_key(model: str, messages: t.List[t.Dict[str, str]], **params: t.Any) -> str:
+    """Content address of a chat completion request.
+
+    Args:
+        model: Model name
+        messages: Chat messages, including the system prompt
+        **params: Generation parameters such as temperature and max_tokens
+
+    Returns:
+        str: SHA-256 hex digest of the canonical JSON of the request
+    """
+    request = {"model": model, "messages": messages, "params": params}
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+
+class ResponseCache:
+    """Two-tier cache of LLM responses keyed by cache_key.
+
+    The first tier is an in-memory LRU that survives warm Lambda invocations,
+    the optional second tier stores one JSON file per response on an fsspec
+    filesystem (S3 or local disk). Entries older than `ttl` seconds are misses.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = MEMORY_CACHE_SIZE,
+        ttl: float = CACHE_TTL,
+        fs: t.Optional[AbstractFileSystem] = None,
+        path: t.Optional[str] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.fs = fs
+        self.path = path.rstrip("/") if path else None
+        self.stats = CacheStats()
+        self._memory: "OrderedDict[str, t.Tuple[float, str]]" = OrderedDict()
+
+    def _file(self, key: str) -> str:
+        return f"{self.path}/{key[:2]}/{key}.json"
+
+    def _remember(self, key: str, created: float, response: str) -> None:
+        self._memory[key] = (created, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> t.Optional[str]:
+        """Look up a response in memory first, then on the persistent tier"""
+        now = time.time()
+        cached = self._memory.get(key)
+        if cached and now - cached[0] < self.ttl:
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return cached[1]
+        self._memory.pop(key, None)
+
+        if self.fs is not None:
+            try:
+                entry = await asyncio.to_thread(read_json, self.fs, self._file(key))
+            except Exception as e:
+                logger.warning(f"Failed to read cached response {key}: {e}")
+                entry = None
+            if entry and now - entry["created"] < self.ttl:
+                self._remember(key, entry["created"], entry["response"])
+                self.stats.disk_hits += 1
+                return entry["response"]
+
+        self.stats.misses += 1
+        return None
+
+    async def put(self, key: str, response: str) -> None:
+        """Store a response in both tiers"""
+        created = time.time()
+        self._remember(key, created, response)
+        if self.fs is not None:
+            try:
+                await asyncio.to_thread(
+                    write_json, self.fs, self._file(key), {"created": created, "response": response}
+                )
+            except Exception as e:
+                logger.warning(f"Failed to persist cached response {key}: {e}")
+
+    async def cached(
+        self,
+        key: str,
+        call: t.Callable[[], t.Awaitable[str]],
+        cacheable: t.Optional[t.Callable[[str], bool]] = None,
+    ) -> str:
+        """Return the cached response for key, or make the call and cache its result
+
+        Responses `cacheable` rejects are returned without being cached.
+        """
+        response = await self.get(key)
+        if response is None:
+            response = await call()
+            if response is not None and (cacheable is None or cacheable(response)):
+                await self.put(key, response)
+        return response
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"LLM cache: {self.stats.hits} hits ({self.stats.memory_hits} memory, "
+            f"{self.stats.disk_hits} disk), {self.stats.misses} misses"
+        )
+
+
+_cache: t.Optional[ResponseCache] = None
+
+
+def get_cache() -> ResponseCache:
+    """Module-wide response cache, created on first use.
+
+    The persistent tier is enabled when the LLM_CACHE_PATH environment
+    variable names a directory, e.g. s3://bucket/llm-cache or /tmp/llm-cache.
+    """
+    global _cache
+    if _cache is None:
+        path = os.environ.get(CACHE_PATH_ENV)
+        fs = None
+        if path:
+            fs, path = url_to_fs(path)
+        _cache = ResponseCache(fs=fs, path=path)
+    return _cache
+
+
+def set_cache(cache: t.Optional[ResponseCache]) -> None:
+    """Replace the module-wide cache, e.g. to disable persistence in tests"""
+    global _cache
+    _cache = cache
@@ -0,0 +1,159 @@
+import contextlib
+import json
+import logging
+import os
+import time
+import typing as t
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+
+logger = logging.getLogger(__name__)
+
+METRICS_NAMESPACE = "TeleFilters/LLM"
+RECENT_CALLS = 100  # Calls kept in memory for inspection
+
+# USD per million tokens: prompt, cached prompt, completion
+PRICES: t.Dict[str, t.Tuple[float, float, float]] = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4-turbo-preview": (10.00, 10.00, 30.00),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+}
+
+_tags: ContextVar[t.Dict[str, str]] = ContextVar("llm_tags", default={})
+
+
+@contextlib.contextmanager
+def tags(**values: str) -> t.Iterator[None]:
+    """Tag the LLM calls made inside the block, e.g. with command="/get_bvg_risk" or conversation="..." """
+    token = _tags.set({**_tags.get(), **values})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> t.Optional[float]:
+    """Estimated cost of a call in USD, None for models without a known price"""
+    prices = next((PRICES[name] for name in sorted(PRICES, key=len, reverse=True) if model.startswith(name)), None)
+    if prices is None:
+        return None
+    prompt, cached, completion = prices
+    return ((prompt_tokens - cached_tokens) * prompt + cached_tokens * cached + completion_tokens * completion) / 1e6
+
+
+@dataclass
+class CallMetrics:
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # Prompt tokens served from the OpenAI prompt cache
+    latency: float = 0.0  # Seconds, including retries
+    retries: int = 0
+    cost: t.Optional[float] = None
+    cache_hit: bool = False  # Answered from the response cache without calling the API
+    tags: t.Dict[str, str] = field(default_factory=dict)
+
+
+recent: t.Deque[CallMetrics] = deque(maxlen=RECENT_CALLS)
+
+
+def _emit(metrics: CallMetrics) -> None:
+    if not os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        logger.info(f"LLM call {json.dumps(asdict(metrics))}")
+        return
+
+    # CloudWatch embedded metric format, picked up from the function's stdout
+    dimensions = sorted({"command", *metrics.tags} - {"conversation"})
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [dimensions + ["model"], ["model"]],
+                "Metrics": [
+                    {"Name": "PromptTokens", "Unit": "Count"},
+                    {"Name": "CompletionTokens", "Unit": "Count"},
+                    {"Name": "CachedTokens", "Unit": "Count"},
+                    {"Name": "Latency", "Unit": "Seconds"},
+                    {"Name": "Retries", "Unit": "Count"},
+                    {"Name": "Cost", "Unit": "None"},
+                    {"Name": "CacheHits", "Unit": "Count"},
+                ],
+            }],
+        },
+        "command": "unknown",
+        **metrics.tags,
+        "model": metrics.model,
+        "PromptTokens": metrics.prompt_tokens,
+        "CompletionTokens": metrics.completion_tokens,
+        "CachedTokens": metrics.cached_tokens,
+        "Latency": round(metrics.latency, 3),
+        "Retries": metrics.retries,
+        "Cost": metrics.cost or 0.0,
+        "CacheHits": int(metrics.cache_hit),
+    }
+    print(json.dumps(document), flush=True)
+
+
+def record_call(model: str, usage: t.Any, latency: float, retries: int = 0) -> CallMetrics:
+    """
+    Records a call made to the API.
+
+    Args:
+        model: Model of the request
+        usage: Usage of the completion, may be None
+        latency: Seconds from the first attempt to the answer
+        retries: Attempts beyond the first one, hedged requests included
+
+    Returns:
+        The recorded metrics
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+    metrics = CallMetrics(
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=cached_tokens,
+        latency=latency,
+        retries=retries,
+        cost=estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens),
+        tags=dict(_tags.get()),
+    )
+    recent.append(metrics)
+    _emit(metrics)
+    return metrics
+
+
+def record_cache_hit(model: str, latency: float) -> CallMetrics:
+    """Records a call answered from the response cache"""
+    metrics = CallMetrics(model=model, latency=latency, cost=0.0, cache_hit=True, tags=dict(_tags.get()))
+    recent.append(metrics)
+    _emit(metrics)
+    return metrics
+
+
+def record_duration(name: str, seconds: float) -> None:
+    """Records the duration of an operation spanning several calls, e.g. a whole risk assessment"""
+    current = dict(_tags.get())
+    if not os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        logger.info(f"Duration {json.dumps({**current, name: round(seconds, 3)})}")
+        return
+
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [sorted({"command", *current} - {"conversation"})],
+                "Metrics": [{"Name": name, "Unit": "Seconds"}],
+            }],
+        },
+        "command": "unknown",
+        **current,
+        name: round(seconds, 3),
+    }
+    print(json.dumps(document), flush=True)
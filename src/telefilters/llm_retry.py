@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+import typing as t
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 4  # Attempts per call, including the first
+BASE_DELAY = 0.5  # Seconds before the first retry, doubled for every further one
+MAX_DELAY = 8.0  # Cap on the backoff and on an honored Retry-After
+HEDGE_DELAY = 4.0  # Seconds before a hedged request until enough latencies are recorded
+LATENCY_WINDOW = 200  # Recent call latencies kept for the p95 hedge delay
+MIN_LATENCY_SAMPLES = 20  # Latencies needed before the p95 is used
+
+T = t.TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call cannot finish before the current deadline"""
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How to retry an LLM call.
+
+    Rate limits (429), server errors (5xx), timeouts and connection errors are
+    retried with exponential backoff and jitter, or after the Retry-After the
+    API asks for. With `hedge`, a second identical request is sent when the
+    first one has not answered after `hedge_delay` seconds (by default the p95
+    latency of recent calls) and the first answer wins.
+    """
+    max_attempts: int = MAX_ATTEMPTS
+    base_delay: float = BASE_DELAY
+    max_delay: float = MAX_DELAY
+    hedge: bool = False
+    hedge_delay: t.Optional[float] = None
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+@dataclass
+class RetryStats:
+    calls: int = 0
+    retries: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0  # Calls answered by the hedged request
+    deadline_exceeded: int = 0
+
+
+stats = RetryStats()
+_latencies: t.Deque[float] = deque(maxlen=LATENCY_WINDOW)
+_deadline: ContextVar[t.Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: t.Optional[float]) -> t.Iterator[None]:
+    """Limit the LLM calls made inside the block, and in tasks started from it, to `seconds` from now"""
+    token = _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> t.Optional[float]:
+    """Seconds left until the current deadline, None without a deadline"""
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+def p95_latency() -> t.Optional[float]:
+    """95th percentile of recent call latencies, None until enough calls were made"""
+    if len(_latencies) < MIN_LATENCY_SAMPLES:
+        return None
+    ordered = sorted(_latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def retry_after(error: Exception) -> t.Optional[float]:
+    """Seconds the API asked to wait before retrying, from the Retry-After headers"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:  # An HTTP date, fall back to the backoff
+        pass
+    return None
+
+
+async def _within_deadline(call: t.Callable[[], t.Awaitable[T]]) -> T:
+    left = remaining()
+    if left is None:
+        return await call()
+    if left <= 0:
+        raise DeadlineExceeded("No time left for the call")
+    return await asyncio.wait_for(call(), left)
+
+
+async def _hedged(call: t.Callable[[], t.Awaitable[T]], delay: float) -> T:
+    """Run call, start a second one after `delay` seconds, and return the first answer"""
+    first = asyncio.ensure_future(_within_deadline(call))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    stats.hedges += 1
+    second = asyncio.ensure_future(_within_deadline(call))
+    pending = {first, second}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    stats.hedge_wins += task is second
+                    return task.result()
+        # Both failed, report the original request's error
+        return first.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call_with_retries(
+    call: t.Callable[[], t.Awaitable[T]],
+    policy: RetryPolicy = DEFAULT_POLICY,
+) -> T:
+    """Make an LLM call, retrying transient failures within the current deadline.
+
+    Args:
+        call: Factory of the request coroutine, called once per attempt
+        policy: Retry and hedging policy
+
+    Returns:
+        The result of the first successful attempt
+
+    Raises:
+        DeadlineExceeded: The deadline passed, or the next retry would end after it
+        Exception: The last error once it is not retryable or the attempts are used up
+    """
+    stats.calls += 1
+    attempt = 0
+    while True:
+        attempt += 1
+        start = time.monotonic()
+        try:
+            if policy.hedge:
+                delay = policy.hedge_delay or p95_latency() or HEDGE_DELAY
+                result = await _hedged(call, delay)
+            else:
+                result = await _within_deadline(call)
+            _latencies.append(time.monotonic() - start)
+            return result
+        except DeadlineExceeded:
+            stats.deadline_exceeded += 1
+            raise
+        except Exception as e:
+            left = remaining()
+            if left is not None and left <= 0:
+                stats.deadline_exceeded += 1
+                raise DeadlineExceeded(f"Deadline passed during the call: {e}") from e
+            if attempt == policy.max_attempts or not is_retryable(e):
+                raise
+
+            backoff = policy.base_delay * 2 ** (attempt - 1)
+            delay = min(policy.max_delay, retry_after(e) or random.uniform(backoff / 2, backoff))
+            if left is not None and delay >= left:
+                stats.deadline_exceeded += 1
+                raise DeadlineExceeded(f"No time left to retry after: {e}") from e
+            logger.warning(f"LLM call failed ({e}), retry {attempt} in {delay:.1f}s")
+            stats.retries += 1
+            await asyncio.sleep(delay)
@@ -1,14 +1,25 @@
 import asyncio
+import json
 import logging
 import os
+import time
 import typing as t
 from datetime import datetime
 
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+from telefilters import llm, llm_metrics, llm_retry
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
+# Users wait for the answer, so slow requests are hedged
+RETRY_POLICY = llm_retry.RetryPolicy(hedge=True)
+
+FAST = "fast"  # One structured call for risk level and reasons
+TWO_STAGE = "two_stage"  # Detailed analysis first, then a summary of it
+FAST_MAX_TOKENS = 300
+
 SYSTEM_PROMPT = """
     You are a Berliner, who knows very well the public transport system.
     You are helping the user playing the game of avoiding getting controled by the ticket inspectors."
@@ -29,113 +40,237 @@ SUMMARY_PROMPT = """
     """
 
 
+FAST_PROMPT = """
+    Respond with a JSON object and nothing else:
+    {
+        "risk_level": "Low|Medium|High",
+        "reasons": ["At most 4 short reasons, each naming the time and location of a recent sighting"]
+    }
+    """
+
+
+# Same answer as FAST_PROMPT in a layout that reads well while it is streamed
+STREAMED_PROMPT = """
+    Respond in exactly this layout and nothing else:
+    Risk: Low|Medium|High
+    - At most 4 short reasons, one per line, each naming the time and location of a recent sighting
+    """
+
+
 async def get_freifahren_risk_assessment(
-    client: OpenAI,
+    client: AsyncOpenAI,
     user_prompt: str,
     freifahren_prompt: str,
     system_prompt: t.Optional[str] = None,
     model: str = "gpt-4-turbo-preview",
     temperature: float = 0.7,
     max_tokens: t.Optional[int] = None,
+    mode: str = FAST,
+    on_text: t.Optional[t.Callable[[str], None]] = None,
 ) -> str:
     """Get a risk assessment for encountering ticket inspectors.
 
-    Makes two API calls:
+    In fast mode one API call returns the risk level and the reasons as JSON.
+    In two-stage mode two API calls are made:
     1. Detailed analysis of the situation
     2. Concise summary for the user
 
+    With `on_text`, the answer is streamed: on_text receives the text so far
+    after every chunk of the final call.
+
+    The latency of each assessment is recorded as AssessmentLatency with the
+    mode as a dimension; the delta between the modes is their difference in
+    CloudWatch.
+
     Args:
-        client: OpenAI client
+        client: AsyncOpenAI client
         user_prompt: User's journey question
         freifahren_prompt: Recent inspector sightings
         system_prompt: Optional override for system prompt
         model: OpenAI model to use
         temperature: Response randomness (0.0-2.0)
-        max_tokens: Maximum tokens in response
+        max_tokens: Maximum tokens in response of the fast mode
+        mode: FAST or TWO_STAGE
+        on_text: Optional callback for the streamed answer, e.g. StreamingReply.update
 
     Returns:
         str: Concise risk assessment message
     """
-    time = datetime.now().strftime("%H:%M")
+    current_time = datetime.now().strftime("%H:%M")
 
     context_prompt = f"""
     Here are the hints of the locations of the ticket inspectors. They are based on the recent reports from the community.
-    Each message consists of time in H:M format and a text from community. Text can be either in german or english. Current time is {time}.
+    Each message consists of time in H:M format and a text from community. Text can be either in german or english. Current time is {current_time}.
     \nHere are the last 20 messages:\n
     {freifahren_prompt}
     """
 
+    start = time.monotonic()
+    try:
+        with llm_metrics.tags(mode=mode):
+            if mode == FAST:
+                final_response = await _fast_assessment(
+                    client, context_prompt, user_prompt, system_prompt, model, temperature, max_tokens, on_text
+                )
+            else:
+                final_response = await _two_stage_assessment(
+                    client, context_prompt, user_prompt, system_prompt, model, temperature, on_text
+                )
+            _record_latency(mode, time.monotonic() - start)
+
+        logger.info(f"Final response:\n{final_response}")
+        return final_response
+
+    except Exception as e:
+        logger.error(f"Error getting risk assessment: {str(e)}")
+        raise
+
+
+def _record_latency(mode: str, seconds: float) -> None:
+    """Record the latency of an assessment, tagged with its mode"""
+    llm_metrics.record_duration("AssessmentLatency", seconds)
+    logger.info(f"{mode} assessment took {seconds:.1f}s")
+
+
+def _format_assessment(response: str) -> str:
+    """Render the JSON answer of the fast mode as a short message"""
     try:
-        # First call: Detailed analysis
-        detailed_analysis = await _make_openai_call(
+        data = json.loads(response.strip().removeprefix("```json").removesuffix("```"))
+        reasons = "\n".join(f"- {reason}" for reason in data.get("reasons", []))
+        return f"Risk: {data['risk_level']}\n{reasons}".strip()
+    except (json.JSONDecodeError, KeyError, AttributeError, TypeError):
+        logger.warning(f"Failed to parse fast assessment: {response}")
+        return response
+
+
+async def _fast_assessment(
+    client: AsyncOpenAI,
+    context_prompt: str,
+    user_prompt: str,
+    system_prompt: t.Optional[str],
+    model: str,
+    temperature: float,
+    max_tokens: t.Optional[int],
+    on_text: t.Optional[t.Callable[[str], None]] = None,
+) -> str:
+    """Risk level and reasons in a single structured call"""
+    if on_text:
+        # JSON cannot be shown while it streams, ask for the rendered layout instead
+        response = await _make_openai_call(
             client=client,
-            system_prompt=SYSTEM_PROMPT,
+            system_prompt=(system_prompt or SYSTEM_PROMPT) + STREAMED_PROMPT,
             user_prompts=[context_prompt, user_prompt],
             model=model,
             temperature=temperature,
-            max_tokens=1000,  # Allow longer response for analysis
+            max_tokens=max_tokens or FAST_MAX_TOKENS,
+            on_text=on_text,
         )
+        return response.strip()
 
-        logger.info(f"Detailed analysis:\n{detailed_analysis}")
+    response = await _make_openai_call(
+        client=client,
+        system_prompt=(system_prompt or SYSTEM_PROMPT) + FAST_PROMPT,
+        user_prompts=[context_prompt, user_prompt],
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens or FAST_MAX_TOKENS,
+        response_format={"type": "json_object"},
+    )
+    return _format_assessment(response)
 
-        # Second call: Concise summary
-        summary_prompt = f"Based on this analysis:\n{detailed_analysis}\n\nProvide a concise risk assessment."
-        final_response = await _make_openai_call(
-            client=client,
-            system_prompt=SUMMARY_PROMPT,
-            user_prompts=[summary_prompt],
-            model=model,
-            temperature=temperature,
-            max_tokens=150,  # Keep summary brief
-        )
 
-        logger.info(f"Final response:\n{final_response}")
-        return final_response
+async def _two_stage_assessment(
+    client: AsyncOpenAI,
+    context_prompt: str,
+    user_prompt: str,
+    system_prompt: t.Optional[str],
+    model: str,
+    temperature: float,
+    on_text: t.Optional[t.Callable[[str], None]] = None,
+) -> str:
+    """Detailed analysis followed by a concise summary of it, only the summary is streamed"""
+    # First call: Detailed analysis
+    detailed_analysis = await _make_openai_call(
+        client=client,
+        system_prompt=system_prompt or SYSTEM_PROMPT,
+        user_prompts=[context_prompt, user_prompt],
+        model=model,
+        temperature=temperature,
+        max_tokens=1000,  # Allow longer response for analysis
+    )
 
-    except Exception as e:
-        logger.error(f"Error getting risk assessment: {str(e)}")
-        raise
+    logger.info(f"Detailed analysis:\n{detailed_analysis}")
 
+    # Second call: Concise summary
+    summary_prompt = f"Based on this analysis:\n{detailed_analysis}\n\nProvide a concise risk assessment."
+    return await _make_openai_call(
+        client=client,
+        system_prompt=SUMMARY_PROMPT,
+        user_prompts=[summary_prompt],
+        model=model,
+        temperature=temperature,
+        max_tokens=150,  # Keep summary brief
+        on_text=on_text,
+    )
 
 async def _make_openai_call(
-    client: OpenAI,
+    client: AsyncOpenAI,
     system_prompt: str,
     user_prompts: t.List[str],
     model: str,
     temperature: float,
     max_tokens: int,
+    response_format: t.Optional[t.Dict[str, str]] = None,
+    on_text: t.Optional[t.Callable[[str], None]] = None,
 ) -> str:
     """Helper function to make OpenAI API calls.
 
+    Responses are cached by model, prompts and generation parameters, so a
+    repeated request is answered without calling the API. Transient failures
+    are retried and slow requests hedged with RETRY_POLICY, within the
+    deadline of the invocation, and every call is recorded in llm_metrics.
+
     Args:
-        client: OpenAI client
+        client: AsyncOpenAI client
         system_prompt: System message
         user_prompts: List of user messages
         model: OpenAI model
         temperature: Response randomness
         max_tokens: Maximum tokens
+        response_format: Optional response format, e.g. {"type": "json_object"}
+        on_text: Stream the response, calling on_text with the text so far after every chunk
 
     Returns:
         str: Assistant's response
     """
     try:
-        loop = asyncio.get_event_loop()
         messages = [{"role": "system", "content": system_prompt}]
         messages.extend(
             [{"role": "user", "content": prompt} for prompt in user_prompts]
         )
-
-        response = await loop.run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
+        if on_text:
+            response = ""
+            async for response in llm.stream(
+                client,
+                messages,
+                RETRY_POLICY,
                 model=model,
-                messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
-            ),
-        )
+                **({"response_format": response_format} if response_format else {}),
+            ):
+                on_text(response)
+            return response
 
-        return response.choices[0].message.content
+        return await llm.complete(
+            client,
+            messages,
+            RETRY_POLICY,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **({"response_format": response_format} if response_format else {}),
+        )
 
     except Exception as e:
         logger.error(f"Error in OpenAI call: {str(e)}")
@@ -147,7 +282,7 @@ if __name__ == "__main__":
     import os
 
     # Get authenticated client using your existing function
-    openai_client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    openai_client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
 
     user_prompt = "going from U5 samariterstr to U8 voltastr"
 
@@ -191,10 +326,12 @@ if __name__ == "__main__":
     prompt_freifahren = "\n".join([f"{time}: {text}" for time, text in messages])
 
     try:
-        response = get_freifahren_risk_assessment(
-            client=openai_client,
-            user_prompt=user_prompt,
-            freifahren_prompt=prompt_freifahren,
+        response = asyncio.run(
+            get_freifahren_risk_assessment(
+                client=openai_client,
+                user_prompt=user_prompt,
+                freifahren_prompt=prompt_freifahren,
+            )
         )
         print(f"Assistant's response:\n{response}")
 
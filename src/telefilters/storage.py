@@ -0,0 +1,21 @@
+import json
+from typing import Any
+
+from fsspec import AbstractFileSystem
+
+
+def read_json(fs: AbstractFileSystem, path: str, default: Any = None) -> Any:
+    """Read a JSON file from an fsspec filesystem, returning default if it does not exist"""
+    if not fs.exists(path):
+        return default
+    with fs.open(path, "r") as f:
+        return json.load(f)
+
+
+def write_json(fs: AbstractFileSystem, path: str, data: Any) -> None:
+    """Write data as JSON to an fsspec filesystem, creating the parent directory"""
+    parent = path.rsplit("/", 1)[0]
+    if parent != path:
+        fs.makedirs(parent, exist_ok=True)
+    with fs.open(path, "w") as f:
+        json.dump(data, f)
@@ -0,0 +1,100 @@
+import logging
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+from fsspec import AbstractFileSystem
+from fsspec.implementations.local import LocalFileSystem
+
+from telefilters.storage import read_json, write_json
+from telefilters.telegram.records import MessageRecord, as_record
+
+logger = logging.getLogger(__name__)
+
+MAX_CONTEXT_WORDS = 80  # Length of the running summary the model is asked to keep
+
+
+@dataclass
+class ConversationState:
+    """What the previous runs already analyzed of one conversation"""
+    last_id: int = 0  # Highest analyzed message id, 0 for messages without ids
+    last_timestamp: int = 0  # Unix epoch seconds of the newest analyzed message
+    context: str = ""  # Running summary of the analyzed messages
+
+
+def conversation_key(conversation: dict) -> str:
+    """Key of a conversation in the state store: chat name and forum topic"""
+    return f"{conversation.get('chat_name', 'Untitled')}:{conversation.get('topic') or ''}"
+
+
+class AnalysisStateStore:
+    """
+    Persists per-conversation analysis state between runs.
+
+    A run only sends the messages newer than the stored state together with
+    the running summary of everything before them. Like the checkpoint store
+    this is a single JSON file on any fsspec filesystem.
+    """
+
+    def __init__(self, path: str, fs: AbstractFileSystem):
+        self.path = path
+        self.fs = fs
+        self._states: Dict[str, ConversationState] = {}
+        self._dirty = False
+
+    def load(self) -> "AnalysisStateStore":
+        """Read the state from the filesystem, starting empty if there is none"""
+        states = read_json(self.fs, self.path)
+        if states is not None:
+            self._states = {key: ConversationState(**state) for key, state in states.items()}
+            logger.info(f"Loaded analysis state of {len(self._states)} conversations from {self.path}")
+        return self
+
+    def save(self) -> None:
+        """Write the state back if any conversation was analyzed"""
+        if not self._dirty:
+            return
+        write_json(self.fs, self.path, {key: asdict(state) for key, state in self._states.items()})
+        self._dirty = False
+        logger.info(f"Saved analysis state of {len(self._states)} conversations to {self.path}")
+
+    def get(self, conversation: dict) -> ConversationState:
+        """Return the state of a conversation, empty if it was never analyzed"""
+        return self._states.get(conversation_key(conversation), ConversationState())
+
+    def new_messages(self, conversation: dict) -> List[MessageRecord]:
+        """
+        Messages of a conversation that were not analyzed yet.
+
+        Messages are compared by id when they have one and by timestamp
+        otherwise, e.g. when read from a JSON dump.
+        """
+        state = self.get(conversation)
+        messages = [as_record(msg) for msg in conversation.get("messages", [])]
+        return [
+            msg for msg in messages
+            if (msg.id > state.last_id if msg.id is not None else (msg.timestamp or 0) > state.last_timestamp)
+        ]
+
+    def update(self, conversation: dict, analyzed: List[MessageRecord], context: Optional[str]) -> None:
+        """Move the state of a conversation past the analyzed messages"""
+        if not analyzed:
+            return
+        state = self.get(conversation)
+        self._states[conversation_key(conversation)] = ConversationState(
+            last_id=max([state.last_id] + [msg.id for msg in analyzed if msg.id is not None]),
+            last_timestamp=max([state.last_timestamp] + [msg.timestamp or 0 for msg in analyzed]),
+            context=context if context is not None else state.context,
+        )
+        self._dirty = True
+
+
+def s3_analysis_state(bucket_path: str, fs: Optional[AbstractFileSystem] = None) -> AnalysisStateStore:
+    """Analysis state in the user data bucket, using the S3FileSystem from auth"""
+    if fs is None:
+        from telefilters.auth import fs
+    return AnalysisStateStore(f"{bucket_path}/checkpoints/analysis.json", fs).load()
+
+
+def local_analysis_state(path: str) -> AnalysisStateStore:
+    """Analysis state in a local JSON file"""
+    return AnalysisStateStore(path, LocalFileSystem()).load()
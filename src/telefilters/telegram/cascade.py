@@ -0,0 +1,112 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Optional
+
+from openai import AsyncOpenAI
+
+from telefilters import llm
+
+logger = logging.getLogger(__name__)
+
+CLASSIFIER_MODEL = "gpt-4o-mini"  # Decides whether a conversation is worth summarizing
+SUMMARY_MODEL = "gpt-4o"  # Summarizes the conversations the classifier escalates
+ESCALATION_THRESHOLD = 0.5  # Conversations scoring at or above are escalated
+
+# Scores of the classifier's answers; anything else counts as uncertain
+ANSWER_SCORES = {"yes": 1.0, "unsure": 0.5, "no": 0.0}
+UNCERTAIN_SCORE = 0.5
+
+
+def _classifier_prompt():
+        return """You are screening Telegram conversations from Berlin communities.
+
+Does the conversation contain an event or meetup, or a request for help or information?
+Offers, general announcements, introductions, flatshares and job offers do not count.
+
+Answer with exactly one word: yes, no or unsure.
+"""
+
+
+@dataclass
+class CascadeStats:
+    classified: int = 0
+    escalated: int = 0
+    classifier_seconds: float = 0.0
+    summaries: int = 0
+    summary_seconds: float = 0.0
+
+    @property
+    def escalation_rate(self) -> Optional[float]:
+        return self.escalated / self.classified if self.classified else None
+
+    @property
+    def saved_seconds(self) -> float:
+        """Summary latency avoided by the classifier, net of the classifier's own latency"""
+        if not self.summaries:
+            return 0.0
+        skipped = self.classified - self.escalated
+        return skipped * self.summary_seconds / self.summaries - self.classifier_seconds
+
+
+class Cascade:
+    """
+    Two-tier analysis: a cheap model screens each conversation and only
+    positive or uncertain ones are sent to the summary model.
+
+    The classifier answers yes, no or unsure in one word, which is
+    scored with ANSWER_SCORES and compared with the threshold. A failing
+    classifier call escalates, so the cascade never loses a conversation the
+    summary model would have seen.
+    """
+
+    def __init__(
+        self,
+        classifier_model: str = CLASSIFIER_MODEL,
+        summary_model: str = SUMMARY_MODEL,
+        threshold: float = ESCALATION_THRESHOLD
+    ):
+        self.classifier_model = classifier_model
+        self.summary_model = summary_model
+        self.threshold = threshold
+        self.stats = CascadeStats()
+
+    async def score(self, client: AsyncOpenAI, content: str) -> float:
+        """Relevance score of a rendered conversation between 0 and 1"""
+        messages = [
+            {"role": "system", "content": _classifier_prompt()},
+            {"role": "user", "content": content},
+        ]
+        params = {"model": self.classifier_model, "max_tokens": 2, "temperature": 0}
+        answer = await llm.complete(client, messages, **params)
+        return ANSWER_SCORES.get((answer or "").strip().strip(".").lower(), UNCERTAIN_SCORE)
+
+    async def escalate(self, client: AsyncOpenAI, content: str) -> bool:
+        """Whether a rendered conversation should go to the summary model"""
+        start = time.monotonic()
+        try:
+            escalated = await self.score(client, content) >= self.threshold
+        except Exception as e:
+            logger.warning(f"Classifier failed, escalating: {e}")
+            escalated = True
+        self.stats.classifier_seconds += time.monotonic() - start
+        self.stats.classified += 1
+        self.stats.escalated += escalated
+        return escalated
+
+    async def summarize(self, call: Awaitable[str]) -> str:
+        """Await a summary call, recording its latency to estimate the latency saved"""
+        start = time.monotonic()
+        response = await call
+        self.stats.summaries += 1
+        self.stats.summary_seconds += time.monotonic() - start
+        return response
+
+    def log_stats(self) -> None:
+        rate = self.stats.escalation_rate
+        logger.info(
+            f"Cascade {self.classifier_model} -> {self.summary_model}: "
+            f"escalated {self.stats.escalated} of {self.stats.classified}"
+            + (f" ({rate:.0%})" if rate is not None else "")
+            + f", classifier {self.stats.classifier_seconds:.1f}s, saved {self.stats.saved_seconds:.1f}s"
+        )
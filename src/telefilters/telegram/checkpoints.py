@@ -0,0 +1,70 @@
+import logging
+from typing import Dict, Optional
+
+from fsspec import AbstractFileSystem
+from fsspec.implementations.local import LocalFileSystem
+
+from telefilters.storage import read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """
+    Persists the highest message id seen per dialog and per forum topic.
+
+    The store is a single JSON file on any fsspec filesystem, so the same code
+    runs against S3 in the Lambda and against a local file in development.
+    """
+
+    def __init__(self, path: str, fs: AbstractFileSystem):
+        self.path = path
+        self.fs = fs
+        self._checkpoints: Dict[str, int] = {}
+        self._dirty = False
+
+    @staticmethod
+    def dialog_key(dialog_id: int) -> str:
+        return str(dialog_id)
+
+    @staticmethod
+    def topic_key(channel_id: int, topic_id: int) -> str:
+        return f"{channel_id}:{topic_id}"
+
+    def load(self) -> "CheckpointStore":
+        """Read the checkpoints from the filesystem, starting empty if there are none"""
+        checkpoints = read_json(self.fs, self.path)
+        if checkpoints is not None:
+            self._checkpoints = {key: int(value) for key, value in checkpoints.items()}
+            logger.info(f"Loaded {len(self._checkpoints)} checkpoints from {self.path}")
+        return self
+
+    def save(self) -> None:
+        """Write the checkpoints back if any of them moved"""
+        if not self._dirty:
+            return
+        write_json(self.fs, self.path, self._checkpoints)
+        self._dirty = False
+        logger.info(f"Saved {len(self._checkpoints)} checkpoints to {self.path}")
+
+    def get(self, key: str) -> int:
+        """Return the highest message id seen for key, 0 if it was never scraped"""
+        return self._checkpoints.get(key, 0)
+
+    def update(self, key: str, message_id: int) -> None:
+        """Move the checkpoint for key forward to message_id"""
+        if message_id > self._checkpoints.get(key, 0):
+            self._checkpoints[key] = message_id
+            self._dirty = True
+
+
+def s3_checkpoint_store(bucket_path: str, fs: Optional[AbstractFileSystem] = None) -> CheckpointStore:
+    """Checkpoint store in the user data bucket, using the S3FileSystem from auth"""
+    if fs is None:
+        from telefilters.auth import fs
+    return CheckpointStore(f"{bucket_path}/checkpoints/messages.json", fs).load()
+
+
+def local_checkpoint_store(path: str) -> CheckpointStore:
+    """Checkpoint store in a local JSON file"""
+    return CheckpointStore(path, LocalFileSystem()).load()
@@ -0,0 +1,246 @@
+import logging
+import re
+import zlib
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from telefilters.telegram.records import as_record
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_THRESHOLD = 0.6  # Estimated Jaccard similarity of near-duplicates
+SHINGLE_WORDS = 3  # Words per shingle
+MIN_WORDS = 8  # Shorter messages are never treated as duplicates
+NUM_PERMUTATIONS = 32
+LSH_BANDS = 8  # Bands of NUM_PERMUTATIONS // LSH_BANDS rows, candidates above ~0.6 similarity
+
+_PRIME = (1 << 61) - 1
+_URLS = re.compile(r"https?://\S+|t\.me/\S+")
+_WORDS = re.compile(r"\w+")
+
+
+def normalize(text: str) -> List[str]:
+    """Lowercased words of a text, without links and punctuation"""
+    return _WORDS.findall(_URLS.sub(" ", text.lower()))
+
+
+def shingles(words: Sequence[str], size: int = SHINGLE_WORDS) -> List[int]:
+    """Hashes of the overlapping word n-grams of a text"""
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return list({zlib.crc32(gram.encode("utf-8")) for gram in grams})
+
+
+class MinHasher:
+    """MinHash signatures from NUM_PERMUTATIONS universal hash functions"""
+
+    def __init__(self, num_permutations: int = NUM_PERMUTATIONS, seed: int = 1):
+        # Fixed coefficients, so signatures stay comparable between runs
+        state = seed
+        self.coefficients = []
+        for _ in range(num_permutations):
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            a = state % _PRIME or 1
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            self.coefficients.append((a, state % _PRIME))
+
+    def signature(self, hashes: Sequence[int]) -> Tuple[int, ...]:
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self.coefficients)
+
+
+def similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    """Jaccard similarity estimated from two MinHash signatures"""
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+class NearDuplicateIndex:
+    """
+    Locality-sensitive hashing index of MinHash signatures.
+
+    Each signature is split into bands and stored in one bucket per band, so
+    looking up a text only compares it with the texts sharing a bucket. Adding
+    n texts takes time linear in n.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SIMILARITY_THRESHOLD,
+        bands: int = LSH_BANDS,
+        hasher: Optional[MinHasher] = None
+    ):
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = hasher or MinHasher()
+        self.rows = len(self.hasher.coefficients) // bands
+        self.signatures: Dict[int, Tuple[int, ...]] = {}
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = defaultdict(list)
+
+    def _bands(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def match(self, text: str) -> Tuple[Optional[int], Tuple[int, ...]]:
+        """
+        Looks up the best near-duplicate of text.
+
+        Returns:
+            Key of the most similar indexed text above the threshold, or None,
+            and the signature of text to pass to add
+        """
+        signature = self.hasher.signature(shingles(normalize(text)))
+        best, best_similarity = None, self.threshold
+        for bucket in self._bands(signature):
+            for key in self.buckets.get(bucket, ()):
+                score = similarity(signature, self.signatures[key])
+                if score >= best_similarity:
+                    best, best_similarity = key, score
+        return best, signature
+
+    def add(self, key: int, signature: Tuple[int, ...]) -> None:
+        self.signatures[key] = signature
+        for bucket in self._bands(signature):
+            self.buckets[bucket].append(key)
+
+
+class ConversationDeduplicator:
+    """
+    Drops messages that repeat an earlier message of any conversation, one conversation at a time.
+
+    Cross-posted announcements are kept in the first conversation they appear
+    in, which lists the other chats under "also_posted_in". Conversations are
+    added in order, so this also works on a stream of scraped conversations.
+    """
+
+    def __init__(self, group_name: Callable[[dict], str], threshold: float = SIMILARITY_THRESHOLD):
+        self.group_name = group_name
+        self.index = NearDuplicateIndex(threshold)
+        self.owners: List[dict] = []  # Conversation of each indexed message
+        self.dropped = 0
+
+    def add(self, conversation: dict) -> Optional[dict]:
+        """
+        Deduplicates the messages of the next conversation.
+
+        Returns:
+            Copy of the conversation with the duplicates removed, None if no message is left
+        """
+        result = {**conversation, "messages": []}
+        for msg in conversation.get("messages", []):
+            content = as_record(msg).content or ""
+            if len(normalize(content)) < MIN_WORDS:
+                result["messages"].append(msg)
+                continue
+            key, signature = self.index.match(content)
+            if key is None:
+                self.index.add(len(self.owners), signature)
+                self.owners.append(result)
+                result["messages"].append(msg)
+                continue
+            self.dropped += 1
+            owner = self.owners[key]
+            name = self.group_name(conversation)
+            if owner is not result and name not in owner.get("also_posted_in", []):
+                owner["also_posted_in"] = owner.get("also_posted_in", []) + [name]
+        return result if result["messages"] else None
+
+
+def dedup_conversations(
+    conversations: List[dict],
+    group_name: Callable[[dict], str],
+    threshold: float = SIMILARITY_THRESHOLD
+) -> List[dict]:
+    """
+    Drops messages that repeat an earlier message of any conversation.
+
+    Cross-posted announcements are kept in the first conversation they appear
+    in, which lists the other chats under "also_posted_in". Conversations left
+    without messages are dropped, so they cost no LLM call.
+
+    Args:
+        conversations: Scraped conversations
+        group_name: Display name of a conversation
+        threshold: Estimated Jaccard similarity above which messages are duplicates
+
+    Returns:
+        Copies of the conversations with the duplicates removed
+    """
+    deduplicator = ConversationDeduplicator(group_name, threshold)
+    kept = [result for result in map(deduplicator.add, conversations) if result is not None]
+    if deduplicator.dropped:
+        logger.info(
+            f"Dropped {deduplicator.dropped} duplicate messages, "
+            f"{len(conversations) - len(kept)} conversations left empty"
+        )
+    return kept
+
+
+def collapse_entries(
+    entries: List[Tuple[List[str], str]],
+    threshold: float = SIMILARITY_THRESHOLD
+) -> List[str]:
+    """
+    Merges digest entries that describe the same topic.
+
+    Args:
+        entries: Markdown entries with the chats each one comes from, the
+            entry's own chat first
+        threshold: Estimated Jaccard similarity above which summaries are duplicates
+
+    Returns:
+        Markdown entries in their original order, each duplicate folded into
+        the first entry and its chats listed there
+    """
+    index = NearDuplicateIndex(threshold)
+    merged: List[Tuple[List[str], str]] = []
+    for sources, markdown in entries:
+        summary = markdown.split("\n", 1)[-1]
+        key, signature = index.match(summary)
+        if key is None:
+            index.add(len(merged), signature)
+            merged.append((list(sources), markdown))
+            continue
+        merged_sources = merged[key][0]
+        merged_sources.extend(source for source in sources if source not in merged_sources)
+
+    collapsed = [
+        markdown + (f"\n_Also in: {', '.join(sources[1:])}_" if len(sources) > 1 else "")
+        for sources, markdown in merged
+    ]
+    if len(collapsed) < len(entries):
+        logger.info(f"Collapsed {len(entries) - len(collapsed)} duplicate digest entries")
+    return collapsed
+
+
+class EntryDeduplicator:
+    """
+    Streaming form of collapse_entries for entries that are sent as soon as they exist.
+
+    Entries already sent cannot list chats found later, so a later entry with
+    a near-identical summary is dropped instead of merged.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.index = NearDuplicateIndex(threshold)
+        self.count = 0
+        self.dropped = 0
+
+    def add(self, sources: List[str], markdown: str) -> Optional[str]:
+        """
+        Checks the next entry against the entries sent before.
+
+        Args:
+            sources: Chats the entry comes from, the entry's own chat first
+            markdown: Markdown entry
+
+        Returns:
+            The entry with its other chats listed, None if it repeats an earlier entry
+        """
+        key, signature = self.index.match(markdown.split("\n", 1)[-1])
+        if key is not None:
+            self.dropped += 1
+            return None
+        self.index.add(self.count, signature)
+        self.count += 1
+        return markdown + (f"\n_Also in: {', '.join(sources[1:])}_" if len(sources) > 1 else "")
@@ -0,0 +1,191 @@
+import logging
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+from fsspec import AbstractFileSystem
+from fsspec.implementations.local import LocalFileSystem
+from telethon import TelegramClient, utils
+from telethon.tl.types import Channel, InputPeerChannel, InputPeerChat, InputPeerUser, PeerChannel, PeerUser, User
+
+from telefilters.storage import read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+FULL_REFRESH_INTERVAL = 7 * 24 * 60 * 60  # Seconds between refreshes that rebuild the index from all dialogs
+
+
+def dialog_kind(entity: Any) -> str:
+    """
+    Works out the kind of chat behind a dialog entity.
+
+    Args:
+        entity: Dialog entity
+
+    Returns:
+        One of "forum", "megagroup", "channel", "user" or "chat"
+    """
+    if getattr(entity, 'forum', False):
+        return "forum"
+    if getattr(entity, 'megagroup', False):
+        return "megagroup"
+    if isinstance(entity, Channel):
+        return "channel"
+    if isinstance(entity, User):
+        return "user"
+    return "chat"
+
+
+@dataclass
+class DialogEntry:
+    """Metadata of a dialog as stored in the index"""
+    id: int  # Marked peer id, as in Dialog.id
+    name: str
+    kind: str
+    access_hash: Optional[int]
+    folder_id: Optional[int]
+    pinned: bool
+    last_date: int  # Unix epoch seconds of the last message
+
+    @classmethod
+    def from_dialog(cls, dialog: Any) -> "DialogEntry":
+        return cls(
+            id=dialog.id,
+            name=dialog.name,
+            kind=dialog_kind(dialog.entity),
+            access_hash=getattr(dialog.entity, 'access_hash', None),
+            folder_id=dialog.folder_id,
+            pinned=bool(dialog.pinned),
+            last_date=int(dialog.date.timestamp()) if dialog.date else 0,
+        )
+
+    def input_peer(self) -> Any:
+        """Build the input peer from the stored id and access hash, without any request"""
+        peer_id, peer_type = utils.resolve_id(self.id)
+        if peer_type is PeerChannel:
+            return InputPeerChannel(peer_id, self.access_hash or 0)
+        if peer_type is PeerUser:
+            return InputPeerUser(peer_id, self.access_hash or 0)
+        return InputPeerChat(peer_id)
+
+
+class IndexedDialog(NamedTuple):
+    """Stand-in for a Telethon Dialog that the scraper can fetch without iter_dialogs"""
+    id: int
+    name: str
+    kind: str
+    entity: Any
+    input_entity: Any
+    folder_id: Optional[int]
+    pinned: bool
+    date: datetime
+
+
+class DialogIndex:
+    """
+    Persisted index of the account's dialogs.
+
+    Telegram lists dialogs by last activity, so a refresh only walks
+    iter_dialogs until it reaches a dialog that has not changed since the
+    previous refresh. Scrapes then go straight to the indexed peers.
+
+    An incremental refresh never sees dialogs the account has left or quiet
+    dialogs that were renamed, so every FULL_REFRESH_INTERVAL seconds the
+    index is rebuilt from all dialogs instead.
+    """
+
+    def __init__(self, path: str, fs: AbstractFileSystem):
+        self.path = path
+        self.fs = fs
+        self.entries: Dict[int, DialogEntry] = {}
+        self.refreshed_at = 0
+        self.full_refreshed_at = 0.0  # Unix epoch seconds of the last full refresh
+
+    def load(self) -> "DialogIndex":
+        """Read the index from the filesystem, starting empty if there is none"""
+        data = read_json(self.fs, self.path)
+        if data is not None:
+            self.refreshed_at = data["refreshed_at"]
+            self.full_refreshed_at = data.get("full_refreshed_at", 0.0)
+            self.entries = {entry["id"]: DialogEntry(**entry) for entry in data["dialogs"]}
+            logger.info(f"Loaded {len(self.entries)} dialogs from {self.path}")
+        return self
+
+    def save(self) -> None:
+        write_json(self.fs, self.path, {
+            "refreshed_at": self.refreshed_at,
+            "full_refreshed_at": self.full_refreshed_at,
+            "dialogs": [asdict(entry) for entry in self.entries.values()],
+        })
+
+    async def refresh(self, client: TelegramClient, full: bool = False) -> int:
+        """
+        Updates the index with the dialogs that changed since the last refresh.
+
+        Args:
+            client: Telegram client instance
+            full: Rebuild the index from all dialogs instead of stopping at the
+                first unchanged one, done anyway once FULL_REFRESH_INTERVAL has passed
+
+        Returns:
+            Number of dialogs that were added or updated
+        """
+        now = time.time()
+        full = full or now - self.full_refreshed_at > FULL_REFRESH_INTERVAL
+        # A full refresh starts empty, so dialogs that are not listed any more drop out
+        entries = {} if full else dict(self.entries)
+        updated = 0
+        async for dialog in client.iter_dialogs():
+            entry = DialogEntry.from_dialog(dialog)
+            known = entry.id in self.entries
+            # Pinned dialogs are listed first regardless of their activity
+            if not full and known and not entry.pinned and entry.last_date <= self.refreshed_at:
+                break
+            entries[entry.id] = entry
+            updated += 1
+        self.entries = entries
+        if full:
+            self.full_refreshed_at = now
+
+        if self.entries:
+            self.refreshed_at = max(entry.last_date for entry in self.entries.values())
+        logger.info(f"Refreshed {updated} of {len(self.entries)} indexed dialogs")
+        return updated
+
+    def dialogs(self) -> List[IndexedDialog]:
+        """Indexed dialogs in the order of iter_dialogs: pinned first, then by last activity"""
+        entries = sorted(self.entries.values(), key=lambda entry: (not entry.pinned, -entry.last_date))
+        dialogs = []
+        for entry in entries:
+            input_peer = entry.input_peer()
+            dialogs.append(IndexedDialog(
+                id=entry.id,
+                name=entry.name,
+                kind=entry.kind,
+                entity=input_peer,
+                input_entity=input_peer,
+                folder_id=entry.folder_id,
+                pinned=entry.pinned,
+                date=datetime.fromtimestamp(entry.last_date, timezone.utc),
+            ))
+        return dialogs
+
+    async def iter_dialogs(self, client: TelegramClient) -> AsyncIterator[IndexedDialog]:
+        """Refresh the index and iterate over its dialogs, like client.iter_dialogs"""
+        await self.refresh(client)
+        self.save()
+        for dialog in self.dialogs():
+            yield dialog
+
+
+def s3_dialog_index(bucket_path: str, fs: Optional[AbstractFileSystem] = None) -> DialogIndex:
+    """Dialog index in the user data bucket, using the S3FileSystem from auth"""
+    if fs is None:
+        from telefilters.auth import fs
+    return DialogIndex(f"{bucket_path}/cache/dialogs.json", fs).load()
+
+
+def local_dialog_index(path: str) -> DialogIndex:
+    """Dialog index in a local JSON file"""
+    return DialogIndex(path, LocalFileSystem()).load()
@@ -1,17 +1,159 @@
+import asyncio
 import logging
 import os
+import time
+import typing as t
 
 import aiohttp
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
+EDIT_INTERVAL = 1.0  # Seconds between edits of a streamed message, Telegram allows about one per second
+TYPING_INTERVAL = 4.0  # Seconds between typing indicators, each one shows for up to five seconds
+MAX_MESSAGE_LENGTH = 4096
 
-async def sendReply(bot_token: str, chat_id: int, message: str):
-    """Async version of sendReply using aiohttp"""
+
+async def _post(bot_token: str, method: str, payload: t.Dict, session: t.Optional[aiohttp.ClientSession] = None) -> t.Dict:
+    """Call a Bot API method and return its decoded response"""
+    url = f"https://api.telegram.org/bot{bot_token}/{method}"
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await _post(bot_token, method, payload, session)
+    async with session.post(url, json=payload) as response:
+        return await response.json()
+
+
+async def sendReply(bot_token: str, chat_id: int, message: str) -> t.Optional[int]:
+    """Async version of sendReply using aiohttp, returns the id of the sent message"""
     reply = {"chat_id": chat_id, "text": message}
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=reply) as response:
-            await response.json()
-            logger.info(f"Sent reply: {message}")
+    response = await _post(bot_token, "sendMessage", reply)
+    logger.info(f"Sent reply: {message}")
+    return (response.get("result") or {}).get("message_id")
+
+
+async def editMessageText(
+    bot_token: str,
+    chat_id: int,
+    message_id: int,
+    message: str,
+    session: t.Optional[aiohttp.ClientSession] = None,
+) -> t.Dict:
+    """Replace the text of a message the bot sent"""
+    payload = {"chat_id": chat_id, "message_id": message_id, "text": message[:MAX_MESSAGE_LENGTH]}
+    return await _post(bot_token, "editMessageText", payload, session)
+
+
+async def sendChatAction(
+    bot_token: str,
+    chat_id: int,
+    action: str = "typing",
+    session: t.Optional[aiohttp.ClientSession] = None,
+) -> t.Dict:
+    """Show a chat action such as the typing indicator"""
+    return await _post(bot_token, "sendChatAction", {"chat_id": chat_id, "action": action}, session)
+
+
+class StreamingReply:
+    """
+    Streams text into one bot message by editing it in place.
+
+    update() only stores the latest text, so it can be called for every
+    streamed chunk; a background task edits the message at most once per
+    `interval` seconds, waits longer when Telegram answers with retry_after,
+    and keeps the typing indicator on until finish().
+
+    Usage:
+        async with StreamingReply(bot_token, chat_id, message_id) as reply:
+            reply.update(partial_text)
+            await reply.finish(final_text)
+    """
+
+    def __init__(self, bot_token: str, chat_id: int, message_id: int, interval: float = EDIT_INTERVAL):
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self.edits = 0
+        self._text = ""
+        self._shown = ""
+        self._next_edit = 0.0
+        self._changed = asyncio.Event()
+        self._session: t.Optional[aiohttp.ClientSession] = None
+        self._task: t.Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "StreamingReply":
+        self._session = aiohttp.ClientSession()
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    def update(self, text: str) -> None:
+        """Show text once the edit rate allows it"""
+        self._text = text
+        self._changed.set()
+
+    async def finish(self, text: str) -> None:
+        """Stop the background edits and show the final text"""
+        self._text = text
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for _ in range(3):  # Telegram may ask to wait with retry_after
+            await asyncio.sleep(max(0.0, self._next_edit - time.monotonic()))
+            await self._edit()
+            if not self._pending():
+                return
+
+    def _pending(self) -> bool:
+        """Whether the message does not show the latest text yet, as far as it fits"""
+        return self._text.strip()[:MAX_MESSAGE_LENGTH] != self._shown
+
+    async def _edit(self) -> None:
+        text = self._text.strip()[:MAX_MESSAGE_LENGTH]
+        if not text or text == self._shown:
+            return
+        response = await editMessageText(self.bot_token, self.chat_id, self.message_id, text, self._session)
+        retry_after = (response.get("parameters") or {}).get("retry_after")
+        if retry_after:
+            logger.warning(f"Telegram asked to wait {retry_after}s before editing again")
+            self._next_edit = time.monotonic() + retry_after
+            return
+        self._shown = text
+        self.edits += 1
+        self._next_edit = time.monotonic() + self.interval
+
+    async def _run(self) -> None:
+        typing_at = 0.0
+        while True:
+            try:
+                now = time.monotonic()
+                if now >= typing_at:
+                    await sendChatAction(self.bot_token, self.chat_id, session=self._session)
+                    typing_at = now + TYPING_INTERVAL
+                self._changed.clear()
+                if self._pending() and now >= self._next_edit:
+                    await self._edit()
+
+                # Sleep until the next typing indicator, or the next allowed edit if text is waiting
+                wake_at = typing_at
+                if self._pending():
+                    wake_at = min(wake_at, self._next_edit)
+                wait = wake_at - time.monotonic()
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to update streamed reply: {e}")
+                await asyncio.sleep(self.interval)
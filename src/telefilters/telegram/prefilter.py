@@ -0,0 +1,237 @@
+import logging
+import math
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fsspec import AbstractFileSystem
+
+from telefilters.storage import read_json, write_json
+from telefilters.telegram.records import as_record
+
+logger = logging.getLogger(__name__)
+
+PREFILTER_THRESHOLD = 0.3  # Conversations scoring below are skipped
+MODEL_FEATURES = 2**18  # Size of the hashed feature space
+
+# Signals of the topics the digest looks for, in English and German
+RULES: Dict[str, Tuple[float, re.Pattern]] = {
+    "event": (0.6, re.compile(
+        r"\b(event|meetup|meet-up|party|workshop|concert|gig|festival|potluck|picnic|jam|"
+        r"dinner|brunch|screening|lecture|talk|exhibition|invite|invitation|join us|come by|"
+        r"rsvp|tickets?|sign up|volunteers?|shifts?|veranstaltung|treffen|einladung|feier|fest|"
+        r"konzert|vortrag|ausstellung|kommt vorbei)\b", re.IGNORECASE)),
+    "request": (0.6, re.compile(
+        r"(\b(looking for|does anyone|does anybody|anyone (have|know|got|up for|wants?)|"
+        r"can someone|could someone|can anyone|who (has|can|wants)|need(s|ed)? (help|a|an|some)|"
+        r"help with|borrow|recommendations?|suche|wer hat|kann jemand|hat jemand|brauche)\b)",
+        re.IGNORECASE)),
+    "date": (0.4, re.compile(
+        r"\b(today|tonight|tomorrow|weekend|monday|tuesday|wednesday|thursday|friday|saturday|"
+        r"sunday|heute|morgen|wochenende|montag|dienstag|mittwoch|donnerstag|freitag|samstag|"
+        r"sonntag|january|february|march|april|may|june|july|august|september|october|november|"
+        r"december|\d{1,2}\.\d{1,2}\.?(\d{2,4})?|\d{1,2}(st|nd|rd|th))\b", re.IGNORECASE)),
+    "time": (0.4, re.compile(
+        r"\b(\d{1,2}[:.]\d{2}\s*(h|uhr)?|\d{1,2}\s*(am|pm|uhr)|noon|midnight)\b", re.IGNORECASE)),
+    "address": (0.3, re.compile(
+        r"(\b\d{5}\b|\w+(straße|strasse|str\.|platz|allee|damm|ufer|weg)\b|\bhaus der\b)",
+        re.IGNORECASE)),
+}
+
+_WORDS = re.compile(r"\w+")
+
+
+def conversation_text(conversation: dict) -> str:
+    """Message texts of a conversation, the topic title included"""
+    texts = [conversation.get("topic") or ""]
+    texts.extend(as_record(msg).content for msg in conversation.get("messages", []))
+    return "\n".join(texts)
+
+
+def rule_hits(text: str) -> List[str]:
+    """Names of the rules matching text"""
+    return [name for name, (_, pattern) in RULES.items() if pattern.search(text)]
+
+
+def rule_score(text: str) -> float:
+    """Combine the weights of the matching rules into a score between 0 and 1"""
+    miss = 1.0
+    for name in rule_hits(text):
+        miss *= 1.0 - RULES[name][0]
+    return 1.0 - miss
+
+
+class HashedLinearModel:
+    """
+    Logistic regression over hashed word unigrams, bigrams and rule hits.
+
+    Small enough to train on a few hundred labelled conversations and to
+    score thousands per second on one CPU.
+    """
+
+    def __init__(self, n_features: int = MODEL_FEATURES, weights: Optional[Dict[int, float]] = None, bias: float = 0.0):
+        self.n_features = n_features
+        self.weights: Dict[int, float] = weights or {}
+        self.bias = bias
+
+    def features(self, text: str) -> Dict[int, float]:
+        words = _WORDS.findall(text.lower())
+        names = [f"w:{word}" for word in words]
+        names.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+        names.extend(f"r:{name}" for name in rule_hits(text))
+        indices = {zlib.crc32(name.encode("utf-8")) % self.n_features for name in names}
+        value = 1.0 / math.sqrt(len(indices)) if indices else 0.0
+        return {index: value for index in indices}
+
+    def _margin(self, features: Dict[int, float]) -> float:
+        return self.bias + sum(self.weights.get(index, 0.0) * value for index, value in features.items())
+
+    def predict(self, text: str) -> float:
+        """Probability that text is relevant"""
+        margin = max(-30.0, min(30.0, self._margin(self.features(text))))
+        return 1.0 / (1.0 + math.exp(-margin))
+
+    def train(
+        self,
+        examples: Iterable[Tuple[str, bool]],
+        epochs: int = 10,
+        learning_rate: float = 0.5,
+        l2: float = 1e-4
+    ) -> "HashedLinearModel":
+        """
+        Fits the model with stochastic gradient descent.
+
+        Args:
+            examples: Pairs of conversation text and whether it was relevant
+            epochs: Passes over the examples
+            learning_rate: Step size
+            l2: L2 regularization strength
+
+        Returns:
+            The trained model
+        """
+        data = [(self.features(text), 1.0 if label else 0.0) for text, label in examples]
+        for _ in range(epochs):
+            for features, label in data:
+                margin = max(-30.0, min(30.0, self._margin(features)))
+                gradient = 1.0 / (1.0 + math.exp(-margin)) - label
+                self.bias -= learning_rate * gradient
+                for index, value in features.items():
+                    weight = self.weights.get(index, 0.0)
+                    self.weights[index] = weight - learning_rate * (gradient * value + l2 * weight)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "n_features": self.n_features,
+            "bias": self.bias,
+            "weights": {str(index): weight for index, weight in self.weights.items() if weight},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HashedLinearModel":
+        weights = {int(index): weight for index, weight in data["weights"].items()}
+        return cls(data["n_features"], weights, data["bias"])
+
+    def save(self, fs: AbstractFileSystem, path: str) -> None:
+        write_json(fs, path, self.to_dict())
+
+    @classmethod
+    def load(cls, fs: AbstractFileSystem, path: str) -> Optional["HashedLinearModel"]:
+        data = read_json(fs, path)
+        return cls.from_dict(data) if data is not None else None
+
+
+def training_examples(conversations: List[dict], entries: List[list]) -> List[Tuple[str, bool]]:
+    """
+    Labels past conversations with the results of the full LLM analysis.
+
+    Args:
+        conversations: Analyzed conversations
+        entries: Markdown entries the analysis produced for each conversation
+
+    Returns:
+        Pairs of conversation text and whether the analysis found anything
+    """
+    return [
+        (conversation_text(conversation), bool(conversation_entries))
+        for conversation, conversation_entries in zip(conversations, entries)
+    ]
+
+
+@dataclass
+class PrefilterStats:
+    scored: int = 0
+    skipped: int = 0  # In shadow mode: would have been skipped
+    # Shadow mode: LLM positives the prefilter would have skipped, and all LLM positives
+    missed_positives: int = 0
+    positives: int = 0
+
+    @property
+    def recall(self) -> Optional[float]:
+        if not self.positives:
+            return None
+        return 1.0 - self.missed_positives / self.positives
+
+
+class Prefilter:
+    """
+    Cheap relevance score ahead of the LLM.
+
+    Uses the hashed linear model when one is given and the keyword rules
+    otherwise. Conversations scoring below the threshold are skipped; in
+    shadow mode nothing is skipped and the would-be decisions are checked
+    against the LLM results to measure recall.
+    """
+
+    def __init__(
+        self,
+        threshold: float = PREFILTER_THRESHOLD,
+        model: Optional[HashedLinearModel] = None,
+        shadow: bool = False
+    ):
+        self.threshold = threshold
+        self.model = model
+        self.shadow = shadow
+        self.stats = PrefilterStats()
+
+    def score(self, conversation: dict) -> float:
+        text = conversation_text(conversation)
+        self.stats.scored += 1
+        if self.model is not None:
+            return self.model.predict(text)
+        return rule_score(text)
+
+    def keep(self, conversation: dict) -> bool:
+        """Whether a conversation passes the prefilter"""
+        return self.score(conversation) >= self.threshold
+
+    def select(self, conversations: List[dict]) -> Tuple[List[dict], List[bool]]:
+        """
+        Applies the prefilter to conversations.
+
+        Returns:
+            Conversations to analyze, and whether each input conversation passed
+        """
+        passed = [self.keep(conversation) for conversation in conversations]
+        self.stats.skipped += passed.count(False)
+        if self.shadow:
+            return conversations, passed
+        return [conversation for conversation, keep in zip(conversations, passed) if keep], passed
+
+    def record_shadow(self, passed: List[bool], entries: List[list]) -> None:
+        """Compare shadow decisions with the entries the LLM produced"""
+        for keep, conversation_entries in zip(passed, entries):
+            if conversation_entries:
+                self.stats.positives += 1
+                if not keep:
+                    self.stats.missed_positives += 1
+
+    def log_stats(self) -> None:
+        skipped = "would skip" if self.shadow else "skipped"
+        recall = self.stats.recall
+        logger.info(
+            f"Prefilter scored {self.stats.scored}, {skipped} {self.stats.skipped}"
+            + (f", recall {recall:.2f} on {self.stats.positives} positives" if recall is not None else "")
+        )
@@ -1,13 +1,28 @@
+import asyncio
 import json
 import logging
-from datetime import datetime
 from pathlib import Path
-from typing import Tuple
+from typing import AsyncIterator, Awaitable, List, Optional, Tuple
 
 from openai import AsyncOpenAI
 
+from telefilters import llm, llm_cache, llm_metrics, tokens
+from telefilters.telegram.analysis_state import MAX_CONTEXT_WORDS, AnalysisStateStore
+from telefilters.telegram import dedup
+from telefilters.telegram.cascade import SUMMARY_MODEL, Cascade
+from telefilters.telegram.prefilter import Prefilter
+from telefilters.telegram.records import as_record, to_datetime
+
 logger = logging.getLogger(__name__)
 
+ANALYSIS_CONCURRENCY = 8  # LLM requests in flight when analyzing a scrape
+BATCH_TOKEN_BUDGET = 3000  # Conversation tokens packed into one request in batching mode
+SMALL_CONVERSATION_TOKENS = 600  # Larger conversations are always analyzed on their own
+BATCH_TOKENS_PER_CONVERSATION = 250  # Completion tokens allowed per packed conversation
+TRUNCATION_POLICY = tokens.TruncationPolicy()  # Applied to every conversation before it is sent
+ANALYSIS_QUEUE_SIZE = 8  # Scraped conversations buffered ahead of the analysis workers
+ANALYSIS_WORKERS = 4  # Conversations analyzed at the same time when streaming
+
 
 def _base_prompt():
         return """You are analyzing Telegram conversations from Berlin communities.
@@ -50,34 +65,94 @@ OR
 VERY IMPORTANT: Only respond if the conversation is relevant!
 """
 
-async def _call_llm(client: AsyncOpenAI, content: str) -> str:
-    # Log the actual content being sent to LLM
+async def _call_llm(client: AsyncOpenAI, content: str, model: str = SUMMARY_MODEL) -> str:
+    # Identical requests are answered from the response cache, see llm.complete
 
     messages = [
         {"role": "system", "content": _base_prompt()},
         {"role": "user", "content": content},
     ]
+    params = {"model": model, "max_tokens": 500}
+
+    return await llm.complete(client, messages, **params)
+
+def _batch_prompt():
+        return _base_prompt() + """
+# Several conversations
+
+You will receive several conversations. Each one starts with a line "Conversation <id>".
+Analyze every conversation on its own and respond with a single JSON array that
+contains one object per relevant topic, with the id of its conversation:
+[
+    {
+        "id": 0,
+        "type": "event|request|offer|announcement",
+        "summary": "..."
+    }
+]
+Leave out conversations without relevant topics. Respond with [] if none is relevant.
+"""
 
-    api_calls += 1  # Increment counter
-    completion = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=500,
-    )
-    return completion.choices[0].message.content
+async def _call_llm_batch(client: AsyncOpenAI, content: str, conversations: int, model: str = SUMMARY_MODEL) -> str:
+    """Analyze several packed conversations in one request"""
+
+    messages = [
+        {"role": "system", "content": _batch_prompt()},
+        {"role": "user", "content": content},
+    ]
+    params = {"model": model, "max_tokens": BATCH_TOKENS_PER_CONVERSATION * conversations}
+
+    return await llm.complete(client, messages, **params)
+
+def _incremental_prompt():
+        return _base_prompt() + f"""
+# Running analysis
+
+Earlier messages of this conversation may already have been analyzed. Their summary
+is given under "Earlier context", followed only by the new messages. Use the context
+to understand the new messages, but only report topics that the new messages raise
+or change. Respond with a JSON object:
+{{
+    "topics": [
+        {{
+            "type": "event|request|offer|announcement",
+            "summary": "..."
+        }}
+    ],
+    "context": "At most {MAX_CONTEXT_WORDS} words summarizing the whole conversation so far, including the new messages"
+}}
+Use an empty topics list if nothing new is relevant, but always update the context.
+"""
+
+async def _call_llm_incremental(client: AsyncOpenAI, content: str, model: str = SUMMARY_MODEL) -> str:
+    """Analyze the new messages of a conversation together with its running summary"""
+
+    messages = [
+        {"role": "system", "content": _incremental_prompt()},
+        {"role": "user", "content": content},
+    ]
+    params = {"model": model, "max_tokens": 500}
+
+    # A malformed reply is not cached, so the messages get a fresh answer next run
+    return await llm.complete(client, messages, cacheable=_is_json, **params)
+
+def _strip_code_block(response: str) -> str:
+    """Clean the response if it's wrapped in markdown code blocks"""
+    if response.startswith("```json"):
+        return response.replace("```json", "").replace("```", "").strip()
+    return response
+
+def _is_json(response: str) -> bool:
+    try:
+        json.loads(_strip_code_block(response))
+    except json.JSONDecodeError:
+        return False
+    return True
 
 def _parse_llm_response(response: str) -> dict:
     """Parse the LLM response, handling both pure JSON and markdown-formatted JSON"""
     try:
-        # Clean the response if it's wrapped in markdown code blocks
-        cleaned_response = response
-        if response.startswith("```json"):
-            cleaned_response = (
-                response.replace("```json", "").replace("```", "").strip()
-            )
-
-        # Parse the cleaned JSON
-        return json.loads(cleaned_response)
+        return json.loads(_strip_code_block(response))
 
     except json.JSONDecodeError:
         logger.error(f"Failed to parse LLM response: {response}")
@@ -85,10 +160,12 @@ def _parse_llm_response(response: str) -> dict:
 
 def _format_analysis_to_markdown(group: str, analysis: str) -> str:
     """Format a single analysis entry as markdown"""
-    try:
-        # Parse the JSON response from LLM using the new parser
-        data = _parse_llm_response(analysis)
+    # Parse the JSON response from LLM using the new parser
+    return _format_entries_to_markdown(group, _parse_llm_response(analysis))
 
+def _format_entries_to_markdown(group: str, data) -> list:
+    """Format parsed analysis entries of one group as markdown"""
+    try:
         # Handle both single entry and array of entries
         if isinstance(data, list):
             entries = data
@@ -110,11 +187,24 @@ def _format_analysis_to_markdown(group: str, analysis: str) -> str:
         logger.error(f"Failed to format analysis: {str(e)}")
         return []
 
-async def analyze_conversations(openai_client, scraped_content):
+async def analyze_conversations(
+    openai_client,
+    scraped_content,
+    concurrency: int = ANALYSIS_CONCURRENCY,
+    batch_budget: Optional[int] = None,
+    prefilter: Optional[Prefilter] = None,
+    state: Optional[AnalysisStateStore] = None,
+    cascade: Optional[Cascade] = None,
+    deduplicate: bool = False,
+):
     """Analyze conversations from the latest messages file and save results"""
     try:
         # Analyze messages
-        markdown_entries = await _analyze_data(openai_client, scraped_content)
+        with llm_metrics.tags(command="digest"):
+            markdown_entries = await _analyze_data(
+                openai_client, scraped_content, concurrency, batch_budget, prefilter, state, cascade, deduplicate
+            )
+        llm_cache.get_cache().log_stats()
 
         return markdown_entries
 
@@ -122,48 +212,397 @@ async def analyze_conversations(openai_client, scraped_content):
         logger.error(f"Error analyzing conversations: {e}")
         return []
 
-async def _analyze_data(openai_client, scraped_content: dict) -> list:
-    """Internal method to analyze the conversation data"""
-    markdown_entries = []
-    conversations = scraped_content.get("conversations", [])
+def _conversation_prompt(
+    conversation: dict,
+    truncation: Optional[tokens.TruncationPolicy] = None,
+    context: Optional[str] = None,
+) -> str:
+    """Render a conversation as the user content of an analysis request
+
+    Messages may be MessageRecord tuples from the scraper or dicts read from
+    a JSON dump. Conversations above the token budget of the truncation
+    policy (TRUNCATION_POLICY by default) are shortened, and the prompt then
+    states how many messages and tokens were kept. A running summary of
+    earlier messages is included when `context` is given.
+    """
+    chat_name = conversation.get("chat_name", "Untitled")
+    topic = conversation.get("topic", "")
+    messages = [as_record(msg) for msg in conversation.get("messages", [])]
+
+    content = f"Channel: {chat_name}\n"
+    if topic:
+        content += f"Topic: {topic}\n"
+    if context is not None:
+        content += f"Earlier context: {context or 'none, this is the first analysis'}\n"
+
+    lines = []
+    for msg in messages:
+        moment = to_datetime(msg)
+
+        # Format message with weekday and timestamp
+        if moment:
+            lines.append(f"[{moment:%A %Y-%m-%d %H:%M}] {msg.name}: {msg.content}\n")
+        else:
+            lines.append(f"{msg.name}: {msg.content}\n")
+
+    kept = tokens.truncate(lines, truncation or TRUNCATION_POLICY, [msg.forwarded for msg in messages])
+    if kept.truncated:
+        content += (
+            f"Note: conversation shortened to {len(kept.lines)} of {len(lines)} messages "
+            f"({kept.tokens_kept} of {kept.tokens_in} tokens)\n"
+        )
+        logger.info(
+            f"Truncated {_group_name(conversation)} from {kept.tokens_in} to {kept.tokens_kept} tokens"
+        )
+
+    content += "\nMessages:\n"
+    content += "".join(kept.lines)
+    return content
+
+def _group_name(conversation: dict) -> str:
+    chat_name = conversation.get("chat_name", "Untitled")
+    topic = conversation.get("topic", "")
+    return f"{chat_name}{' - Topic: ' + topic if topic else ''}"
+
+async def _summarize(cascade: Optional[Cascade], call: Awaitable[str]) -> str:
+    """Await a summary call, timed by the cascade if there is one"""
+    return await cascade.summarize(call) if cascade else await call
+
+async def _analyze_conversation(openai_client, conversation: dict, cascade: Optional[Cascade] = None) -> list:
+    """Analyze a single conversation and return its markdown entries
+
+    With a cascade, the conversation is only summarized if the classifier
+    model escalates it.
+    """
+    if not conversation.get("messages"):
+        return []
 
-    total = len(conversations)
-    processed = 0
+    content = _conversation_prompt(conversation)
+    if cascade and not await cascade.escalate(openai_client, content):
+        return []
+    model = cascade.summary_model if cascade else SUMMARY_MODEL
+    analysis = await _summarize(cascade, _call_llm(openai_client, content, model))
+    return _format_analysis_to_markdown(_group_name(conversation), analysis)
+
+async def _analyze_incremental(
+    openai_client,
+    conversation: dict,
+    state: AnalysisStateStore,
+    cascade: Optional[Cascade] = None,
+) -> list:
+    """Analyze only the messages added since the last run, with the running summary of the rest
+
+    New messages the cascade's classifier does not escalate count as
+    analyzed and leave the running summary unchanged.
+    """
+    new_messages = state.new_messages(conversation)
+    if not new_messages:
+        return []
 
+    delta = {**conversation, "messages": new_messages}
+    content = _conversation_prompt(delta, context=state.get(conversation).context)
+    if cascade and not await cascade.escalate(openai_client, content):
+        state.update(conversation, new_messages, None)
+        return []
+    model = cascade.summary_model if cascade else SUMMARY_MODEL
+    data = _parse_llm_response(await _summarize(cascade, _call_llm_incremental(openai_client, content, model)))
+    if data == {}:
+        # Unparseable reply, the messages stay new and are sent again next run
+        return []
+    if not isinstance(data, dict) or "topics" not in data:
+        # Answered in the plain format, keep the previous context
+        topics, context = data, None
+    else:
+        topics, context = data["topics"], data.get("context")
+
+    state.update(conversation, new_messages, context)
+    return _format_entries_to_markdown(_group_name(conversation), topics)
+
+def _pack_conversations(conversations: List[dict], budget: int) -> List[List[dict]]:
+    """Pack consecutive small conversations into batches of at most `budget` tokens
+
+    Conversations above SMALL_CONVERSATION_TOKENS, or above the budget, get a
+    batch of their own. Batches keep the order of the conversations.
+    """
+    batches = []
+    batch: List[dict] = []
+    batch_tokens = 0
     for conversation in conversations:
-        chat_name = conversation.get("chat_name", "Untitled")
-        topic = conversation.get("topic", "")
-        messages = conversation.get("messages", [])
-
-        if not messages:
+        conversation_tokens = tokens.count_tokens(_conversation_prompt(conversation))
+        if conversation_tokens > min(SMALL_CONVERSATION_TOKENS, budget):
+            if batch:
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batches.append([conversation])
             continue
+        if batch and batch_tokens + conversation_tokens > budget:
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(conversation)
+        batch_tokens += conversation_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def _analyze_batch(openai_client, batch: List[dict], cascade: Optional[Cascade] = None) -> List[list]:
+    """Analyze packed conversations in one request and split the results per conversation
+
+    With a cascade, every conversation is classified first and only the
+    escalated ones are packed into the summary request.
+    """
+    if len(batch) == 1:
+        return [await _analyze_conversation(openai_client, batch[0], cascade)]
+
+    escalated = list(range(len(batch)))
+    if cascade:
+        decisions = await asyncio.gather(*[
+            cascade.escalate(openai_client, _conversation_prompt(conversation)) for conversation in batch
+        ])
+        escalated = [index for index, escalate in enumerate(decisions) if escalate]
+
+    markdown_entries: List[list] = [[] for _ in batch]
+    if len(escalated) == 1:
+        index = escalated[0]
+        model = cascade.summary_model if cascade else SUMMARY_MODEL
+        analysis = await _summarize(cascade, _call_llm(openai_client, _conversation_prompt(batch[index]), model))
+        markdown_entries[index] = _format_analysis_to_markdown(_group_name(batch[index]), analysis)
+        return markdown_entries
+    if not escalated:
+        return markdown_entries
 
-        group_name = f"{chat_name}{' - Topic: ' + topic if topic else ''}"
-
-        content = f"Channel: {chat_name}\n"
-        if topic:
-            content += f"Topic: {topic}\n"
-        content += "\nMessages:\n"
-
-        for msg in messages:
-            name = msg.get("name", "Unknown")
-            text = msg.get("content", "")
-            timestamp = msg.get("timestamp", "")
-            weekday = datetime.fromisoformat(timestamp).strftime("%A")
-
-            # Format message with timestamp
-            if timestamp:
-                content += f"[{weekday} {timestamp}] {name}: {text}\n"
-            else:
-                content += f"{name}: {text}\n"
-
-        analysis = await _call_llm(openai_client, content)
-        processed += 1
+    content = "\n\n".join(
+        f"Conversation {position}\n{_conversation_prompt(batch[index])}"
+        for position, index in enumerate(escalated)
+    )
+    model = cascade.summary_model if cascade else SUMMARY_MODEL
+    data = _parse_llm_response(await _summarize(cascade, _call_llm_batch(openai_client, content, len(escalated), model)))
+    if not isinstance(data, list):
+        data = [data]
+
+    for position, index in enumerate(escalated):
+        entries = [entry for entry in data if isinstance(entry, dict) and entry.get("id") == position]
+        markdown_entries[index] = _format_entries_to_markdown(_group_name(batch[index]), entries)
+    return markdown_entries
+
+async def _analyze_safely(
+    openai_client,
+    conversation: dict,
+    state: Optional[AnalysisStateStore] = None,
+    cascade: Optional[Cascade] = None,
+) -> list:
+    """Analyze a conversation like _analyze_data does, logging a failure instead of raising it"""
+    try:
+        with llm_metrics.tags(conversation=_group_name(conversation)):
+            if state:
+                return await _analyze_incremental(openai_client, conversation, state, cascade)
+            return await _analyze_conversation(openai_client, conversation, cascade)
+    except Exception as e:
+        logger.error(f"Error analyzing {_group_name(conversation)}: {e}")
+        return []
 
-        entries = _format_analysis_to_markdown(group_name, analysis)
-        markdown_entries.extend(entries)
+async def _analyze_data(
+    openai_client,
+    scraped_content: dict,
+    concurrency: int = ANALYSIS_CONCURRENCY,
+    batch_budget: Optional[int] = None,
+    prefilter: Optional[Prefilter] = None,
+    state: Optional[AnalysisStateStore] = None,
+    cascade: Optional[Cascade] = None,
+    deduplicate: bool = False,
+) -> list:
+    """Internal method to analyze the conversation data
+
+    All conversations are dispatched at once with at most `concurrency`
+    LLM requests in flight. Entries keep the order of the conversations and a
+    failing conversation only loses its own entries.
+
+    With `batch_budget`, consecutive small conversations are packed into
+    shared requests of up to that many tokens; a failing batch loses the
+    entries of all its conversations.
+
+    With a prefilter, conversations it scores as clearly irrelevant are not
+    sent at all. In shadow mode everything is sent and the prefilter's
+    decisions are compared with the results.
+
+    With an analysis state store, conversations are analyzed one by one and
+    only their messages newer than the stored state are sent, together with
+    the running summary of the earlier ones. Conversations without new
+    messages are skipped; the state is saved once all are analyzed.
+
+    With a cascade, a cheap classifier model screens each conversation and
+    only the ones it escalates are summarized.
+
+    With `deduplicate`, messages cross-posted in several chats are only
+    analyzed in the first one, and entries with near-identical summaries are
+    merged into one that lists all their chats.
+    """
+    conversations = [
+        conversation for conversation in scraped_content.get("conversations", [])
+        if conversation.get("messages")
+    ]
+    if state:
+        total = sum(len(conversation["messages"]) for conversation in conversations)
+        conversations = [conversation for conversation in conversations if state.new_messages(conversation)]
+        new = sum(len(state.new_messages(conversation)) for conversation in conversations)
+        logger.info(f"Analyzing {new} new of {total} messages in {len(conversations)} conversations")
+    if deduplicate:
+        conversations = dedup.dedup_conversations(conversations, _group_name)
+    if prefilter:
+        conversations, passed = prefilter.select(conversations)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    if batch_budget and not state:
+        batches = _pack_conversations(conversations, batch_budget)
+    else:
+        batches = [[conversation] for conversation in conversations]
+
+    async def analyze(batch: List[dict]) -> List[list]:
+        async with semaphore:
+            try:
+                with llm_metrics.tags(conversation=", ".join(map(_group_name, batch))):
+                    if state:
+                        return [await _analyze_incremental(openai_client, batch[0], state, cascade)]
+                    return await _analyze_batch(openai_client, batch, cascade)
+            except Exception as e:
+                logger.error(f"Error analyzing {', '.join(map(_group_name, batch))}: {e}")
+                return [[] for _ in batch]
+
+    results = await asyncio.gather(*[analyze(batch) for batch in batches])
+    conversation_entries = [entries for batch_entries in results for entries in batch_entries]
+
+    if state:
+        state.save()
+    if cascade:
+        cascade.log_stats()
+    if prefilter:
+        if prefilter.shadow:
+            prefilter.record_shadow(passed, conversation_entries)
+        prefilter.log_stats()
+    if deduplicate:
+        return dedup.collapse_entries([
+            ([_group_name(conversation)] + conversation.get("also_posted_in", []), entry)
+            for conversation, entries in zip(conversations, conversation_entries)
+            for entry in entries
+        ])
+    return [entry for entries in conversation_entries for entry in entries]
+
+async def analyze_conversation_stream(
+    openai_client,
+    conversations: AsyncIterator[dict],
+    queue_size: int = ANALYSIS_QUEUE_SIZE,
+    workers: int = ANALYSIS_WORKERS,
+    prefilter: Optional[Prefilter] = None,
+    state: Optional[AnalysisStateStore] = None,
+    cascade: Optional[Cascade] = None,
+    deduplicate: bool = False,
+) -> AsyncIterator[str]:
+    """Analyze conversations while they are still being scraped.
+
+    The scraper feeds a bounded queue, so it pauses when the analysis falls
+    `queue_size` conversations behind. `workers` analysis tasks drain the
+    queue and markdown entries are yielded as soon as each conversation is
+    analyzed. A failing conversation is logged and skipped. Stopping the
+    iteration early cancels the scraper and the workers.
+
+    Conversations go through the same steps as in analyze_conversations:
+    the analysis state, deduplication, the prefilter and the cascade, tagged
+    with command="digest". Batching is not supported, every conversation is
+    analyzed on its own. With `deduplicate`, entries already yielded cannot
+    list chats found later, so a later near-identical entry is dropped
+    instead of merged. The analysis state is saved only once the stream has
+    been consumed completely.
+
+    Args:
+        openai_client: AsyncOpenAI client
+        conversations: Async iterator of conversations, e.g. scraper.iter_conversations
+        queue_size: Maximum number of scraped conversations waiting for analysis
+        workers: Number of conversations analyzed at the same time
+        prefilter: Optional prefilter, as in analyze_conversations
+        state: Optional analysis state store, as in analyze_conversations
+        cascade: Optional classifier cascade, as in analyze_conversations
+        deduplicate: Skip cross-posted messages and repeated entries
+
+    Yields:
+        Markdown entries in the order their conversations finish
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+    results: asyncio.Queue = asyncio.Queue()
+    deduplicator = dedup.ConversationDeduplicator(_group_name) if deduplicate else None
+    entry_deduplicator = dedup.EntryDeduplicator() if deduplicate else None
+    workers = max(1, workers)
+
+    def prepare(conversation: dict) -> Tuple[Optional[dict], bool]:
+        """The conversation as it is sent to the analysis, None if it is skipped, and the prefilter decision"""
+        if not conversation.get("messages"):
+            return None, True
+        if state and not state.new_messages(conversation):
+            return None, True
+        if deduplicator:
+            conversation = deduplicator.add(conversation)
+            if conversation is None:
+                return None, True
+        if prefilter:
+            selected, passed = prefilter.select([conversation])
+            return (selected[0] if selected else None), passed[0]
+        return conversation, True
+
+    async def produce():
+        try:
+            async for conversation in conversations:
+                conversation, passed = prepare(conversation)
+                if conversation is not None:
+                    await queue.put((conversation, passed))
+        except Exception as e:
+            logger.error(f"Error scraping conversations: {e}")
+        finally:
+            aclose = getattr(conversations, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        # Not in the finally block: after a cancellation the workers are gone and a full queue would block forever
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def consume():
+        while (item := await queue.get()) is not None:
+            conversation, passed = item
+            entries = await _analyze_safely(openai_client, conversation, state, cascade)
+            await results.put((conversation, passed, entries))
+        await results.put(None)
+
+    # Tasks copy the context they are created in, so all their LLM calls carry the tag
+    with llm_metrics.tags(command="digest"):
+        tasks = [asyncio.ensure_future(produce())]
+        tasks.extend(asyncio.ensure_future(consume()) for _ in range(workers))
 
-        return markdown_entries
+    try:
+        finished = 0
+        while finished < workers:
+            result = await results.get()
+            if result is None:
+                finished += 1
+                continue
+            conversation, passed, entries = result
+            if prefilter and prefilter.shadow:
+                prefilter.record_shadow([passed], [entries])
+            for entry in entries:
+                if entry_deduplicator:
+                    entry = entry_deduplicator.add(
+                        [_group_name(conversation)] + conversation.get("also_posted_in", []), entry
+                    )
+                    if entry is None:
+                        continue
+                yield entry
+
+        if state:
+            state.save()
+        if cascade:
+            cascade.log_stats()
+        if prefilter:
+            prefilter.log_stats()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 # negative examples
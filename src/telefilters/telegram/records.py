@@ -0,0 +1,102 @@
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, NamedTuple, Optional
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M"  # Timestamp format of the JSON output
+
+
+class MessageRecord(NamedTuple):
+    """A scraped message, kept in this compact form from the scraper until the prompt is rendered"""
+    name: Optional[str]  # None until a missing sender is resolved
+    content: str
+    timestamp: Optional[int] = None  # Unix epoch seconds, UTC
+    sender_id: Optional[int] = None
+    id: Optional[int] = None
+    forwarded: bool = False
+
+
+def _intern(name: Optional[str]) -> Optional[str]:
+    return sys.intern(name) if name else name
+
+
+def from_message(message: Any, name: Optional[str]) -> MessageRecord:
+    """
+    Builds a record from a Telegram message.
+
+    Args:
+        message: Telegram message
+        name: Display name of the sender, None if it still has to be resolved
+
+    Returns:
+        Message record with an interned sender name
+    """
+    date = message.date
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return MessageRecord(
+        name=_intern(name),
+        content=message.message,
+        timestamp=int(date.timestamp()),
+        sender_id=message.sender_id,
+        id=message.id,
+        forwarded=getattr(message, 'fwd_from', None) is not None,
+    )
+
+
+def to_datetime(record: MessageRecord) -> Optional[datetime]:
+    """UTC datetime of the record, None if it has no timestamp"""
+    if record.timestamp is None:
+        return None
+    return datetime.fromtimestamp(record.timestamp, timezone.utc)
+
+
+def to_json_dict(record: MessageRecord) -> Dict[str, Any]:
+    """Converts a record to the message layout of the JSON output"""
+    moment = to_datetime(record)
+    return {
+        "name": record.name,
+        "content": record.content,
+        "timestamp": moment.strftime(TIMESTAMP_FORMAT) if moment else None,
+    }
+
+
+def from_json_dict(msg: Dict[str, Any]) -> MessageRecord:
+    """Reads a message of the JSON output, e.g. data/crawler_output.json"""
+    timestamp = msg.get("timestamp")
+    if timestamp:
+        moment = datetime.strptime(timestamp, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+        timestamp = int(moment.timestamp())
+    return MessageRecord(
+        name=_intern(msg.get("name", "Unknown")),
+        content=msg.get("content", ""),
+        timestamp=timestamp or None,
+    )
+
+
+def as_record(msg: Any) -> MessageRecord:
+    """Accepts either a record or a JSON message and returns a record"""
+    if isinstance(msg, MessageRecord):
+        return msg
+    return from_json_dict(msg)
+
+
+def conversations_to_json(scraped_content: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converts the output of the scraper to plain JSON-serializable data.
+
+    Args:
+        scraped_content: Output of scraper.process_dialogs
+
+    Returns:
+        Copy of the output with every message record converted to a dict
+    """
+    return {
+        **scraped_content,
+        "conversations": [
+            {
+                **conversation,
+                "messages": [to_json_dict(as_record(msg)) for msg in conversation.get("messages", [])],
+            }
+            for conversation in scraped_content.get("conversations", [])
+        ],
+    }
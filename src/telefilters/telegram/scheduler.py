@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MAX_REQUEST_RATE = 50.0  # Requests per second when Telegram is not pushing back
+MIN_REQUEST_RATE = 0.5  # Lowest rate the scheduler backs off to
+REQUEST_BURST = 20  # Requests that may be sent at once after a quiet period
+RATE_BACKOFF = 0.5  # Rate multiplier applied on every FloodWait
+RATE_RECOVERY = 0.2  # Requests per second added back after every successful request
+MAX_FLOOD_RETRIES = 5  # Retries of a single request before giving up
+MAX_FLOOD_WAIT = 30  # Longest FloodWait in seconds worth waiting for inside a Lambda
+
+
+@dataclass
+class SchedulerStats:
+    requests: int = 0
+    flood_waits: int = 0
+    retries: int = 0
+    throttled_seconds: float = 0.0  # Wall-clock time in which at least one request was held back
+
+
+class RequestScheduler:
+    """
+    Token bucket that paces all RPCs of a Telegram client.
+
+    Every FloodWait halves the request rate and pauses the bucket for the
+    requested time; each successful request raises the rate again up to
+    max_rate. Requests that hit a FloodWait are retried instead of failing.
+
+    Telethon sleeps through FloodWaits of up to a minute on its own, so
+    scheduler_for turns that off on the clients it manages; the scheduler
+    then sees and adapts to all of them.
+    """
+
+    def __init__(
+        self,
+        max_rate: float = MAX_REQUEST_RATE,
+        min_rate: float = MIN_REQUEST_RATE,
+        burst: int = REQUEST_BURST,
+        max_retries: int = MAX_FLOOD_RETRIES,
+        max_flood_wait: float = MAX_FLOOD_WAIT
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self.rate = max_rate
+        self.stats = SchedulerStats()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = 0
+        self._waiting_since = 0.0
+
+    def _reserve(self) -> float:
+        """Take the next request slot and return the seconds until it starts"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # Tokens may go negative: each waiting request holds its own later slot
+        self._tokens -= 1
+        self.stats.requests += 1
+        wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return max(wait, self._paused_until - now)
+
+    async def acquire(self) -> None:
+        """Wait until a request may be sent"""
+        # The slot is taken without awaiting anything, so concurrent callers sleep side by side
+        wait = self._reserve()
+        if wait <= 0:
+            return
+        # Concurrent waits overlap, only the time in which any request waits counts as throttled
+        if not self._waiting:
+            self._waiting_since = time.monotonic()
+        self._waiting += 1
+        try:
+            while wait > 0:
+                await asyncio.sleep(wait)
+                # A FloodWait may have paused the bucket while this request slept
+                wait = self._paused_until - time.monotonic()
+        finally:
+            self._waiting -= 1
+            if not self._waiting:
+                self.stats.throttled_seconds += time.monotonic() - self._waiting_since
+
+    def _succeeded(self) -> None:
+        self.rate = min(self.max_rate, self.rate + RATE_RECOVERY)
+
+    def _flood_waited(self, e: FloodWaitError, attempt: int) -> None:
+        """Back off after a FloodWait, or re-raise it if it cannot be waited out"""
+        self.stats.flood_waits += 1
+        if attempt >= self.max_retries or e.seconds > self.max_flood_wait:
+            raise e
+        self.stats.retries += 1
+        self.rate = max(self.min_rate, self.rate * RATE_BACKOFF)
+        self._paused_until = max(self._paused_until, time.monotonic() + e.seconds)
+        self._tokens = min(self._tokens, 0.0)
+        logger.warning(f"FloodWait of {e.seconds}s, request rate lowered to {self.rate:.1f}/s")
+
+    async def run(self, request: Callable[[], Awaitable[T]]) -> T:
+        """
+        Sends a request under the scheduler and retries it after FloodWaits.
+
+        Args:
+            request: Function returning the awaitable to send, e.g. lambda: client(GetUsersRequest(...))
+
+        Returns:
+            Result of the request
+        """
+        attempt = 0
+        while True:
+            await self.acquire()
+            try:
+                result = await request()
+            except FloodWaitError as e:
+                self._flood_waited(e, attempt)
+                attempt += 1
+                continue
+            self._succeeded()
+            return result
+
+    async def iter_messages(self, client: TelegramClient, entity: Any, **kwargs) -> AsyncIterator[Any]:
+        """
+        Iterates client.iter_messages under the scheduler.
+
+        After a FloodWait the iteration resumes after the last message that was
+        already yielded, so no messages are dropped or repeated.
+
+        Args:
+            client: Telegram client instance
+            entity: Chat to read
+            **kwargs: Arguments of client.iter_messages
+
+        Yields:
+            Messages, newest first or oldest first with reverse=True
+        """
+        limit = kwargs.pop("limit", None)
+        yielded = 0
+        attempt = 0
+        while True:
+            if limit is not None and yielded >= limit:
+                return
+            await self.acquire()
+            try:
+                async for message in client.iter_messages(
+                    entity, limit=None if limit is None else limit - yielded, **kwargs
+                ):
+                    kwargs["offset_id"] = message.id
+                    yielded += 1
+                    yield message
+            except FloodWaitError as e:
+                self._flood_waited(e, attempt)
+                attempt += 1
+                continue
+            self._succeeded()
+            return
+
+
+_schedulers: "weakref.WeakKeyDictionary[Any, RequestScheduler]" = weakref.WeakKeyDictionary()
+
+
+def scheduler_for(client: TelegramClient) -> RequestScheduler:
+    """
+    Return the scheduler shared by all requests of client, creating it on first use.
+
+    FloodWaits are left to the scheduler: the client's flood_sleep_threshold
+    is set to 0 so that Telethon raises them instead of sleeping.
+    """
+    scheduler = _schedulers.get(client)
+    if scheduler is None:
+        client.flood_sleep_threshold = 0
+        scheduler = _schedulers[client] = RequestScheduler()
+    return scheduler
@@ -1,9 +1,21 @@
+import asyncio
+import logging
+from dataclasses import dataclass, replace
 from datetime import datetime, date, timezone, timedelta
-from telethon import TelegramClient
+from telethon import TelegramClient, utils
 from telethon.tl.types import Channel
 from telethon.tl.functions.channels import GetForumTopicsRequest
-from collections import OrderedDict
-from typing import Dict, List, Any, Optional, Tuple
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, List, Any, Optional, Tuple
+
+from telefilters.telegram import records
+from telefilters.telegram.checkpoints import CheckpointStore
+from telefilters.telegram.dialog_index import DialogIndex, dialog_kind
+from telefilters.telegram.records import MessageRecord
+from telefilters.telegram.scheduler import scheduler_for
+from telefilters.telegram.senders import SenderCache
+
+logger = logging.getLogger(__name__)
 
 
 def scrape_messages(client: TelegramClient):
@@ -21,6 +33,20 @@ MAX_DIALOGS = 100  # Maximum number of dialogs to process
 MAX_MESSAGES_PER_DIALOG = 100  # Maximum messages to fetch per dialog/topic
 ARCHIVED_FOLDER_ID = 1  # ID for archived folders
 TEST_MODE_DIALOG_LIMIT = 10  # Number of dialogs to process in test mode
+DIALOG_CONCURRENCY = 8  # Maximum number of dialogs fetched at the same time
+TOPIC_CONCURRENCY = 4  # Maximum number of topics fetched at the same time per forum
+
+
+@dataclass
+class FetchStats:
+    """Counts messages received from Telegram versus messages kept for the output"""
+    fetched: int = 0  # The last page of a history may also hold a few unread messages after end_date
+    kept: int = 0
+
+
+# Sender names shared by all fetches of a warm container unless a cache is passed in
+_default_sender_cache = SenderCache()
+
 
 def should_stop_processing(
     dialog: Any,
@@ -65,17 +91,162 @@ def is_valid_dialog(dialog: Any) -> bool:
         return False
     return True
 
+def is_active_topic(topic: Any, top_message_dates: Dict[int, datetime], start_date: datetime) -> bool:
+    """
+    Checks if a forum topic had any activity since start_date.
+    
+    Args:
+        topic: Forum topic to check
+        top_message_dates: Dates of the topics' latest messages by message id
+        start_date: Start of the query date range
+        
+    Returns:
+        False if the topic's latest message is older than start_date, True otherwise
+    """
+    top_date = top_message_dates.get(getattr(topic, 'top_message', None))
+    if top_date is None:
+        return True
+    if top_date.tzinfo is None:
+        top_date = top_date.replace(tzinfo=timezone.utc)
+    return top_date >= start_date
+
+async def _iter_history(
+    client: TelegramClient,
+    entity: Any,
+    start_date: datetime,
+    end_date: datetime,
+    limit: int,
+    stats: FetchStats,
+    checkpoint: int = 0,
+    **kwargs
+) -> AsyncIterator[Any]:
+    """
+    Messages of a chat or topic between start_date and end_date, oldest first.
+
+    Without a checkpoint the history is read newest first from end_date and
+    stops at start_date, so a busy chat keeps its latest `limit` messages.
+    With a checkpoint it is read oldest first after the checkpoint, so the
+    next run continues where this one stopped. Telethon sends the checkpoint
+    as the id offset, which takes priority over offset_date, so a checkpoint
+    older than the window would page through everything before start_date;
+    the read then starts over from start_date instead.
+
+    Args:
+        client: Telegram client instance
+        entity: Chat to read
+        start_date: Start of date range, timezone-aware
+        end_date: End of date range, timezone-aware
+        limit: Maximum number of messages to read
+        stats: Counters of fetched messages
+        checkpoint: Highest message id already processed, 0 for none
+        **kwargs: Further arguments of iter_messages, e.g. reply_to
+    """
+    scheduler = scheduler_for(client)
+    if not checkpoint:
+        newest_first = []
+        async for message in scheduler.iter_messages(client, entity, limit=limit, offset_date=end_date, **kwargs):
+            stats.fetched += 1
+            if message.date.replace(tzinfo=timezone.utc) < start_date:
+                break
+            newest_first.append(message)
+        for message in reversed(newest_first):
+            yield message
+        return
+
+    stale = False
+    async for message in scheduler.iter_messages(client, entity, limit=limit, reverse=True, min_id=checkpoint, **kwargs):
+        stats.fetched += 1
+        msg_date = message.date.replace(tzinfo=timezone.utc)
+        if msg_date < start_date:
+            stale = True
+            break
+        # Messages arrive oldest first, everything after this one is too new
+        if msg_date > end_date:
+            break
+        yield message
+    if not stale:
+        return
+
+    async for message in scheduler.iter_messages(client, entity, limit=limit, offset_date=start_date, reverse=True, **kwargs):
+        stats.fetched += 1
+        msg_date = message.date.replace(tzinfo=timezone.utc)
+        if msg_date > end_date:
+            break
+        if message.id > checkpoint and msg_date >= start_date:
+            yield message
+
+async def _fetch_topic_messages(
+    client: TelegramClient,
+    channel: Channel,
+    topic: Any,
+    start_date: datetime,
+    end_date: datetime,
+    my_username: str,
+    limit: int,
+    semaphore: asyncio.Semaphore,
+    stats: FetchStats,
+    checkpoints: Optional[CheckpointStore] = None,
+    senders: Optional[SenderCache] = None
+) -> List[MessageRecord]:
+    """Fetch messages of a single forum topic while holding a slot of the forum's pool"""
+    messages = []
+    senders = senders if senders is not None else _default_sender_cache
+    key = CheckpointStore.topic_key(utils.get_peer_id(channel, add_mark=False), topic.id)
+    
+    async with semaphore:
+        async for message in _iter_history(
+            client,
+            channel,
+            start_date,
+            end_date,
+            limit,
+            stats,
+            checkpoints.get(key) if checkpoints else 0,
+            reply_to=topic.id
+        ):
+            if checkpoints:
+                checkpoints.update(key, message.id)
+            if not message.message:
+                continue
+            
+            if message.out:
+                continue
+            sender_name = senders.name_for(message)
+            if sender_name == my_username:
+                continue
+            if sender_name is None and message.sender_id is None:
+                sender_name = "Unknown"
+            
+            messages.append(records.from_message(message, sender_name))
+            stats.kept += 1
+    
+    return messages
+
 async def fetch_forum_messages(
     client: TelegramClient,
     channel: Channel,
     start_date: datetime,
     end_date: datetime,
     my_username: str,
-    limit=MAX_MESSAGES_PER_DIALOG
-) -> Dict[str, List[Dict[str, str]]]:
-    """Fetch messages from forum topics"""
+    limit=MAX_MESSAGES_PER_DIALOG,
+    concurrency: int = TOPIC_CONCURRENCY,
+    stats: Optional[FetchStats] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+    senders: Optional[SenderCache] = None
+) -> Dict[str, List[MessageRecord]]:
+    """
+    Fetch messages from forum topics.
+    
+    Topics are fetched concurrently by at most `concurrency` workers per forum.
+    Topics whose latest message is older than start_date are skipped without
+    requesting their history. Each topic keeps its newest `limit` messages
+    of the date window. With checkpoints only messages newer than the
+    topic's checkpoint are requested, oldest first, and topics without new
+    messages are skipped.
+    """
     
     topics_result = {}
+    stats = stats if stats is not None else FetchStats()
     
     if start_date.tzinfo is None:
         start_date = start_date.replace(tzinfo=timezone.utc)
@@ -83,59 +254,42 @@ async def fetch_forum_messages(
         end_date = end_date.replace(tzinfo=timezone.utc)
 
     try:
-        forum_topics = await client(GetForumTopicsRequest(
+        forum_topics = await scheduler_for(client).run(lambda: client(GetForumTopicsRequest(
             channel=channel,
             offset_date=0,
             offset_id=0,
             offset_topic=0,
             limit=limit
-        ))
+        )))
         
-        topics_with_messages = 0
+        top_message_dates = {
+            message.id: message.date
+            for message in getattr(forum_topics, 'messages', None) or []
+        }
+        topics = [
+            topic for topic in forum_topics.topics[:limit]
+            if hasattr(topic, 'title') and is_active_topic(topic, top_message_dates, start_date)
+            and not (checkpoints and topic.top_message <= checkpoints.get(
+                CheckpointStore.topic_key(utils.get_peer_id(channel, add_mark=False), topic.id)
+            ))
+        ]
         
-        for topic in forum_topics.topics[:limit]:
-            if not hasattr(topic, 'title'):
-                continue
-                
-            messages = []
-            skipped_count = 0
-            date_skipped = 0
-            
-            async for message in client.iter_messages(
-                channel,
-                limit=limit,
-                reply_to=topic.id
-            ):
-                if not message.message:
-                    skipped_count += 1
-                    continue
-                
-                msg_date = message.date
-                if not (start_date <= msg_date <= end_date):
-                    date_skipped += 1
-                    continue
-                
-                if message.sender:
-                    sender_name = message.sender.username or message.sender.first_name
-                    if sender_name == my_username:
-                        skipped_count += 1
-                        continue
-                else:
-                    sender_name = "Unknown"
-                
-                messages.append({
-                    "name": sender_name,
-                    "time": str(message.date),
-                    "content": message.message
-                })
-            
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        results = await asyncio.gather(*[
+            _fetch_topic_messages(
+                client, channel, topic, start_date, end_date, my_username, limit, semaphore, stats, checkpoints, senders
+            )
+            for topic in topics
+        ])
+        
+        for topic, messages in zip(topics, results):
             if messages:
                 topics_result[topic.title] = messages
-                topics_with_messages += 1
         
         return topics_result
         
     except Exception as e:
+        logger.error(f"Error fetching forum messages: {e}")
         return {}
 
 async def fetch_messages(
@@ -143,22 +297,37 @@ async def fetch_messages(
     dialog: Any,
     start_date: datetime,
     end_date: datetime,
-    my_username: str
-) -> List[Dict[str, str]]:
+    my_username: str,
+    stats: Optional[FetchStats] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+    senders: Optional[SenderCache] = None
+) -> List[MessageRecord]:
     """
     Fetches messages from a regular chat within a date range.
     
+    At most MAX_MESSAGES_PER_DIALOG messages are read. Without checkpoints
+    these are the newest ones of the date window; with checkpoints the
+    messages after the checkpoint are read oldest first and the next run
+    continues after the last one, so busy chats are caught up without gaps.
+    
     Args:
         client: Telegram client instance
         dialog: Dialog to fetch messages from
         start_date: Start of date range
         end_date: End of date range
         my_username: Username to filter out own messages
+        stats: Optional counters for fetched and kept messages
+        checkpoints: Optional store of the highest message id seen per dialog
+        senders: Optional sender name cache, defaults to the module-wide cache
         
     Returns:
-        List of message dictionaries
+        List of message records. Senders that still need to be resolved
+        have no name yet, only a sender_id.
     """
     messages = []
+    stats = stats if stats is not None else FetchStats()
+    senders = senders if senders is not None else _default_sender_cache
+    key = CheckpointStore.dialog_key(dialog.id)
     
     # Ensure datetime objects are timezone-aware
     if start_date.tzinfo is None:
@@ -167,40 +336,36 @@ async def fetch_messages(
         end_date = end_date.replace(tzinfo=timezone.utc)
     
     try:
-        async for message in client.iter_messages(dialog, limit=MAX_MESSAGES_PER_DIALOG):
+        async for message in _iter_history(
+            client,
+            dialog,
+            start_date,
+            end_date,
+            MAX_MESSAGES_PER_DIALOG,
+            stats,
+            checkpoints.get(key) if checkpoints else 0
+        ):
+            if checkpoints:
+                checkpoints.update(key, message.id)
             if not message.message:
                 continue
-                
-            # Ensure message date is timezone-aware
-            msg_date = message.date.replace(tzinfo=timezone.utc)
-            if not (start_date <= msg_date <= end_date):
-                continue
             
-            # Improved sender name handling
-            sender_name = "Channel Post"
-            if message.sender:
-                if message.sender.username:
-                    sender_name = message.sender.username
-                elif hasattr(message.sender, 'first_name'):
-                    sender_name = message.sender.first_name
-                    if hasattr(message.sender, 'last_name') and message.sender.last_name:
-                        sender_name += f" {message.sender.last_name}"
-                else:
-                    sender_name = "Anonymous"
+            if message.out:
+                continue
+            sender_name = senders.name_for(message)
+            if sender_name is None and message.sender_id is None:
+                sender_name = "Channel Post"
                     
             if sender_name == my_username:
                 continue
                 
-            messages.append({
-                "name": sender_name,
-                "time": str(message.date),
-                "content": message.message
-            })
+            messages.append(records.from_message(message, sender_name))
+            stats.kept += 1
             
         return messages
         
     except Exception as e:
-        #logger.error(f"Error fetching messages: {e}", exc_info=True)
+        logger.error(f"Error fetching messages: {e}")
         return []
 
 async def process_dialog_messages(
@@ -209,11 +374,17 @@ async def process_dialog_messages(
     entity: Any,
     start_date: datetime,
     end_date: datetime,
-    my_username: str
+    my_username: str,
+    stats: Optional[FetchStats] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+    senders: Optional[SenderCache] = None
 ) -> Tuple[Optional[str], Any]:
     """
     Processes messages from a dialog based on its type.
     
+    Dialogs from a DialogIndex carry their kind, for Telethon dialogs it is
+    worked out from the entity.
+    
     Args:
         client: Telegram client instance
         dialog: Dialog to process
@@ -221,41 +392,186 @@ async def process_dialog_messages(
         start_date: Start of date range
         end_date: End of date range
         my_username: Username to filter out own messages
+        stats: Optional counters for fetched and kept messages
+        checkpoints: Optional store of the highest message id seen per dialog
+        senders: Optional sender name cache
         
     Returns:
         Tuple of (chat_type, messages)
     """
+    kind = getattr(dialog, 'kind', None) or dialog_kind(entity)
     try:
-        if hasattr(entity, 'forum') and entity.forum:
-            return "group", await fetch_forum_messages(client, entity, start_date, end_date, my_username)
+        if kind == "forum":
+            return "group", await fetch_forum_messages(
+                client, entity, start_date, end_date, my_username,
+                stats=stats, checkpoints=checkpoints, senders=senders
+            )
             
-        elif hasattr(entity, 'megagroup') and entity.megagroup:
+        elif kind == "megagroup":
             #logger.debug(f"Processing supergroup: {dialog.name}")
-            messages = await fetch_messages(client, dialog, start_date, end_date, my_username)
+            messages = await fetch_messages(
+                client, dialog, start_date, end_date, my_username, stats, checkpoints, senders
+            )
             return ("group", messages) if messages else (None, None)
             
-        elif isinstance(entity, Channel):
+        elif kind == "channel":
             #logger.debug(f"Processing channel: {dialog.name}")
-            messages = await fetch_messages(client, dialog, start_date, end_date, my_username)
+            messages = await fetch_messages(
+                client, dialog, start_date, end_date, my_username, stats, checkpoints, senders
+            )
             return ("channel", messages) if messages else (None, None)
             
         else:
             #logger.debug(f"Processing chat: {dialog.name}")
-            messages = await fetch_messages(client, dialog, start_date, end_date, my_username)
+            messages = await fetch_messages(
+                client, dialog, start_date, end_date, my_username, stats, checkpoints, senders
+            )
             return ("chat", messages) if messages else (None, None)
             
     except Exception as e:
-        #logger.error(f"Error processing dialog messages: {e}", exc_info=True)
+        logger.error(f"Error processing dialog messages: {e}")
         return None, None
 
+async def _fetch_dialog(
+    client: TelegramClient,
+    dialog: Any,
+    start_date: datetime,
+    end_date: datetime,
+    my_username: str,
+    semaphore: asyncio.Semaphore,
+    stats: FetchStats,
+    checkpoints: Optional[CheckpointStore] = None,
+    senders: Optional[SenderCache] = None
+) -> Tuple[Optional[str], Any]:
+    """Fetch a single dialog while holding a slot of the worker pool"""
+    async with semaphore:
+        return await process_dialog_messages(
+            client, dialog, dialog.entity, start_date, end_date, my_username, stats, checkpoints, senders
+        )
+
+def _date_range(
+    start_date: Optional[datetime],
+    end_date: Optional[datetime]
+) -> Tuple[datetime, datetime]:
+    """Fill in the default date range of the last 24 hours"""
+    end_date = end_date or datetime.now(timezone.utc)
+    start_date = start_date or end_date - timedelta(days=1)
+    return start_date, end_date
+
+async def _collect_dialogs(
+    client: TelegramClient,
+    start_date: datetime,
+    end_date: datetime,
+    dialog_index: Optional[DialogIndex] = None
+) -> List[Any]:
+    """Walk iter_dialogs, or the refreshed dialog index, and return the dialogs that should be fetched"""
+    is_24h_query = end_date - start_date <= timedelta(hours=24)
+    checked_count = 0
+    
+    dialogs = []
+    source = dialog_index.iter_dialogs(client) if dialog_index else client.iter_dialogs()
+    async for dialog in source:
+        checked_count += 1
+        
+        if not is_valid_dialog(dialog):
+            continue
+            
+        dialog_date = dialog.date
+        if should_stop_processing(dialog, dialog_date, start_date, is_24h_query, checked_count):
+            break
+
+        dialogs.append(dialog)
+        if len(dialogs) >= MAX_DIALOGS:
+            break
+    
+    return dialogs
+
+def _to_conversations(
+    dialog_name: str,
+    chat_type: str,
+    messages: Any,
+    senders: SenderCache
+) -> List[Dict[str, Any]]:
+    """
+    Converts the fetched messages of a dialog into conversations.
+    
+    Args:
+        dialog_name: Name of the dialog
+        chat_type: Type of the dialog (group, channel or chat)
+        messages: List of messages, or messages by topic title for forums
+        senders: Sender name cache used to fill in late resolved names
+        
+    Returns:
+        One conversation per forum topic, or a single conversation otherwise
+    """
+    topics = messages.items() if isinstance(messages, dict) else [(None, messages)]
+    
+    conversations = []
+    for topic, topic_messages in topics:
+        processed_messages = [
+            msg if msg.name else msg._replace(name=senders.get(msg.sender_id) or "Unknown")
+            for msg in topic_messages
+        ]
+        processed_messages.sort(key=lambda x: x.timestamp or 0)
+
+        conversation = {
+            "chat_name": dialog_name,
+            "type": chat_type,
+        }
+        if topic is not None:
+            conversation["topic"] = topic
+        conversation["messages"] = processed_messages
+        conversations.append(conversation)
+    
+    return conversations
+
 async def process_dialogs(
-    client: TelegramClient, 
+    client: TelegramClient,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    concurrency: int = DIALOG_CONCURRENCY,
+    checkpoints: Optional[CheckpointStore] = None,
+    senders: Optional[SenderCache] = None,
+    dialog_index: Optional[DialogIndex] = None
 ) -> OrderedDict:
     """
     Process dialogs and return in LLM-friendly format.
+
+    Dialogs are fetched concurrently by at most `concurrency` workers. The
+    conversations keep the order in which `iter_dialogs` returned the dialogs,
+    so the output is the same as a sequential run.
+
+    With a checkpoint store only messages newer than the last scrape are
+    fetched. The store moves past the fetched messages but is not saved here:
+    call checkpoints.save() once the digest has been produced, so messages
+    whose analysis failed are fetched again by the next run.
+
+    Sender names come from a shared cache. Senders missing from their
+    messages are resolved in one batch after all dialogs are fetched.
+
+    With a dialog index, only dialogs that changed since the index was last
+    refreshed are listed from Telegram; the rest come from the index.
+
+    All requests go through the client's RequestScheduler, which paces them
+    and retries after FloodWaits. Its request count, FloodWaits and time
+    spent throttled during this run are reported in the metadata.
+
+    Args:
+        client: Telegram client instance
+        start_date: Start of date range, defaults to 24 hours before end_date
+        end_date: End of date range, defaults to now
+        concurrency: Maximum number of dialogs fetched at the same time
+        checkpoints: Optional store of the highest message id seen per dialog and topic,
+            saved by the caller once the conversations are analyzed
+        senders: Optional sender name cache, defaults to the module-wide cache
+        dialog_index: Optional dialog index used instead of a full iter_dialogs sweep
+
+    Returns:
+        Dictionary with metadata and the list of conversations. Messages are
+        MessageRecord tuples, use records.conversations_to_json before
+        serializing the output.
     """
-    start_date = datetime.now()
-    end_date = datetime.now()
+    start_date, end_date = _date_range(start_date, end_date)
     output = {
         "metadata": {
             "date_range": {
@@ -264,92 +580,129 @@ async def process_dialogs(
             },
             "total_chats_processed": 0,
             "total_messages": 0,
+            "messages_fetched": 0,
+            "messages_kept": 0,
+            "requests": 0,
+            "flood_waits": 0,
+            "throttled_seconds": 0.0,
             "collection_time": str(datetime.now()),
         },
         "conversations": []
     }
     
-    all_messages = OrderedDict()
-    processed_count = 0
-    checked_count = 0
-    
+    scheduler = scheduler_for(client)
+    scheduler_before = replace(scheduler.stats)
     my_username = await get_me(client)
-    
-    async for dialog in client.iter_dialogs():
-        checked_count += 1
-        
-        if not is_valid_dialog(dialog):
+    dialogs = await _collect_dialogs(client, start_date, end_date, dialog_index)
+
+    stats = FetchStats()
+    senders = senders if senders is not None else _default_sender_cache
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    results = await asyncio.gather(*[
+        _fetch_dialog(client, dialog, start_date, end_date, my_username, semaphore, stats, checkpoints, senders)
+        for dialog in dialogs
+    ])
+    await senders.resolve(client)
+
+    for dialog, (chat_type, messages) in zip(dialogs, results):
+        if not (chat_type and messages):
             continue
+        for conversation in _to_conversations(dialog.name, chat_type, messages, senders):
+            output["conversations"].append(conversation)
+            output["metadata"]["total_messages"] += len(conversation["messages"])
+        output["metadata"]["total_chats_processed"] += 1
             
-        dialog_date = dialog.date
-        if should_stop_processing(dialog, dialog_date, start_date, checked_count):
-            break
-            
-        chat_type, messages = await process_dialog_messages(
-            client, dialog, dialog.entity, start_date, end_date, my_username
-        )
-        
-        if chat_type and messages:
-            all_messages[dialog.name] = {
-                "type": chat_type,
-                "messages": messages
-            }
-            processed_count += 1
-            
-    
-    for dialog_name, content in all_messages.items():
-        chat_type = content["type"]
-        messages = content["messages"]
-        
-        if isinstance(messages, dict):
-            for topic, topic_messages in messages.items():
-                processed_messages = []
-                for msg in topic_messages:
-                    message_dict = {
-                        "name": msg["name"],
-                        "content": msg["content"],
-                        "timestamp": datetime.fromisoformat(msg["time"]).strftime("%Y-%m-%d %H:%M") if msg.get("time") else None
-                    }
-                    processed_messages.append(message_dict)
-                
-                processed_messages.sort(key=lambda x: x["timestamp"], reverse=False)
-
-                output["conversations"].append({
-                    "chat_name": dialog_name,
-                    "type": chat_type,
-                    "topic": topic,
-                    "messages": processed_messages
-                })
-                output["metadata"]["total_messages"] += len(processed_messages)
-        
-        else:
-            processed_messages = []
-            for msg in messages:
-                message_dict = {
-                    "name": msg["name"],
-                    "content": msg["content"],
-                    "timestamp": datetime.fromisoformat(msg["time"]).strftime("%Y-%m-%d %H:%M") if msg.get("time") else None
-                }
-                processed_messages.append(message_dict)
-
-            processed_messages.sort(key=lambda x: x["timestamp"], reverse=False)
-            
-            output["conversations"].append({
-                "chat_name": dialog_name,
-                "type": chat_type,
-                "messages": processed_messages
-            })
-            output["metadata"]["total_messages"] += len(processed_messages)
-            
-    output["metadata"]["total_chats_processed"] = len(all_messages)
+    output["metadata"]["messages_fetched"] = stats.fetched
+    output["metadata"]["messages_kept"] = stats.kept
+    output["metadata"]["requests"] = scheduler.stats.requests - scheduler_before.requests
+    output["metadata"]["flood_waits"] = scheduler.stats.flood_waits - scheduler_before.flood_waits
+    output["metadata"]["throttled_seconds"] = round(
+        scheduler.stats.throttled_seconds - scheduler_before.throttled_seconds, 3
+    )
+
+    senders.save()
     
     return output 
 
+async def iter_conversations(
+    client: TelegramClient,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    concurrency: int = DIALOG_CONCURRENCY,
+    checkpoints: Optional[CheckpointStore] = None,
+    senders: Optional[SenderCache] = None,
+    stats: Optional[FetchStats] = None,
+    dialog_index: Optional[DialogIndex] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of process_dialogs that yields each conversation as soon as its dialog is fetched.
+
+    Conversations are yielded in dialog order, so a consumer can start
+    analyzing the first conversations while later dialogs are still
+    downloading. At most `concurrency` dialogs are fetched ahead of the
+    consumer: the next dialog is only requested once the consumer takes a
+    fetched one, so a slow consumer pauses the scrape. Stopping the
+    iteration early cancels the fetches in flight. Missing senders are
+    resolved per dialog instead of in one batch.
+
+    Args:
+        client: Telegram client instance
+        start_date: Start of date range, defaults to 24 hours before end_date
+        end_date: End of date range, defaults to now
+        concurrency: Maximum number of dialogs fetched at the same time
+        checkpoints: Optional store of the highest message id seen per dialog and topic,
+            saved by the caller once the conversations are analyzed
+        senders: Optional sender name cache, defaults to the module-wide cache
+        stats: Optional counters for fetched and kept messages
+        dialog_index: Optional dialog index used instead of a full iter_dialogs sweep
+
+    Yields:
+        Conversations in the same format as process_dialogs
+    """
+    start_date, end_date = _date_range(start_date, end_date)
+    my_username = await get_me(client)
+    dialogs = await _collect_dialogs(client, start_date, end_date, dialog_index)
+
+    stats = stats if stats is not None else FetchStats()
+    senders = senders if senders is not None else _default_sender_cache
+    # The window of dialogs being fetched, the slot of the oldest one is refilled once it is consumed
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    upcoming = iter(dialogs)
+    window: Deque[Tuple[Any, asyncio.Future]] = deque()
+
+    def fetch_next() -> None:
+        dialog = next(upcoming, None)
+        if dialog is not None:
+            window.append((dialog, asyncio.ensure_future(_fetch_dialog(
+                client, dialog, start_date, end_date, my_username, semaphore, stats, checkpoints, senders
+            ))))
+
+    for _ in range(max(1, concurrency)):
+        fetch_next()
+
+    try:
+        while window:
+            dialog, task = window.popleft()
+            chat_type, messages = await task
+            fetch_next()
+            if not (chat_type and messages):
+                continue
+            await senders.resolve(client)
+            for conversation in _to_conversations(dialog.name, chat_type, messages, senders):
+                yield conversation
+    finally:
+        tasks = [task for _, task in window]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    senders.save()
+
 
 
 async def get_me(client: TelegramClient) -> str:
     """Get the username of the authenticated user"""
-    me = await client.get_me()
+    me = await scheduler_for(client).run(client.get_me)
     username = me.username or me.first_name
     # logger.debug(f"Authenticated as user: {username}")
     return username 
\ No newline at end of file
@@ -0,0 +1,163 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+from fsspec import AbstractFileSystem
+from fsspec.implementations.local import LocalFileSystem
+from telethon import TelegramClient, utils
+from telethon.tl.functions.users import GetUsersRequest
+
+from telefilters.telegram.scheduler import scheduler_for
+from telefilters.storage import read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+SENDER_CACHE_SIZE = 2048  # Maximum number of sender names kept in memory
+
+
+def display_name(sender: Any) -> str:
+    """
+    Builds the display name of a message sender.
+
+    Args:
+        sender: User or channel that sent a message
+
+    Returns:
+        Username if set, otherwise first and last name, otherwise "Anonymous"
+    """
+    if getattr(sender, 'username', None):
+        return sender.username
+    if getattr(sender, 'first_name', None):
+        name = sender.first_name
+        if getattr(sender, 'last_name', None):
+            name += f" {sender.last_name}"
+        return name
+    return "Anonymous"
+
+
+class SenderCache:
+    """
+    Bounded LRU cache of sender display names keyed by sender id.
+
+    Senders that are not attached to their messages are collected as pending
+    and resolved together with a single users.getUsers call. Their access
+    hashes come from the session's entity cache only: client.get_input_entity
+    would send a users.getUsers of its own for every id missing there.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = SENDER_CACHE_SIZE,
+        path: Optional[str] = None,
+        fs: Optional[AbstractFileSystem] = None
+    ):
+        self.maxsize = maxsize
+        self.path = path
+        self.fs = fs
+        self._names: "OrderedDict[int, str]" = OrderedDict()
+        self._pending: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get(self, sender_id: Optional[int]) -> Optional[str]:
+        """Return the cached name for sender_id and mark it as recently used"""
+        if sender_id is None or sender_id not in self._names:
+            return None
+        self._names.move_to_end(sender_id)
+        return self._names[sender_id]
+
+    def put(self, sender_id: int, name: str) -> None:
+        """Cache name for sender_id, evicting the least recently used entry when full"""
+        self._names[sender_id] = name
+        self._names.move_to_end(sender_id)
+        self._pending.discard(sender_id)
+        while len(self._names) > self.maxsize:
+            self._names.popitem(last=False)
+
+    def name_for(self, message: Any) -> Optional[str]:
+        """
+        Returns the sender name of a message.
+
+        Args:
+            message: Telegram message
+
+        Returns:
+            Cached or freshly built name, or None if the sender is not known yet.
+            Unknown sender ids are remembered for resolve().
+        """
+        sender_id = getattr(message, 'sender_id', None)
+        name = self.get(sender_id)
+        if name is not None:
+            return name
+        if message.sender:
+            name = display_name(message.sender)
+            if sender_id is not None:
+                self.put(sender_id, name)
+            return name
+        if sender_id is not None:
+            self._pending.add(sender_id)
+        return None
+
+    async def resolve(self, client: TelegramClient) -> int:
+        """
+        Resolves all pending sender ids with one users.getUsers call.
+
+        Args:
+            client: Telegram client instance
+
+        Returns:
+            Number of senders that were resolved
+        """
+        pending = [sender_id for sender_id in self._pending if sender_id not in self._names]
+        self._pending.clear()
+        if not pending:
+            return 0
+
+        input_users = []
+        for sender_id in pending:
+            try:
+                input_users.append(utils.get_input_user(client.session.get_input_entity(sender_id)))
+            except Exception as e:
+                # Not a user or not in the session's entity cache
+                logger.debug(f"Sender {sender_id} not resolvable from the session: {e}")
+                continue
+        if not input_users:
+            return 0
+
+        try:
+            users = await scheduler_for(client).run(lambda: client(GetUsersRequest(input_users)))
+        except Exception as e:
+            logger.warning(f"Failed to resolve {len(input_users)} senders: {e}")
+            return 0
+
+        for user in users:
+            self.put(user.id, display_name(user))
+        return len(users)
+
+    def load(self) -> "SenderCache":
+        """Read persisted names if the cache has a path"""
+        names: Optional[Dict[str, str]] = read_json(self.fs, self.path) if self.path else None
+        if names is not None:
+            for sender_id, name in names.items():
+                self.put(int(sender_id), name)
+            logger.info(f"Loaded {len(self._names)} sender names from {self.path}")
+        return self
+
+    def save(self) -> None:
+        """Persist the cached names if the cache has a path"""
+        if not self.path:
+            return
+        write_json(self.fs, self.path, {str(sender_id): name for sender_id, name in self._names.items()})
+
+
+def s3_sender_cache(bucket_path: str, fs: Optional[AbstractFileSystem] = None) -> SenderCache:
+    """Sender cache persisted in the user data bucket, using the S3FileSystem from auth"""
+    if fs is None:
+        from telefilters.auth import fs
+    return SenderCache(path=f"{bucket_path}/cache/senders.json", fs=fs).load()
+
+
+def local_sender_cache(path: str) -> SenderCache:
+    """Sender cache persisted in a local JSON file"""
+    return SenderCache(path=path, fs=LocalFileSystem()).load()
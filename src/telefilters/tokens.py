@@ -0,0 +1,126 @@
+import math
+import re
+import typing as t
+from dataclasses import dataclass
+
+try:
+    import tiktoken
+except ImportError:  # Optional, the estimate below is close enough for budgeting
+    tiktoken = None
+
+KEEP_NEWEST = "keep_newest"
+HEAD_TAIL = "head_tail"
+DROP_FORWARDS = "drop_forwards"
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+_encodings: t.Dict[str, t.Any] = {}
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Count the tokens of a text locally.
+
+    Uses tiktoken when it is installed, otherwise estimates one token per
+    punctuation mark and per four characters of every word.
+
+    Args:
+        text: Text to count
+        model: Model whose tokenizer to use with tiktoken
+
+    Returns:
+        int: Number of tokens
+    """
+    if tiktoken is not None:
+        if model not in _encodings:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        return len(_encodings[model].encode(text))
+    return sum(math.ceil(len(piece) / 4) for piece in _PIECES.findall(text))
+
+
+@dataclass(frozen=True)
+class TruncationPolicy:
+    """How to shorten a conversation that does not fit its token budget.
+
+    Strategies:
+        keep_newest: drop the oldest messages
+        head_tail: keep the first and the last messages, drop the middle
+        drop_forwards: drop forwarded posts above forward_tokens first, then
+            the oldest messages
+    """
+    max_tokens: int = 3000
+    strategy: str = KEEP_NEWEST
+    forward_tokens: int = 300
+    head_share: float = 0.3  # Share of the budget kept from the start with head_tail
+
+
+@dataclass
+class Truncation:
+    lines: t.List[str]
+    tokens_in: int
+    tokens_kept: int
+    dropped: int
+
+    @property
+    def truncated(self) -> bool:
+        return self.dropped > 0
+
+
+def _keep_newest(counts: t.List[int], keep: t.List[bool], budget: int) -> None:
+    total = sum(count for count, kept in zip(counts, keep) if kept)
+    for index in range(len(counts)):
+        if total <= budget:
+            return
+        if keep[index]:
+            keep[index] = False
+            total -= counts[index]
+
+
+def truncate(
+    lines: t.List[str],
+    policy: TruncationPolicy,
+    forwarded: t.Optional[t.List[bool]] = None,
+) -> Truncation:
+    """Shorten rendered message lines, oldest first, to the policy's token budget.
+
+    Args:
+        lines: One rendered line per message, oldest first
+        policy: Truncation policy
+        forwarded: Whether each message is a forwarded post
+
+    Returns:
+        Truncation: Kept lines in their original order with token counts
+    """
+    counts = [count_tokens(line) for line in lines]
+    tokens_in = sum(counts)
+    keep = [True] * len(lines)
+
+    if tokens_in > policy.max_tokens:
+        if policy.strategy == HEAD_TAIL:
+            head_budget = int(policy.max_tokens * policy.head_share)
+            used = 0
+            head = 0
+            while head < len(lines) and used + counts[head] <= head_budget:
+                used += counts[head]
+                head += 1
+            tail = len(lines)
+            while tail > head and used + counts[tail - 1] <= policy.max_tokens:
+                used += counts[tail - 1]
+                tail -= 1
+            for index in range(head, tail):
+                keep[index] = False
+        else:
+            if policy.strategy == DROP_FORWARDS and forwarded:
+                for index, is_forward in enumerate(forwarded):
+                    if is_forward and counts[index] > policy.forward_tokens:
+                        keep[index] = False
+            _keep_newest(counts, keep, policy.max_tokens)
+
+    kept_lines = [line for line, kept in zip(lines, keep) if kept]
+    return Truncation(
+        lines=kept_lines,
+        tokens_in=tokens_in,
+        tokens_kept=sum(count for count, kept in zip(counts, keep) if kept),
+        dropped=len(lines) - len(kept_lines),
+    )
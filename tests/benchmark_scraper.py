@@ -0,0 +1,91 @@
+"""
+Scraper benchmark on a synthetic account served by the mock Telegram client.
+
+Run from the repository root, e.g.:
+
+    PYTHONPATH=src python -m tests.benchmark_scraper --dialogs 100 --latency 0.05 --concurrency 1 8
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+from telefilters.telegram.scraper import DIALOG_CONCURRENCY, process_dialogs
+from tests.mock_telegram import MockTelegramClient, build_synthetic_client
+
+
+async def run_benchmark(client: MockTelegramClient, **kwargs) -> Dict[str, Any]:
+    """
+    Runs process_dialogs once and measures it.
+
+    Args:
+        client: Mock client, usually from build_synthetic_client
+        **kwargs: Arguments passed on to process_dialogs
+
+    Returns:
+        Wall time, RPC count, kept messages, messages/sec, peak memory and
+        FloodWait statistics of the run
+    """
+    rpc_before = client.rpc_count
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        output = await process_dialogs(client, **kwargs)
+        wall_time = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    metadata = output["metadata"]
+    return {
+        "wall_time": wall_time,
+        "rpc_count": client.rpc_count - rpc_before,
+        "messages": metadata["total_messages"],
+        "messages_per_sec": metadata["total_messages"] / wall_time if wall_time else 0.0,
+        "peak_memory_mb": peak / 2**20,
+        "flood_waits": metadata["flood_waits"],
+        "throttled_seconds": metadata["throttled_seconds"],
+    }
+
+
+def _print_table(rows: List[Dict[str, Any]]) -> None:
+    columns = ["concurrency", "wall_time", "rpc_count", "messages", "messages_per_sec",
+               "peak_memory_mb", "flood_waits", "throttled_seconds"]
+    print("  ".join(f"{column:>17}" for column in columns))
+    for row in rows:
+        print("  ".join(
+            f"{row[column]:>17.3f}" if isinstance(row[column], float) else f"{row[column]:>17}"
+            for column in columns
+        ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dialogs", type=int, default=100, help="Number of dialogs")
+    parser.add_argument("--topics", type=int, default=10, help="Topics per forum")
+    parser.add_argument("--messages", type=int, default=20, help="Messages per chat or topic")
+    parser.add_argument("--forum-every", type=int, default=4, help="Every n-th dialog is a forum")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per simulated RPC")
+    parser.add_argument("--flood-limit", type=int, default=None, help="RPCs per second before FloodWait")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, DIALOG_CONCURRENCY],
+                        help="Dialog concurrency levels to compare")
+    args = parser.parse_args()
+
+    rows = []
+    for concurrency in args.concurrency:
+        client = build_synthetic_client(
+            dialogs=args.dialogs,
+            topics=args.topics,
+            messages=args.messages,
+            forum_every=args.forum_every,
+            latency=args.latency,
+            flood_limit=args.flood_limit,
+        )
+        report = asyncio.run(run_benchmark(client, concurrency=concurrency))
+        rows.append({"concurrency": concurrency, **report})
+    _print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,21 @@
+import sys
+from pathlib import Path
+
 import pytest
 
+# The Lambda ships src/ as its code root, make the same packages importable here
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
 # Configure pytest-asyncio as the default async backend
-pytest_plugins = ('pytest_asyncio',) 
\ No newline at end of file
+pytest_plugins = ('pytest_asyncio',)
+
+
+@pytest.fixture(autouse=True)
+def llm_cache():
+    """Give every test its own in-memory LLM response cache"""
+    from telefilters import llm_cache
+
+    cache = llm_cache.ResponseCache()
+    llm_cache.set_cache(cache)
+    yield cache
+    llm_cache.set_cache(None)
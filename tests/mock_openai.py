@@ -0,0 +1,67 @@
+import asyncio
+import re
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+
+class MockAsyncOpenAI:
+    """
+    Mock AsyncOpenAI client answering chat completions with a callable.
+
+    `respond` gets the request's keyword arguments and returns the message
+    content, or raises to simulate a failing call. Each call sleeps for
+    `latency` seconds; requests and the peak number in flight are recorded.
+    Requests with stream=True get the content in word-sized chunks, one every
+    `chunk_latency` seconds, followed by a chunk with the usage.
+    """
+
+    def __init__(self, respond: Callable[..., str], latency: float = 0.0, chunk_latency: float = 0.0):
+        self.respond = respond
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.requests: List[dict] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            content = self.respond(**kwargs)
+        finally:
+            self.in_flight -= 1
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, prompt_tokens_details=None)
+        if kwargs.get("stream"):
+            return self._stream(content, usage, kwargs.get("model"))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage,
+            model=kwargs.get("model"),
+        )
+
+    async def _stream(self, content: str, usage, model: str):
+        for piece in re.findall(r"\S+\s*", content):
+            await asyncio.sleep(self.chunk_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None, model=model)
+        yield SimpleNamespace(choices=[], usage=usage, model=model)
+
+
+def user_content(request: dict) -> str:
+    """Content of the last user message of a chat completion request"""
+    return request["messages"][-1]["content"]
+
+
+def conversation(chat_name: str, *texts: str, topic: Optional[str] = None) -> dict:
+    """A scraped conversation in the JSON layout with one message per text"""
+    result = {"chat_name": chat_name, "type": "group"}
+    if topic:
+        result["topic"] = topic
+    result["messages"] = [
+        {"name": "user", "content": text, "timestamp": f"2024-12-01 12:{minute:02d}"}
+        for minute, text in enumerate(texts)
+    ]
+    return result
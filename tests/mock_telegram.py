@@ -1,204 +1,333 @@
-from datetime import datetime
-from typing import Dict, List, Any
+import asyncio
+import time
+from collections import deque
 from dataclasses import dataclass
-from telethon.tl.types import Channel as TelegramChannel, User as TelegramUser
-from telegram_bot.src.processors.message_processor import GetForumTopicsRequest  # Import from the main code
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Union
 
-# Mock base classes that would normally come from telethon
-class TelegramClient:
-    pass
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.channels import GetForumTopicsRequest
+from telethon.tl.functions.users import GetUsersRequest
+from telethon.tl.types import Channel, ChatPhotoEmpty, User
 
-class Channel(TelegramChannel):
-    def __init__(self, id: int, title: str):
-        self.id = id
-        self.title = title
-        self._megagroup = False
-        self._forum = False
-        self.username = f"channel_{id}"
+PAGE_SIZE = 100  # Messages or dialogs returned by a single request, as in Telethon
 
-    @property
-    def megagroup(self) -> bool:
-        return self._megagroup
 
-    @megagroup.setter
-    def megagroup(self, value: bool):
-        self._megagroup = value
+def make_channel(id: int, title: str, megagroup: bool = False, forum: bool = False) -> Channel:
+    return Channel(
+        id=id,
+        title=title,
+        photo=ChatPhotoEmpty(),
+        date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        megagroup=megagroup,
+        forum=forum,
+        access_hash=id * 31,
+        username=f"channel_{id}",
+    )
 
-    @property
-    def forum(self) -> bool:
-        return self._forum
-
-    @forum.setter
-    def forum(self, value: bool):
-        self._forum = value
-
-class User(TelegramUser):
-    def __init__(self, id: int, username: str):
-        super().__init__(
-            id=id,
-            is_self=False,
-            contact=False,
-            mutual_contact=False,
-            deleted=False,
-            bot=False,
-            bot_chat_history=False,
-            bot_nochats=False,
-            verified=False,
-            restricted=False,
-            min=False,
-            bot_inline_geo=False,
-            support=False,
-            scam=False,
-            access_hash=0,
-        )
-        self.username = username
-        self.first_name = "Test"
-        self.last_name = "User"
 
-@dataclass
-class MockChannel(Channel):
-    id: int
-    title: str
-    megagroup: bool = False
-    forum: bool = False
-    username: str = "test_channel"
+def make_user(id: int, username: Optional[str], first_name: str = "Test", last_name: str = "User") -> User:
+    return User(id=id, username=username, first_name=first_name, last_name=last_name, access_hash=id * 17)
 
-@dataclass
-class MockUser(User):
-    id: int
-    username: str
-    first_name: str = "Test"
-    last_name: str = "User"
 
 @dataclass
 class MockMessage:
     id: int
-    text: str
+    message: str
     date: datetime
-    sender: MockUser
+    sender: Optional[User]
+    out: bool = False
+    from_id: Optional[int] = None  # Sender id of a message whose sender is not attached
+
+    @property
+    def sender_id(self) -> Optional[int]:
+        return self.sender.id if self.sender else self.from_id
+
 
 class Dialog:
-    def __init__(self, entity, folder_id=0):
+    def __init__(self, entity, folder_id=0, pinned=False, date=None):
         self.entity = entity
-        self.folder_id = 0
+        self.input_entity = utils.get_input_peer(entity)
+        self.folder_id = folder_id
         self.is_user = isinstance(entity, User)
         self.name = getattr(entity, 'title', None) or entity.username
-        self.archived = False
-        self.id = getattr(entity, 'id', 0)
-        self.date = datetime.now()
+        self.archived = folder_id == 1
+        self.pinned = pinned
+        self.id = utils.get_peer_id(entity)
+        self.date = date or datetime.now(timezone.utc)
+
 
 class MockTopic:
-    def __init__(self, id: int, title: str):
+    def __init__(self, id: int, title: str, top_message: int):
         self.id = id
         self.title = title
+        self.top_message = top_message
+
+
+class MockSession:
+    """Entity cache of a session, looked up without any request like Telethon's MemorySession"""
 
-class MockTelegramClient:
-    """Mock Telegram client with predefined test data"""
-    
     def __init__(self):
-        # Create the authenticated user (this is the bot/user running the client)
-        self.me = User(id=999, username="my_bot_user")
-        
-        # Create other users for testing
-        self.test_user = User(id=1, username="test_user")
-        self.another_user = User(id=2, username="another_user")
-        
-        # Create mock channels/groups with explicit megagroup setting
-        self.regular_group = Channel(id=100, title="Regular Group")
-        self.regular_group.megagroup = True
-        
-        self.forum_group = Channel(id=101, title="Forum Group")
-        self.forum_group.megagroup = True
-        self.forum_group.forum = True
-        
-        self.channel = Channel(id=102, title="News Channel")
-        
-        # Create mock messages
-        self.messages = {
-            self.regular_group.id: [
-                MockMessage(
-                    id=1,
-                    text="Hello from regular group",
-                    date=datetime(2024, 3, 1, 12, 0),
-                    sender=self.test_user  # Message from another user
-                ),
-                MockMessage(
-                    id=2,
-                    text="My message that should be filtered",
-                    date=datetime(2024, 3, 1, 12, 30),
-                    sender=self.me  # Message from the bot user
-                ),
-                MockMessage(
-                    id=3,
-                    text="Another user's message",
-                    date=datetime(2024, 3, 1, 13, 0),
-                    sender=self.another_user
-                )
-            ],
-            self.forum_group.id: {
-                "Topic 1": [
-                    MockMessage(
-                        id=4,
-                        text="Forum topic 1 message",
-                        date=datetime(2024, 3, 1, 13, 0),
-                        sender=self.test_user
-                    )
-                ],
-                "Topic 2": [
-                    MockMessage(
-                        id=5,
-                        text="Forum topic 2 message",
-                        date=datetime(2024, 3, 1, 14, 0),
-                        sender=self.another_user
-                    )
-                ]
-            },
-            self.channel.id: [
-                MockMessage(
-                    id=6,
-                    text="Channel announcement",
-                    date=datetime(2024, 3, 1, 15, 0),
-                    sender=self.test_user
-                )
-            ]
-        }
+        self.entities: Dict[int, Any] = {}
+
+    def get_input_entity(self, key):
+        if key in self.entities:
+            return utils.get_input_peer(self.entities[key])
+        raise ValueError(f"Could not find input entity with key {key}")
+
+
+class MockTelegramClient:
+    """
+    Mock Telegram client serving dialogs, histories and forum topics from memory.
+
+    Every simulated RPC sleeps for `latency` seconds and counts towards
+    `rpc_count`. With `flood_limit`, more than that many RPCs within one
+    second raise a FloodWaitError of `flood_seconds`. Histories being read at
+    the same time are counted in `open_histories`, their maximum in
+    `peak_histories`, and every history read is listed in `history_reads`.
+    Messages in the history pages served are counted in `messages_sent`.
+    """
+
+    def __init__(self, latency: float = 0.0, flood_limit: Optional[int] = None, flood_seconds: int = 1):
+        self.latency = latency
+        self.flood_limit = flood_limit
+        self.flood_seconds = flood_seconds
+        self.rpc_count = 0
+        self.flood_sleep_threshold = 60  # Telethon's default
+        self.flood_count = 0
+        self._recent_rpcs: deque = deque()
+        self.open_histories = 0
+        self.peak_histories = 0
+        self.history_reads: List[tuple] = []  # (chat id, topic id) of every iter_messages call
+        self.messages_sent = 0  # Messages in all history pages served
+        self.dialogs_listed = 0  # Dialogs yielded by iter_dialogs
+
+        self.me = make_user(999, "my_bot_user")
+        self.users: Dict[int, User] = {self.me.id: self.me}
+        self.session = MockSession()
+        self.session.entities[self.me.id] = self.me
+        self.dialogs: List[Dialog] = []
+        # Chat id -> messages, or topic id -> messages for forums; newest last
+        self.messages: Dict[int, Union[List[MockMessage], Dict[int, List[MockMessage]]]] = {}
+        self.topics: Dict[int, List[MockTopic]] = {}
+
+    def add_user(self, user: User) -> User:
+        self.users[user.id] = user
+        self.session.entities[user.id] = user
+        return user
+
+    def add_dialog(self, entity: Any, messages: List[MockMessage], folder_id: int = 0, pinned: bool = False):
+        messages = sorted(messages, key=lambda m: m.id)
+        date = messages[-1].date if messages else None
+        self.dialogs.append(Dialog(entity, folder_id=folder_id, pinned=pinned, date=date))
+        self.messages[entity.id] = messages
+
+    def add_forum(self, entity: Channel, topics: Dict[str, List[MockMessage]], folder_id: int = 0):
+        topic_messages = {}
+        self.topics[entity.id] = []
+        for topic_id, (title, messages) in enumerate(topics.items(), start=1):
+            messages = sorted(messages, key=lambda m: m.id)
+            topic_messages[topic_id] = messages
+            top_message = messages[-1].id if messages else 0
+            self.topics[entity.id].append(MockTopic(topic_id, title, top_message))
+        latest = [messages[-1].date for messages in topic_messages.values() if messages]
+        self.dialogs.append(Dialog(entity, folder_id=folder_id, date=max(latest) if latest else None))
+        self.messages[entity.id] = topic_messages
+
+    async def _rpc(self):
+        self.rpc_count += 1
+        if self.flood_limit is not None:
+            now = time.monotonic()
+            while self._recent_rpcs and now - self._recent_rpcs[0] > 1.0:
+                self._recent_rpcs.popleft()
+            if len(self._recent_rpcs) >= self.flood_limit:
+                self.flood_count += 1
+                raise FloodWaitError(request=None, capture=self.flood_seconds)
+            self._recent_rpcs.append(now)
+        if self.latency:
+            await asyncio.sleep(self.latency)
 
     async def get_me(self):
         """Return the authenticated user"""
+        await self._rpc()
         return self.me
 
+    async def get_input_entity(self, peer):
+        """The session's entity cache first, as in Telethon, then a users.getUsers request of its own"""
+        try:
+            return self.session.get_input_entity(peer)
+        except ValueError:
+            pass
+        await self._rpc()
+        if isinstance(peer, int) and peer in self.users:
+            return utils.get_input_peer(self.users[peer])
+        raise ValueError(f"Could not find the input entity for {peer}")
+
     async def iter_dialogs(self):
         """Simulate iterating through different chat types"""
-        yield Dialog(self.regular_group, folder_id=0)
-        yield Dialog(self.forum_group, folder_id=0)
-        yield Dialog(self.channel, folder_id=0)
-        yield Dialog(self.test_user, folder_id=1)
-
-    async def iter_messages(self, dialog, limit=None, topic=None):
-        """Simulate message iteration for a dialog"""
-        dialog_id = getattr(dialog, 'id', None)
-        messages = self.messages.get(dialog_id, [])
-        
-        if isinstance(messages, dict) and topic is not None:
-            # Handle forum topics
-            topic_messages = messages.get(f"Topic {topic + 1}", [])
-            for msg in topic_messages[:limit]:
-                yield msg
-        elif isinstance(messages, list):
-            # Handle regular messages
-            for msg in messages[:limit]:
-                yield msg
+        for index, dialog in enumerate(self.dialogs):
+            if index % PAGE_SIZE == 0:
+                await self._rpc()
+            self.dialogs_listed += 1
+            yield dialog
+
+    async def iter_messages(
+        self,
+        entity,
+        limit=None,
+        reply_to=None,
+        offset_date=None,
+        offset_id=0,
+        min_id=0,
+        reverse=False,
+        **kwargs
+    ):
+        """
+        Simulate message iteration for a dialog or forum topic.
+
+        Newest first below offset_id and before offset_date, or with reverse
+        oldest first above offset_id and from offset_date on. As in Telethon,
+        reverse mode turns min_id into offset_id, and an id offset takes
+        priority over offset_date: the date is ignored whenever one is set.
+        Messages are served in pages of PAGE_SIZE, one RPC each, and every
+        message of a page counts towards `messages_sent` even if the caller
+        stops early.
+        """
+        peer = getattr(entity, 'input_entity', entity)
+        chat_id = utils.get_peer_id(peer, add_mark=False)
+        messages = self.messages.get(chat_id, [])
+        if isinstance(messages, dict):
+            messages = messages.get(reply_to, []) if reply_to is not None else []
+
+        if reverse:
+            offset_id = max(offset_id, min_id)
+            if offset_id:
+                offset_date = None
+            selected = [
+                message for message in messages
+                if message.id > offset_id and (not offset_date or message.date >= offset_date)
+            ]
+        else:
+            if offset_id:
+                offset_date = None
+            selected = [
+                message for message in reversed(messages)
+                if message.id > min_id and (not offset_id or message.id < offset_id)
+                and (not offset_date or message.date < offset_date)
+            ]
+        if limit is not None:
+            selected = selected[:limit]
+
+        self.history_reads.append((chat_id, reply_to))
+        self.open_histories += 1
+        self.peak_histories = max(self.peak_histories, self.open_histories)
+        try:
+            await self._rpc()
+            for index, message in enumerate(selected):
+                if index % PAGE_SIZE == 0:
+                    if index:
+                        await self._rpc()
+                    self.messages_sent += len(selected[index:index + PAGE_SIZE])
+                yield message
+        finally:
+            self.open_histories -= 1
 
     async def __call__(self, request):
-        """Handle forum topic requests"""
-        print(f"Mock client received request: {type(request)}")
+        """Handle forum topic and user requests"""
+        await self._rpc()
         if isinstance(request, GetForumTopicsRequest):
-            print(f"Processing forum topics request")
-            channel_id = request.peer.id
-            if channel_id in self.messages and isinstance(self.messages[channel_id], dict):
-                topics = [
-                    MockTopic(id=idx, title=topic_name)
-                    for idx, topic_name in enumerate(self.messages[channel_id].keys())
-                ]
-                return type('TopicsResponse', (), {'topics': topics})()
-        return None 
\ No newline at end of file
+            channel_id = utils.get_peer_id(request.channel, add_mark=False)
+            topics = self.topics.get(channel_id, [])[:request.limit]
+            top_messages = [
+                message
+                for topic_id, messages in self.messages[channel_id].items()
+                for message in messages[-1:]
+            ]
+            return type('TopicsResponse', (), {'topics': topics, 'messages': top_messages})()
+        if isinstance(request, GetUsersRequest):
+            return [self.users[user.user_id] for user in request.id if user.user_id in self.users]
+        return None
+
+
+def build_test_client() -> MockTelegramClient:
+    """A small account with one chat of each type, all messages on 2024-03-01"""
+    client = MockTelegramClient()
+    me = client.me
+    test_user = client.add_user(make_user(1, "test_user"))
+    another_user = client.add_user(make_user(2, "another_user"))
+
+    regular_group = make_channel(100, "Regular Group", megagroup=True)
+    forum_group = make_channel(101, "Forum Group", megagroup=True, forum=True)
+    channel = make_channel(102, "News Channel")
+
+    client.add_dialog(regular_group, [
+        MockMessage(1, "Hello from regular group", datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc), test_user),
+        MockMessage(2, "My message that should be filtered", datetime(2024, 3, 1, 12, 30, tzinfo=timezone.utc), me, out=True),
+        MockMessage(3, "Another user's message", datetime(2024, 3, 1, 13, 0, tzinfo=timezone.utc), another_user),
+    ])
+    client.add_forum(forum_group, {
+        "Topic 1": [MockMessage(4, "Forum topic 1 message", datetime(2024, 3, 1, 13, 0, tzinfo=timezone.utc), test_user)],
+        "Topic 2": [MockMessage(5, "Forum topic 2 message", datetime(2024, 3, 1, 14, 0, tzinfo=timezone.utc), another_user)],
+    })
+    client.add_dialog(channel, [
+        MockMessage(6, "Channel announcement", datetime(2024, 3, 1, 15, 0, tzinfo=timezone.utc), test_user),
+    ])
+    client.add_dialog(test_user, [
+        MockMessage(7, "Archived chat message", datetime(2024, 3, 1, 15, 30, tzinfo=timezone.utc), test_user),
+    ], folder_id=1)
+    return client
+
+
+def build_synthetic_client(
+    dialogs: int,
+    topics: int,
+    messages: int,
+    forum_every: int = 4,
+    users: int = 200,
+    latency: float = 0.0,
+    flood_limit: Optional[int] = None,
+    now: Optional[datetime] = None
+) -> MockTelegramClient:
+    """
+    Builds a synthetic account for benchmarks.
+
+    Args:
+        dialogs: Number of dialogs
+        topics: Number of topics of each forum
+        messages: Number of messages of each chat or forum topic
+        forum_every: Every n-th dialog is a forum, the others are supergroups
+        users: Number of distinct senders
+        latency: Seconds each simulated RPC takes
+        flood_limit: RPCs per second before a FloodWaitError is raised
+        now: End of the message history, defaults to the current time
+
+    Returns:
+        Mock client whose messages are spread evenly over the 23 hours before now
+    """
+    client = MockTelegramClient(latency=latency, flood_limit=flood_limit)
+    now = now or datetime.now(timezone.utc)
+    senders = [client.add_user(make_user(1000 + i, f"user_{i}")) for i in range(users)]
+    step = timedelta(hours=23) / max(messages, 1)
+    message_id = 0
+
+    def history() -> List[MockMessage]:
+        nonlocal message_id
+        result = []
+        for i in range(messages):
+            message_id += 1
+            sender = senders[message_id % len(senders)]
+            date = now - (messages - i) * step
+            result.append(MockMessage(message_id, f"Message {message_id} from {sender.username}", date, sender))
+        return result
+
+    for index in range(dialogs):
+        if forum_every and index % forum_every == 0:
+            entity = make_channel(10_000 + index, f"Forum {index}", megagroup=True, forum=True)
+            client.add_forum(entity, {f"Topic {t}": history() for t in range(topics)})
+        else:
+            entity = make_channel(10_000 + index, f"Group {index}", megagroup=True)
+            client.add_dialog(entity, history())
+    # iter_dialogs lists the most recently active dialogs first
+    client.dialogs.sort(key=lambda dialog: dialog.date, reverse=True)
+    return client
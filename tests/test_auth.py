@@ -0,0 +1,54 @@
+import httpx
+import openai
+import pytest
+
+
+@pytest.fixture
+def openai_keys():
+    """Keys in Secrets Manager, the last one is current"""
+    return ["sk-first"]
+
+
+@pytest.fixture
+def auth(monkeypatch, openai_keys):
+    """The auth module without a client, reading its key from openai_keys"""
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+    from telefilters import auth
+
+    monkeypatch.setattr(auth, "_read_openai_key", lambda: openai_keys[-1])
+    monkeypatch.setattr(auth, "_openai_client", None)
+    monkeypatch.setattr(auth, "_openai_key", None)
+    monkeypatch.setattr(auth, "_openai_loop", None)
+    return auth
+
+
+def _rejected_key() -> openai.AuthenticationError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.AuthenticationError("Incorrect API key provided", response=httpx.Response(401, request=request), body=None)
+
+
+@pytest.mark.asyncio
+async def test_openai_client_is_reused_between_calls(auth):
+    first = await auth.get_openai_client()
+    second = await auth.get_openai_client()
+
+    assert first is second
+    assert first.api_key == "sk-first"
+
+
+@pytest.mark.asyncio
+async def test_openai_client_is_rebuilt_when_the_key_is_rejected(auth, openai_keys):
+    stale = await auth.get_openai_client()
+    openai_keys.append("sk-rotated")
+    used = []
+
+    async def call(client):
+        used.append(client)
+        if client.api_key != "sk-rotated":
+            raise _rejected_key()
+        return "ok"
+
+    assert await auth.with_openai_client(call) == "ok"
+    assert used[0] is stale
+    assert used[1] is not stale and used[1].api_key == "sk-rotated"
+    assert await auth.get_openai_client() is used[1]
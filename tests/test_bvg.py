@@ -0,0 +1,126 @@
+import pytest
+
+from telefilters.bvg.gazetteer import (
+    Sighting, extract_sightings, fold, format_sightings, load_gazetteer, split_sightings
+)
+from telefilters.bvg.graph import assess_route, load_graph, unplaced_reports
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("u9 westhafen mit blauer weste gerade ausgestiegen", [("Westhafen", "U9", None)]),
+    ("S41 Hermanstraße eingestiegen 2 Zivis", [("Hermannstraße", "S41", None)]),
+    ("Blauwesten u Turmstraße  Richtung Steglitz mittig", [("Turmstraße", "U9", "Rathaus Steglitz")]),
+    ("S46 Richtung Tempelhof an der Hermannstraße", [("Hermannstraße", "S46", "Tempelhof")]),
+    ("U8 Volta Str. ri Wittenau", [("Voltastraße", "U8", "Wittenau")]),
+    ("2 Kontrolleure Kotti und Alex U8", [("Kottbusser Tor", "U8", None), ("Alexanderplatz", "U8", None)]),
+    ("Bus 100 am Zoo", [("Zoologischer Garten", "Bus 100", None)]),
+    ("Danke!", []),
+    # Spaced line names and short aliases need a transit context
+    ("Alex told me it's 1 pm", []),
+    ("Leo and I are at the zoo", []),
+    ("Kontrolle am Alex", [("Alexanderplatz", None, None)]),
+    ("u 8 Voltastr", [("Voltastraße", "U8", None)]),
+])
+def test_sightings_from_messages(text, expected):
+    sightings = load_gazetteer().sightings("14:27", text)
+
+    assert [(s.station, s.line, s.direction) for s in sightings] == expected
+
+
+def test_fold_matches_spelling_variants():
+    assert fold("Kurfürstenstraße") == fold("Kurfuerstenstrasse") == fold("kurfurstenstr.")
+    assert fold("Hermanstr") == fold("Hermannstraße")
+
+
+def test_extract_and_format_sightings():
+    sightings = extract_sightings([("14:27", "u9 westhafen"), ("14:30", None), ("14:57", "U8 Voltastr Ri Wittenau")])
+
+    assert sightings == [
+        Sighting("14:27", "Westhafen", "U9", None),
+        Sighting("14:57", "Voltastraße", "U8", "Wittenau"),
+    ]
+    assert format_sightings(sightings) == "14:27: Westhafen (U9)\n14:57: Voltastraße (U8) towards Wittenau"
+
+
+def test_unmatched_messages_follow_the_sightings():
+    sightings, unmatched = split_sightings([
+        ("14:20", "Station: Alt-Moabit / Line: M10"),
+        ("14:27", "u9 westhafen"),
+        ("14:30", None),
+        ("14:35", "M4 am Hackeschen Markt"),
+    ])
+
+    assert unmatched == [("14:20", "Station: Alt-Moabit / Line: M10"), ("14:35", "M4 am Hackeschen Markt")]
+    assert format_sightings(sightings, unmatched) == (
+        "14:27: Westhafen (U9)\n14:20: Station: Alt-Moabit / Line: M10\n14:35: M4 am Hackeschen Markt"
+    )
+
+
+def test_route_with_transfer():
+    route = load_graph().resolve("U5 samariterstr to U8 voltastr")
+
+    assert route.lines == ["U5", "U8"]
+    assert route.transfers == ["Alexanderplatz"]
+    assert route.stations[0] == "Samariterstraße"
+    assert route.stations[-1] == "Voltastraße"
+    assert "Weinmeisterstraße" in route.stations
+
+
+def test_route_on_the_reverse_direction_of_a_circular_line():
+    route = load_graph().resolve("S42 Hermannstraße to Westkreuz")
+
+    assert route.lines == ["S41"]
+
+
+def test_route_stays_on_one_line():
+    route = load_graph().resolve("U9 Leopoldplatz nach Zoo")
+
+    assert route.lines == ["U9"]
+    assert route.stations[:2] == ["Leopoldplatz", "Amrumer Straße"]
+
+
+@pytest.mark.parametrize("text", [
+    "Wie voll ist es heute?",
+    "U8 Voltastraße",
+    "Alex to Alexanderplatz",
+    # Lines outside the graph, or not serving the station, are left to the LLM
+    "Tram M10 Warschauer to Nordbahnhof",
+    "M4 Hackescher Markt to Alexanderplatz",
+    "Bus 100 Zoo to Alex",
+    "U8 Samariterstraße to Voltastraße",
+])
+def test_unresolved_journeys(text):
+    assert load_graph().resolve(text) is None
+
+
+@pytest.mark.parametrize("sightings, level", [
+    ([Sighting("14:50", "Alexanderplatz", "U8", None)], "High"),
+    ([Sighting("13:50", "Alexanderplatz", "U8", None)], "Medium"),
+    ([Sighting("14:50", "Paracelsus-Bad", "U8", None)], "Medium"),
+    ([Sighting("14:50", "Westhafen", "U9", None), Sighting("11:00", "Voltastraße", "U8", None)], "Low"),
+])
+def test_route_assessment(sightings, level):
+    route = load_graph().resolve("U5 samariterstr to U8 voltastr")
+
+    answer = assess_route(route, sightings, "15:00")
+
+    assert answer.startswith(f"Risk: {level}\n")
+    assert answer.endswith("Route: U5 Samariterstraße → U8 Alexanderplatz → Voltastraße")
+
+
+def test_reports_on_the_route_without_a_station_are_found():
+    route = load_graph().resolve("U5 samariterstr to U8 voltastr")
+    sightings, unmatched = split_sightings([
+        ("18:40", "2 Kontrolleure in der U8 Richtung Wittenau"),
+        ("18:45", "U5 kontrolle richtung hönow"),
+        ("18:46", "U9 voll mit Kontrolleuren"),
+        ("17:00", "U8 Kontrolle"),
+    ])
+
+    assert sightings == []
+    # The graph alone would answer Low, these leave the journey to the LLM
+    assert assess_route(route, sightings, "18:50").startswith("Risk: Low")
+    assert unplaced_reports(route, unmatched, "18:50") == [
+        ("18:40", "2 Kontrolleure in der U8 Richtung Wittenau"),
+        ("18:45", "U5 kontrolle richtung hönow"),
+    ]
@@ -0,0 +1,364 @@
+import json
+
+import pytest
+
+from telefilters.telegram import process
+from tests.mock_openai import MockAsyncOpenAI, conversation, user_content
+
+
+def _event_for_channel(**request) -> str:
+    content = user_content(request)
+    if "Channel: Broken" in content:
+        raise RuntimeError("LLM unavailable")
+    channel = content.splitlines()[0].removeprefix("Channel: ")
+    return json.dumps({"type": "event", "summary": f"Event in {channel}"})
+
+
+@pytest.mark.asyncio
+async def test_analyze_data_keeps_order_and_isolates_failures():
+    client = MockAsyncOpenAI(_event_for_channel, latency=0.01)
+    scraped = {"conversations": [
+        conversation(f"Chat {i}", "Board game evening on Friday") for i in range(5)
+    ]}
+    scraped["conversations"].insert(2, conversation("Broken", "anything"))
+    scraped["conversations"].append(conversation("Empty"))
+
+    entries = await process._analyze_data(client, scraped, concurrency=3)
+
+    assert entries == [f"**Chat {i}**\n*Event*: Event in Chat {i}" for i in range(5)]
+    assert len(client.requests) == 6
+    assert client.max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_repeated_analysis_is_served_from_cache(llm_cache):
+    client = MockAsyncOpenAI(_event_for_channel)
+    scraped = {"conversations": [conversation(f"Chat {i}", "Meetup at 7pm") for i in range(3)]}
+
+    first = await process._analyze_data(client, scraped)
+    second = await process._analyze_data(client, scraped)
+
+    assert first == second
+    assert len(client.requests) == 3
+    assert (llm_cache.stats.hits, llm_cache.stats.misses) == (3, 3)
+
+
+@pytest.mark.asyncio
+async def test_disk_cache_tier_and_ttl(tmp_path):
+    from fsspec.implementations.local import LocalFileSystem
+    from telefilters.llm_cache import ResponseCache, cache_key
+
+    key = cache_key("gpt-4o", [{"role": "user", "content": "hi"}], max_tokens=500)
+    await ResponseCache(fs=LocalFileSystem(), path=str(tmp_path)).put(key, "hello")
+
+    # A fresh process only has the disk tier
+    assert await ResponseCache(fs=LocalFileSystem(), path=str(tmp_path)).get(key) == "hello"
+    assert await ResponseCache(fs=LocalFileSystem(), path=str(tmp_path), ttl=0).get(key) is None
+    assert key != cache_key("gpt-4o", [{"role": "user", "content": "hi"}], max_tokens=100)
+
+
+@pytest.mark.asyncio
+async def test_small_conversations_are_packed_into_one_request():
+    def respond(**request):
+        content = user_content(request)
+        assert "Conversation 0" in content and "Conversation 3" in content
+        return json.dumps([
+            {"id": 1, "type": "event", "summary": "Potluck on Sunday"},
+            {"id": 3, "type": "request", "summary": "Looking for a drill"},
+            {"id": 3, "type": "event", "summary": "Bike repair meetup"},
+        ])
+
+    client = MockAsyncOpenAI(respond)
+    scraped = {"conversations": [
+        conversation("Chat", "hello", topic=f"Topic {i}") for i in range(4)
+    ]}
+
+    entries = await process._analyze_data(client, scraped, batch_budget=process.BATCH_TOKEN_BUDGET)
+
+    assert len(client.requests) == 1
+    assert entries == [
+        "**Chat - Topic: Topic 1**\n*Event*: Potluck on Sunday",
+        "**Chat - Topic: Topic 3**\n*Request*: Looking for a drill",
+        "**Chat - Topic: Topic 3**\n*Event*: Bike repair meetup",
+    ]
+
+
+def test_large_conversations_are_not_packed():
+    small = conversation("Small", "hi")
+    large = conversation("Large", "x" * 4 * process.SMALL_CONVERSATION_TOKENS)
+
+    batches = process._pack_conversations([small, small, large, small], budget=3000)
+
+    assert batches == [[small, small], [large], [small]]
+
+
+def test_truncation_policies():
+    from telefilters.tokens import DROP_FORWARDS, HEAD_TAIL, TruncationPolicy, count_tokens, truncate
+
+    lines = [f"message number {i} " + "word " * 10 for i in range(10)]
+    budget = count_tokens(lines[0]) * 4
+
+    newest = truncate(lines, TruncationPolicy(max_tokens=budget))
+    assert newest.lines == lines[6:]
+    assert (newest.dropped, newest.tokens_kept) == (6, budget)
+
+    head_tail = truncate(lines, TruncationPolicy(max_tokens=budget, strategy=HEAD_TAIL, head_share=0.25))
+    assert head_tail.lines == lines[:1] + lines[7:]
+
+    forwards = lines[:3] + ["forwarded " + "post " * 200] + lines[3:5]
+    dropped = truncate(
+        forwards, TruncationPolicy(max_tokens=budget * 2, strategy=DROP_FORWARDS, forward_tokens=50),
+        forwarded=[False, False, False, True, False, False],
+    )
+    assert dropped.lines == lines[:5]
+
+
+def test_long_conversation_prompt_reports_truncation():
+    from telefilters.tokens import TruncationPolicy
+
+    long_conversation = conversation("Busy chat", *[f"message {i}" for i in range(50)])
+
+    prompt = process._conversation_prompt(long_conversation, TruncationPolicy(max_tokens=100))
+
+    assert "Note: conversation shortened to" in prompt
+    assert "message 49" in prompt and "message 0\n" not in prompt
+
+
+@pytest.mark.asyncio
+async def test_prefilter_skips_clear_negatives_and_measures_recall_in_shadow_mode():
+    from telefilters.telegram.prefilter import Prefilter
+
+    client = MockAsyncOpenAI(_event_for_channel)
+    scraped = {"conversations": [
+        conversation("Events", "Board game evening on Friday at 18:00, Standardstrasse 13a"),
+        conversation("Chatter", "haha yes", "same"),
+        conversation("Requests", "Does anyone have a drill I could borrow?"),
+    ]}
+
+    entries = await process._analyze_data(client, scraped, prefilter=Prefilter())
+    assert [entry.split("**")[1] for entry in entries] == ["Events", "Requests"]
+    assert len(client.requests) == 2
+
+    shadow = Prefilter(shadow=True)
+    await process._analyze_data(MockAsyncOpenAI(_event_for_channel), scraped, prefilter=shadow)
+    assert (shadow.stats.skipped, shadow.stats.positives) == (1, 3)
+    assert shadow.stats.recall == pytest.approx(2 / 3)
+
+
+def test_hashed_model_learns_from_labelled_outputs():
+    from telefilters.telegram.prefilter import HashedLinearModel, training_examples
+
+    conversations = [
+        conversation("A", "Potluck picnic in the park, bring food"),
+        conversation("B", "Thank you all for a lovely weekend"),
+        conversation("C", "Concert tonight, bring friends"),
+        conversation("D", "Thanks everyone, lovely to see you"),
+    ]
+    examples = training_examples(conversations, [["entry"], [], ["entry"], []])
+
+    model = HashedLinearModel(n_features=2**12).train(examples, epochs=30)
+    restored = HashedLinearModel.from_dict(model.to_dict())
+
+    assert restored.predict("Picnic and concert, bring friends") > 0.5
+    assert restored.predict("Thank you, lovely") < 0.5
+
+
+@pytest.mark.asyncio
+async def test_incremental_analysis_sends_only_new_messages_with_context(tmp_path):
+    from telefilters.telegram.analysis_state import local_analysis_state
+
+    def respond(**request):
+        content = user_content(request)
+        topics = [{"type": "event", "summary": "Picnic"}] if "picnic" in content else []
+        return json.dumps({"topics": topics, "context": f"Seen {content.count('user:')} messages"})
+
+    client = MockAsyncOpenAI(respond)
+    path = str(tmp_path / "analysis.json")
+    chat = conversation("Chat", "hello", "picnic on Sunday?")
+    quiet = conversation("Quiet", "hi")
+
+    first = await process._analyze_data(client, {"conversations": [chat, quiet]}, state=local_analysis_state(path))
+    assert first == ["**Chat**\n*Event*: Picnic"]
+
+    chat["messages"].append({"name": "user", "content": "see you there", "timestamp": "2024-12-01 13:00"})
+    second = await process._analyze_data(client, {"conversations": [chat, quiet]}, state=local_analysis_state(path))
+
+    assert second == []
+    assert len(client.requests) == 3
+    delta = user_content(client.requests[-1])
+    assert "Earlier context: Seen 2 messages" in delta
+    assert "see you there" in delta and "picnic" not in delta
+    assert local_analysis_state(path).get(chat).context == "Seen 1 messages"
+
+
+@pytest.mark.asyncio
+async def test_incremental_analysis_retries_messages_after_a_malformed_reply(tmp_path):
+    from telefilters.telegram.analysis_state import local_analysis_state
+
+    replies = iter(["Sorry, here is the summary: {topics", json.dumps({"topics": [], "context": "Seen"})])
+    client = MockAsyncOpenAI(lambda **request: next(replies))
+    path = str(tmp_path / "analysis.json")
+    chat = conversation("Chat", "hello", "picnic on Sunday?")
+
+    assert await process._analyze_data(client, {"conversations": [chat]}, state=local_analysis_state(path)) == []
+    assert len(local_analysis_state(path).new_messages(chat)) == 2
+
+    await process._analyze_data(client, {"conversations": [chat]}, state=local_analysis_state(path))
+
+    assert "picnic on Sunday?" in user_content(client.requests[-1])
+    assert local_analysis_state(path).new_messages(chat) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("batch_budget", [None, 3000])
+async def test_cascade_escalates_only_positive_and_uncertain_conversations(batch_budget):
+    from telefilters.telegram.cascade import Cascade
+
+    answers = {"Events": "Yes.", "Chatter": "no", "Maybe": "hmm"}
+
+    def respond(**request):
+        channel = user_content(request).split("Channel: ")[1].splitlines()[0]
+        if request["model"] == "small":
+            return answers[channel]
+        channels = [part.splitlines()[0] for part in user_content(request).split("Channel: ")[1:]]
+        if len(channels) == 1:
+            return json.dumps({"type": "event", "summary": channels[0]})
+        return json.dumps([{"id": i, "type": "event", "summary": name} for i, name in enumerate(channels)])
+
+    client = MockAsyncOpenAI(respond)
+    cascade = Cascade(classifier_model="small", summary_model="large")
+    scraped = {"conversations": [conversation(name, "Friday at 18:00") for name in answers]}
+
+    entries = await process._analyze_data(client, scraped, batch_budget=batch_budget, cascade=cascade)
+
+    assert [entry.split("**")[1] for entry in entries] == ["Events", "Maybe"]
+    assert [request["model"] for request in client.requests].count("small") == 3
+    assert (cascade.stats.classified, cascade.stats.escalated, cascade.stats.summaries) == (3, 2, 1 if batch_budget else 2)
+    assert cascade.stats.escalation_rate == pytest.approx(2 / 3)
+
+
+@pytest.mark.asyncio
+async def test_cross_posted_events_are_analyzed_once_and_listed_with_their_chats():
+    post = "Join us for the winter solstice potluck on Saturday at 18:00 in the Haus der Statistik courtyard"
+
+    def respond(**request):
+        content = user_content(request)
+        channel = content.splitlines()[0].removeprefix("Channel: ")
+        if "solstice" in content.lower():
+            return json.dumps({"type": "event", "summary": "Winter solstice potluck on Saturday at 18:00"})
+        return json.dumps({"type": "request", "summary": f"Request in {channel}"})
+
+    client = MockAsyncOpenAI(respond)
+    scraped = {"conversations": [
+        conversation("Burners", post),
+        conversation("Neighbours", "Anyone has a ladder?", post.replace("Join us", "join us!!") + " https://t.me/x"),
+        conversation("Events", post + " See you"),
+        conversation("Rave", "Solstice potluck Saturday at 18:00"),
+    ]}
+
+    entries = await process._analyze_data(client, scraped, deduplicate=True)
+
+    assert len(client.requests) == 3
+    assert entries == [
+        "**Burners**\n*Event*: Winter solstice potluck on Saturday at 18:00\n_Also in: Neighbours, Events, Rave_",
+        "**Neighbours**\n*Request*: Request in Neighbours",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_llm_calls_are_measured_and_tagged():
+    from telefilters import llm_metrics
+
+    llm_metrics.recent.clear()
+    client = MockAsyncOpenAI(_event_for_channel)
+    scraped = {"conversations": [conversation("Chat", "Meetup at 7pm")]}
+
+    await process.analyze_conversations(client, scraped)
+    await process.analyze_conversations(client, scraped)
+
+    called, cached = llm_metrics.recent
+    assert called.tags == cached.tags == {"command": "digest", "conversation": "Chat"}
+    assert (called.prompt_tokens, called.completion_tokens, called.retries, called.cache_hit) == (100, 20, 0, False)
+    assert called.cost == pytest.approx((100 * 2.50 + 20 * 10.00) / 1e6)
+    assert cached.cache_hit and cached.cost == 0.0
+
+
+async def _stream_of(conversations):
+    for item in conversations:
+        yield item
+
+
+@pytest.mark.asyncio
+async def test_stream_runs_the_digest_pipeline():
+    from telefilters import llm_metrics
+    from telefilters.telegram.prefilter import Prefilter
+
+    llm_metrics.recent.clear()
+    post = "Join us for the winter solstice potluck on Saturday at 18:00 in the Haus der Statistik courtyard"
+
+    def respond(**request):
+        content = user_content(request)
+        if "solstice" in content.lower():
+            return json.dumps({"type": "event", "summary": "Winter solstice potluck on Saturday at 18:00"})
+        return json.dumps({"type": "request", "summary": "Someone needs a ladder"})
+
+    client = MockAsyncOpenAI(respond)
+    scraped = [
+        conversation("Burners", post),
+        conversation("Chatter", "haha yes", "same"),
+        conversation("Neighbours", "Does anyone have a ladder I could borrow?", post + " https://t.me/x"),
+        conversation("Events", post + " See you"),
+    ]
+
+    entries = [
+        entry async for entry in process.analyze_conversation_stream(
+            client, _stream_of(scraped), prefilter=Prefilter(), deduplicate=True
+        )
+    ]
+
+    # Chatter is prefiltered, Events only repeats the cross-post
+    assert len(client.requests) == 2
+    assert sorted(entry.split("\n")[0] for entry in entries) == ["**Burners**", "**Neighbours**"]
+    assert all(metrics.tags["command"] == "digest" for metrics in llm_metrics.recent)
+
+
+@pytest.mark.asyncio
+async def test_stream_uses_and_saves_the_analysis_state(tmp_path):
+    from telefilters.telegram.analysis_state import local_analysis_state
+
+    client = MockAsyncOpenAI(lambda **request: json.dumps({"topics": [], "context": "Seen"}))
+    path = str(tmp_path / "analysis.json")
+    chat = conversation("Chat", "hello", "picnic on Sunday?")
+
+    async for _ in process.analyze_conversation_stream(client, _stream_of([chat]), state=local_analysis_state(path)):
+        pass
+    async for _ in process.analyze_conversation_stream(client, _stream_of([chat]), state=local_analysis_state(path)):
+        pass
+
+    assert len(client.requests) == 1
+    assert local_analysis_state(path).get(chat).context == "Seen"
+
+
+@pytest.mark.asyncio
+async def test_stream_stops_cleanly_when_the_consumer_leaves_early():
+    import asyncio
+
+    closed = asyncio.Event()
+
+    async def endless():
+        try:
+            index = 0
+            while True:
+                index += 1
+                yield conversation(f"Chat {index}", "Board game evening on Friday")
+        finally:
+            closed.set()
+
+    client = MockAsyncOpenAI(_event_for_channel, latency=0.01)
+    stream = process.analyze_conversation_stream(client, endless(), queue_size=1, workers=1)
+
+    async for _ in stream:
+        break
+    await asyncio.wait_for(stream.aclose(), 1)
+
+    assert closed.is_set()
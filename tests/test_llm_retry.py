@@ -0,0 +1,90 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from telefilters import llm, llm_cache, llm_retry
+from tests.mock_openai import MockAsyncOpenAI
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def _responses(*outcomes, latency=0.0):
+    """Call factory returning or raising the outcomes in turn"""
+    outcomes = list(outcomes)
+    calls = []
+
+    async def call():
+        calls.append(time.monotonic())
+        outcome = outcomes.pop(0)
+        await asyncio.sleep(outcome[1] if isinstance(outcome, tuple) else latency)
+        outcome = outcome[0] if isinstance(outcome, tuple) else outcome
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return call, calls
+
+
+@pytest.mark.asyncio
+async def test_retries_rate_limits_and_server_errors_honoring_retry_after():
+    call, calls = _responses(StatusError(429, {"retry-after-ms": "50"}), StatusError(503), "answer")
+    policy = llm_retry.RetryPolicy(base_delay=0.01)
+
+    assert await llm_retry.call_with_retries(call, policy) == "answer"
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.05
+
+    call, calls = _responses(StatusError(400), "answer")
+    with pytest.raises(StatusError):
+        await llm_retry.call_with_retries(call, policy)
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_takes_the_first_answer():
+    call, calls = _responses(("slow", 1.0), ("fast", 0.01))
+    policy = llm_retry.RetryPolicy(hedge=True, hedge_delay=0.05)
+
+    start = time.monotonic()
+    assert await llm_retry.call_with_retries(call, policy) == "fast"
+    assert len(calls) == 2
+    assert time.monotonic() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_deadline_cuts_calls_and_retries_short():
+    with llm_retry.deadline(0.05):
+        call, _ = _responses("late", latency=1.0)
+        with pytest.raises(llm_retry.DeadlineExceeded):
+            await llm_retry.call_with_retries(call)
+
+    with llm_retry.deadline(0.5):
+        call, calls = _responses(StatusError(429, {"retry-after": "5"}), "answer")
+        with pytest.raises(llm_retry.DeadlineExceeded):
+            await llm_retry.call_with_retries(call, llm_retry.RetryPolicy(max_delay=10))
+        assert len(calls) == 1
+
+    assert llm_retry.remaining() is None
+
+
+@pytest.mark.asyncio
+async def test_deadline_covers_reading_a_stream():
+    client = MockAsyncOpenAI(lambda **request: "word " * 20, chunk_latency=0.02)
+    messages = [{"role": "user", "content": "hi"}]
+    shown = []
+
+    with llm_retry.deadline(0.1):
+        with pytest.raises(llm_retry.DeadlineExceeded):
+            async for text in llm.stream(client, messages, model="gpt-4o-mini"):
+                shown.append(text)
+
+    assert 0 < len(shown) < 20
+    # A cut-off answer is not cached
+    assert await llm_cache.get_cache().get(llm_cache.cache_key(messages=messages, model="gpt-4o-mini")) is None
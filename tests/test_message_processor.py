@@ -1,8 +1,23 @@
+import asyncio
+import time
+
 import pytest
-from datetime import datetime
-from collections import OrderedDict
-from telegram_bot.src.processors.message_processor import process_dialogs, fetch_messages, fetch_topics_with_new_messages
-from tests.mock_telegram import MockTelegramClient
+from datetime import datetime, timedelta, timezone
+from telethon.errors import FloodWaitError
+from telefilters.telegram import records
+from telefilters.telegram.checkpoints import CheckpointStore, local_checkpoint_store
+from telefilters.telegram.dialog_index import FULL_REFRESH_INTERVAL, local_dialog_index
+from telefilters.telegram.scheduler import RequestScheduler
+from telefilters.telegram.scraper import iter_conversations, process_dialogs
+from telefilters.telegram.senders import SenderCache
+from tests.benchmark_scraper import run_benchmark
+from tests.mock_telegram import (
+    MockMessage, MockTelegramClient, build_synthetic_client, build_test_client, make_channel, make_user
+)
+
+START_DATE = datetime(2024, 3, 1, tzinfo=timezone.utc)
+END_DATE = datetime(2024, 3, 2, tzinfo=timezone.utc)
+
 
 @pytest.mark.asyncio
 async def test_message_processing():
@@ -10,65 +25,332 @@ async def test_message_processing():
     Test that we can correctly process messages from all types of chats
     """
     # Setup
-    client = MockTelegramClient()
-    end_date = datetime(2024, 3, 2)
-    start_date = datetime(2024, 3, 1)
-    
-    result = await process_dialogs(client, start_date, end_date)
+    client = build_test_client()
     
-    # Debug print
-    print("\nResult contents:")
-    for name, data in result.items():
-        print(f"{name}: {data}")
+    result = await process_dialogs(client, START_DATE, END_DATE)
+    conversations = {
+        (conversation["chat_name"], conversation.get("topic")): conversation
+        for conversation in result["conversations"]
+    }
 
-    # Verify structure and content
-    assert isinstance(result, OrderedDict)
-    
-    # Check Regular Group
-    assert "Regular Group" in result, "Regular Group not found in results"
-    regular_group = result["Regular Group"]
-    assert regular_group is not None, "Regular Group data is None"
-    assert "type" in regular_group, f"No 'type' in regular_group data: {regular_group}"
-    assert regular_group["type"] == "group", f"Expected type 'group', got {regular_group.get('type')}"
-    assert isinstance(regular_group["messages"], list), "Regular group messages should be a list"
+    # Check Regular Group, own messages are filtered
+    regular_group = conversations[("Regular Group", None)]
+    assert regular_group["type"] == "group"
+    assert [msg.content for msg in regular_group["messages"]] == [
+        "Hello from regular group",
+        "Another user's message",
+    ]
     
-    # Check Forum Group
-    assert "Forum Group" in result
-    forum_group = result["Forum Group"]
-    assert forum_group["type"] == "group"
-    assert isinstance(forum_group["messages"], dict), "Forum group messages should be a dictionary"
-    
-    # Check forum topics
-    assert "Topic 1" in forum_group["messages"], "Topic 1 not found in forum messages"
-    assert "Topic 2" in forum_group["messages"], "Topic 2 not found in forum messages"
-    
-    # Check topic messages
-    topic1_messages = forum_group["messages"]["Topic 1"]
-    assert isinstance(topic1_messages, list), "Topic messages should be a list"
-    assert len(topic1_messages) > 0, "Topic 1 should have messages"
-    assert topic1_messages[0]["name"] == "test_user"
-    assert "Forum topic 1 message" in topic1_messages[0]["content"]
+    # Check Forum Group, one conversation per topic
+    topic1 = conversations[("Forum Group", "Topic 1")]
+    assert topic1["type"] == "group"
+    assert topic1["messages"][0].name == "test_user"
+    assert "Forum topic 1 message" in topic1["messages"][0].content
+    assert ("Forum Group", "Topic 2") in conversations
     
     # Check Channel
-    assert "News Channel" in result
-    news_channel = result["News Channel"]
+    news_channel = conversations[("News Channel", None)]
     assert news_channel["type"] == "channel"
-    assert isinstance(news_channel["messages"], list), "Channel messages should be a list"
-
-    print("\nTest Results:")
-    for chat_name, chat_data in result.items():
-        print(f"\n{chat_name} ({chat_data['type']}):")
-        if chat_data['type'] == "group" and isinstance(chat_data["messages"], dict):
-            # Handle forum group messages
-            for topic_name, topic_messages in chat_data["messages"].items():
-                print(f"  Topic: {topic_name}")
-                for msg in topic_messages:
-                    print(f"    {msg['name']}: {msg['content']}")
-        else:
-            # Handle regular group and channel messages
-            if isinstance(chat_data["messages"], list):
-                for msg in chat_data["messages"]:
-                    print(f"  {msg['name']}: {msg['content']}")
+
+    # Archived dialogs are skipped
+    assert all(name != "test_user" for name, _ in conversations)
+
+    # Conversations keep the dialog order
+    assert [conversation["chat_name"] for conversation in result["conversations"]] == [
+        "Regular Group", "Forum Group", "Forum Group", "News Channel"
+    ]
+    assert result["metadata"]["total_chats_processed"] == 3
+    assert result["metadata"]["total_messages"] == 5
+
+
+@pytest.mark.asyncio
+async def test_dialogs_fetched_by_bounded_pool_in_dialog_order():
+    sequential_client = build_synthetic_client(dialogs=12, topics=0, messages=3, forum_every=0, latency=0.01)
+    concurrent_client = build_synthetic_client(dialogs=12, topics=0, messages=3, forum_every=0, latency=0.01)
+
+    sequential = await process_dialogs(sequential_client, concurrency=1)
+    concurrent = await process_dialogs(concurrent_client, concurrency=3)
+
+    assert sequential_client.peak_histories == 1
+    assert 1 < concurrent_client.peak_histories <= 3
+    assert [c["chat_name"] for c in concurrent["conversations"]] == [d.name for d in concurrent_client.dialogs]
+    assert [[m.content for m in c["messages"]] for c in concurrent["conversations"]] == [
+        [m.content for m in c["messages"]] for c in sequential["conversations"]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_inactive_forum_topics_not_fetched():
+    client = MockTelegramClient()
+    user = client.add_user(make_user(1, "test_user"))
+    forum = make_channel(200, "Forum", megagroup=True, forum=True)
+    client.add_forum(forum, {
+        "Active": [MockMessage(1, "Still talking", datetime(2024, 3, 1, 10, 0, tzinfo=timezone.utc), user)],
+        "Quiet": [MockMessage(2, "Last year", datetime(2023, 3, 1, 10, 0, tzinfo=timezone.utc), user)],
+    })
+
+    result = await process_dialogs(client, START_DATE, END_DATE)
+
+    assert client.history_reads == [(forum.id, 1)]
+    assert [c["topic"] for c in result["conversations"]] == ["Active"]
+
+
+@pytest.mark.asyncio
+async def test_busy_chat_keeps_the_newest_messages_of_the_window():
+    client = MockTelegramClient()
+    user = client.add_user(make_user(1, "test_user"))
+    group = make_channel(300, "Busy Group", megagroup=True)
+    dates = (
+        [START_DATE - timedelta(hours=20 - i) for i in range(20)]
+        + [START_DATE + timedelta(minutes=5 * i) for i in range(1, 151)]
+        + [END_DATE + timedelta(hours=i) for i in range(1, 4)]
+    )
+    client.add_dialog(group, [
+        MockMessage(i, f"Message {i}", date, user) for i, date in enumerate(dates, start=1)
+    ])
+
+    result = await process_dialogs(client, START_DATE, END_DATE)
+
+    # The 100 newest of the 150 messages in the window, in chronological order
+    assert [m.content for m in result["conversations"][0]["messages"]] == [f"Message {i}" for i in range(71, 171)]
+    # One page read back from end_date, none of the messages after it
+    assert client.messages_sent == 100
+    assert result["metadata"]["messages_fetched"] == 100
+
+
+@pytest.mark.asyncio
+async def test_checkpoints_saved_by_caller_limit_next_run(tmp_path):
+    client = build_test_client()
+    group = client.dialogs[0].entity
+    path = str(tmp_path / "checkpoints.json")
+
+    first = await process_dialogs(client, START_DATE, END_DATE, checkpoints=local_checkpoint_store(path))
+    # The analysis failed, nothing was saved and the next run fetches the same messages
+    store = local_checkpoint_store(path)
+    retry = await process_dialogs(client, START_DATE, END_DATE, checkpoints=store)
+    assert retry["metadata"]["total_messages"] == first["metadata"]["total_messages"] == 5
+
+    store.save()
+    client.messages[group.id].append(MockMessage(
+        8, "New since the last digest", datetime(2024, 3, 1, 16, 0, tzinfo=timezone.utc), client.users[1]
+    ))
+    second = await process_dialogs(client, START_DATE, END_DATE, checkpoints=local_checkpoint_store(path))
+
+    assert [[m.content for m in c["messages"]] for c in second["conversations"]] == [["New since the last digest"]]
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_older_than_the_window_does_not_hold_the_chat_back(tmp_path):
+    client = MockTelegramClient()
+    user = client.add_user(make_user(1, "test_user"))
+    group = make_channel(310, "Quiet While We Were Away", megagroup=True)
+    dates = (
+        [START_DATE - timedelta(days=10, minutes=-i) for i in range(150)]
+        + [START_DATE + timedelta(hours=i) for i in range(1, 6)]
+    )
+    client.add_dialog(group, [
+        MockMessage(i, f"Message {i}", date, user) for i, date in enumerate(dates, start=1)
+    ])
+    path = str(tmp_path / "checkpoints.json")
+    store = local_checkpoint_store(path)
+    key = CheckpointStore.dialog_key(client.dialogs[0].id)
+    store.update(key, 10)
+
+    result = await process_dialogs(client, START_DATE, END_DATE, checkpoints=store)
+
+    # The 140 messages between the checkpoint and the window are skipped, not read page by page
+    assert [m.content for m in result["conversations"][0]["messages"]] == [f"Message {i}" for i in range(151, 156)]
+    assert store.get(key) == 155
+    assert client.messages_sent < 150
+
+
+@pytest.mark.asyncio
+async def test_missing_senders_resolved_in_one_batch():
+    client = MockTelegramClient()
+    users = [client.add_user(make_user(i, f"user_{i}")) for i in range(1, 5)]
+    for index in range(3):
+        client.add_dialog(make_channel(400 + index, f"Group {index}", megagroup=True), [
+            MockMessage(i, f"Hi from {user.username}", START_DATE + timedelta(hours=i), None, from_id=user.id)
+            for i, user in enumerate(users, start=1)
+        ])
+    senders = SenderCache()
+
+    result = await process_dialogs(client, START_DATE, END_DATE, senders=senders)
+
+    # get_me, one dialog page, three histories and a single users.getUsers
+    assert client.rpc_count == 6
+    assert [m.name for m in result["conversations"][0]["messages"]] == [user.username for user in users]
+
+    rpc_before = client.rpc_count
+    await process_dialogs(client, START_DATE, END_DATE, senders=senders)
+    assert client.rpc_count - rpc_before == 5
+
+
+@pytest.mark.asyncio
+async def test_sender_lookups_stay_in_the_session_and_survive_errors():
+    client = MockTelegramClient()
+    users = [client.add_user(make_user(i, f"user_{i}")) for i in range(1, 5)]
+    client.add_dialog(make_channel(450, "Group", megagroup=True), [
+        MockMessage(i, f"Hi from {user.username}", START_DATE + timedelta(hours=i), None, from_id=user.id)
+        for i, user in enumerate(users, start=1)
+    ])
+    # Telethon would ask the server for this one on its own
+    del client.session.entities[users[2].id]
+    lookup = client.session.get_input_entity
+
+    def broken_lookup(key):
+        if key == users[3].id:
+            raise RuntimeError("Corrupt session row")
+        return lookup(key)
+
+    client.session.get_input_entity = broken_lookup
+
+    result = await process_dialogs(client, START_DATE, END_DATE, senders=SenderCache())
+
+    # get_me, one dialog page, one history and the single users.getUsers
+    assert client.rpc_count == 4
+    assert [m.name for m in result["conversations"][0]["messages"]][:2] == ["user_1", "user_2"]
+
+
+@pytest.mark.asyncio
+async def test_streamed_dialogs_are_fetched_only_ahead_of_the_consumer():
+    client = build_synthetic_client(dialogs=20, topics=0, messages=3, forum_every=0, latency=0.01)
+    stream = iter_conversations(client, concurrency=2)
+
+    await stream.__anext__()
+    await asyncio.sleep(0.1)
+
+    # Two dialogs in the window, refilled once after the first was taken
+    assert len(client.history_reads) == 3
+
+    await stream.aclose()
+    await asyncio.sleep(0.05)
+    assert client.open_histories == 0
+    assert len(client.history_reads) == 3
+
+
+@pytest.mark.asyncio
+async def test_messages_are_carried_as_compact_records():
+    client = build_test_client()
+
+    result = await process_dialogs(client, START_DATE, END_DATE)
+    first, second = result["conversations"][0]["messages"]
+
+    assert isinstance(first, records.MessageRecord)
+    assert first.timestamp == int(datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc).timestamp())
+    assert (first.id, first.sender_id) == (1, 1)
+    # Sender names are interned, equal names share one string
+    assert first.name is records.from_message(client.messages[100][0], "test_" + "user").name
+
+    converted = records.conversations_to_json(result)["conversations"][0]["messages"]
+    assert converted[1] == {"name": second.name, "content": "Another user's message", "timestamp": "2024-03-01 13:00"}
+    assert records.as_record(converted[1]) == second._replace(sender_id=None, id=None)
+
+
+@pytest.mark.asyncio
+async def test_dialog_index_lists_only_changed_dialogs(tmp_path):
+    client = build_test_client()
+    path = str(tmp_path / "dialogs.json")
+    expected = await process_dialogs(client, START_DATE, END_DATE)
+
+    client.dialogs_listed = 0
+    first = await process_dialogs(client, START_DATE, END_DATE, dialog_index=local_dialog_index(path))
+    assert client.dialogs_listed == len(client.dialogs)
+    # The index lists dialogs by last activity, the mock in insertion order
+    assert sorted((c["chat_name"], c.get("topic") or "", c["type"]) for c in first["conversations"]) == sorted(
+        (c["chat_name"], c.get("topic") or "", c["type"]) for c in expected["conversations"]
+    )
+
+    # Nothing changed: the refresh stops at the first dialog
+    client.dialogs_listed = 0
+    await process_dialogs(client, START_DATE, END_DATE, dialog_index=local_dialog_index(path))
+    assert client.dialogs_listed == 1
+
+    # A new message moves the channel to the top, the refresh stops right after it
+    channel = client.dialogs.pop(2)
+    client.messages[channel.entity.id].append(MockMessage(
+        8, "Breaking news", datetime(2024, 3, 1, 18, 0, tzinfo=timezone.utc), client.users[1]
+    ))
+    channel.date = datetime(2024, 3, 1, 18, 0, tzinfo=timezone.utc)
+    client.dialogs.insert(0, channel)
+    client.dialogs_listed = 0
+    third = await process_dialogs(client, START_DATE, END_DATE, dialog_index=local_dialog_index(path))
+    assert client.dialogs_listed == 2
+    assert third["conversations"][0]["chat_name"] == "News Channel"
+    assert [m.content for m in third["conversations"][0]["messages"]][-1] == "Breaking news"
+
+
+@pytest.mark.asyncio
+async def test_flood_wait_is_retried_and_reported():
+    expected = await process_dialogs(build_test_client(), START_DATE, END_DATE)
+    client = build_test_client()
+    iter_messages = client.iter_messages
+    flooded = []
+
+    async def flood_once(*args, **kwargs):
+        if not flooded:
+            flooded.append(True)
+            raise FloodWaitError(request=None, capture=1)
+        async for message in iter_messages(*args, **kwargs):
+            yield message
+
+    client.iter_messages = flood_once
+    result = await process_dialogs(client, START_DATE, END_DATE)
+
+    assert flooded
+    # Telethon would sleep through the FloodWait itself instead of raising it to the scheduler
+    assert client.flood_sleep_threshold == 0
+    assert result["metadata"]["total_messages"] == expected["metadata"]["total_messages"]
+    assert result["metadata"]["flood_waits"] == 1
+    assert result["metadata"]["throttled_seconds"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_throttled_time_is_wall_clock_time():
+    scheduler = RequestScheduler(max_rate=20, burst=1)
+    start = time.monotonic()
+
+    await asyncio.gather(*[scheduler.acquire() for _ in range(6)])
+
+    elapsed = time.monotonic() - start
+    # Five requests waited up to 0.25s each, side by side
+    assert 0.2 <= scheduler.stats.throttled_seconds <= elapsed
+
+
+@pytest.mark.asyncio
+async def test_dialog_index_is_rebuilt_periodically(tmp_path):
+    client = build_test_client()
+    path = str(tmp_path / "dialogs.json")
+    await process_dialogs(client, START_DATE, END_DATE, dialog_index=local_dialog_index(path))
+
+    # The account left the channel and a quiet group was renamed, an incremental refresh sees neither
+    channel = client.dialogs.pop(2)
+    client.dialogs[0].name = "Renamed Group"
+    index = local_dialog_index(path)
+    await index.refresh(client)
+    assert channel.id in index.entries
+    assert index.entries[client.dialogs[0].id].name == "Regular Group"
+
+    index.full_refreshed_at -= FULL_REFRESH_INTERVAL + 1
+    await index.refresh(client)
+
+    assert channel.id not in index.entries
+    assert index.entries[client.dialogs[0].id].name == "Renamed Group"
+    assert len(index.entries) == len(client.dialogs)
+
+
+@pytest.mark.asyncio
+async def test_benchmark_counts_messages():
+    client = build_synthetic_client(dialogs=8, topics=3, messages=5)
+
+    report = await run_benchmark(client, concurrency=4)
+
+    # 2 forums with 3 topics and 6 groups, 5 messages each
+    assert report["messages"] == (2 * 3 + 6) * 5
+    assert report["rpc_count"] == client.rpc_count
+    assert report["flood_waits"] == 0
+    assert report["peak_memory_mb"] > 0
+
 
 if __name__ == "__main__":
-    pytest.main([__file__, "-v"]) 
\ No newline at end of file
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from telefilters import prompts
+from tests.mock_openai import MockAsyncOpenAI
+
+SIGHTINGS = "14:27: u9 westhafen mit blauer weste gerade ausgestiegen\n14:57: Blauwesten u Turmstraße"
+
+
+def _respond(**request):
+    if request.get("response_format") == {"type": "json_object"}:
+        return json.dumps({"risk_level": "High", "reasons": ["14:57 controllers at U Turmstraße on the U9"]})
+    if request["max_tokens"] == 1000:
+        return "Detailed analysis of the U9 journey"
+    return "Risk: High, controllers at U Turmstraße"
+
+
+@pytest.mark.asyncio
+async def test_fast_mode_answers_in_one_structured_call():
+    client = MockAsyncOpenAI(_respond)
+
+    answer = await prompts.get_freifahren_risk_assessment(client, "U9 Leopoldplatz to Zoo", SIGHTINGS)
+
+    assert answer == "Risk: High\n- 14:57 controllers at U Turmstraße on the U9"
+    assert len(client.requests) == 1
+    assert SIGHTINGS in client.requests[0]["messages"][1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_two_stage_mode_summarizes_the_detailed_analysis():
+    client = MockAsyncOpenAI(_respond)
+
+    answer = await prompts.get_freifahren_risk_assessment(
+        client, "U9 Leopoldplatz to Zoo", SIGHTINGS, mode=prompts.TWO_STAGE
+    )
+
+    assert answer == "Risk: High, controllers at U Turmstraße"
+    assert [request["max_tokens"] for request in client.requests] == [1000, 150]
+    assert "Detailed analysis of the U9 journey" in client.requests[1]["messages"][1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_latency_is_recorded_per_mode(monkeypatch):
+    recorded = []
+
+    def record_duration(name, seconds):
+        recorded.append((name, prompts.llm_metrics._tags.get().get("mode")))
+
+    monkeypatch.setattr(prompts.llm_metrics, "record_duration", record_duration)
+
+    await prompts.get_freifahren_risk_assessment(MockAsyncOpenAI(_respond), "U9 Leopoldplatz to Zoo", SIGHTINGS)
+
+    assert recorded == [("AssessmentLatency", prompts.FAST)]
+
+
+@pytest.mark.asyncio
+async def test_streamed_answer_is_shown_progressively_and_cached():
+    answer = "Risk: High\n- 14:57 controllers at U Turmstraße on the U9"
+    client = MockAsyncOpenAI(lambda **request: answer)
+    shown = []
+
+    streamed = await prompts.get_freifahren_risk_assessment(
+        client, "U9 Leopoldplatz to Zoo", SIGHTINGS, on_text=shown.append
+    )
+
+    assert streamed == answer
+    assert client.requests[0]["stream"] is True
+    assert shown[0] == "Risk: " and shown[-1] == answer and len(shown) > 3
+
+    shown.clear()
+    assert await prompts.get_freifahren_risk_assessment(
+        client, "U9 Leopoldplatz to Zoo", SIGHTINGS, on_text=shown.append
+    ) == answer
+    assert len(client.requests) == 1 and shown == [answer]
+
+
+@pytest.mark.asyncio
+async def test_streaming_reply_throttles_edits(monkeypatch):
+    from telefilters.telegram import messaging
+
+    calls = []
+
+    async def post(bot_token, method, payload, session=None):
+        calls.append((method, payload.get("text")))
+        return {"ok": True}
+
+    monkeypatch.setattr(messaging, "_post", post)
+
+    async with messaging.StreamingReply("token", 1, 42, interval=0.05) as reply:
+        for i in range(1, 21):
+            reply.update("word " * i)
+            await asyncio.sleep(0.01)
+        await reply.finish("final answer")
+
+    edits = [text for method, text in calls if method == "editMessageText"]
+    assert ("sendChatAction", None) in calls
+    assert 2 <= len(edits) <= 6
+    assert edits[0] == "word" and edits[-1] == "final answer"
+
+
+@pytest.mark.asyncio
+async def test_streaming_reply_waits_when_the_text_is_too_long_for_one_message(monkeypatch):
+    from telefilters.telegram import messaging
+
+    edits = []
+    clock_reads = 0
+
+    async def post(bot_token, method, payload, session=None):
+        if method == "editMessageText":
+            edits.append(payload["text"])
+        return {"ok": True}
+
+    def monotonic():
+        nonlocal clock_reads
+        clock_reads += 1
+        if clock_reads > 1000:
+            raise RuntimeError("StreamingReply is spinning")
+        return time.monotonic()
+
+    monkeypatch.setattr(messaging, "_post", post)
+    monkeypatch.setattr(messaging, "time", SimpleNamespace(monotonic=monotonic))
+    text = "word " * 2000
+
+    async with messaging.StreamingReply("token", 1, 42, interval=0.01) as reply:
+        reply.update(text)
+        await asyncio.sleep(0.1)
+        await reply.finish(text)
+
+    assert clock_reads < 100
+    assert edits == [text.strip()[:messaging.MAX_MESSAGE_LENGTH]]